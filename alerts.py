@@ -0,0 +1,278 @@
+# Server side alerts before planned events. One thread sleeps on a heap of deadlines (T-5 min and T-0 of the
+# upcoming events) and only wakes up when the next deadline is due. The deadlines are re-armed from the
+# upcoming queue when the data version changes and before the armed window of the next events runs out;
+# only added or removed events touch the heap.
+#
+#   CT_TRACKER_ALERT_WEBHOOK=http://localhost:8503/alerts   POST every alert as json to this url
+#   CT_TRACKER_ALERT_SOUND=bell | "<command>"                 terminal bell or e.g. "paplay alarm.wav"
+#
+# Headless, without the app: python alerts.py --webhook http://localhost:8503/alerts
+# Local stand-in for the webhook receiver: python alerts.py --listen 8503
+import argparse
+import heapq
+import itertools
+import json
+import logging
+import os
+import shlex
+import subprocess
+import sys
+import threading
+import urllib.request
+from collections import deque
+from dataclasses import dataclass
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import streamlit as st
+import clock
+from schedule_queue import ScheduledEvent
+from storage import get_storage
+
+logger = logging.getLogger(__name__)
+
+ALERT_OFFSETS = (timedelta(minutes=5), timedelta(0))
+
+
+@dataclass(frozen=True, slots=True)
+class Alert:
+    id: int
+    event: ScheduledEvent
+    offset: timedelta
+
+    @property
+    def message(self):
+        minutes = int(self.offset.total_seconds() // 60)
+        when = f"in {minutes} min" if minutes else "now"
+        interval = f" ({self.event.interval} min interval)" if self.event.interval else ""
+        return f"{self.event.sample}: {self.event.kind}{interval} {when}"
+
+    def as_dict(self):
+        return {"id": self.id, "message": self.message, "sample": self.event.sample, "kind": self.event.kind,
+                "interval": self.event.interval, "event_time": self.event.time.isoformat(),
+                "minutes_before": int(self.offset.total_seconds() // 60)}
+
+
+class ToastSink:
+    # Keeps the latest alerts, the sessions of the app pick up the ones they have not shown yet
+    def __init__(self, maxlen=100):
+        self._alerts = deque(maxlen=maxlen)
+        self._lock = threading.Lock()
+
+    def __call__(self, alert):
+        with self._lock:
+            self._alerts.append(alert)
+
+    def latest_id(self):
+        with self._lock:
+            return self._alerts[-1].id if self._alerts else 0
+
+    def since(self, alert_id):
+        with self._lock:
+            return [alert for alert in self._alerts if alert.id > alert_id]
+
+
+class SoundSink:
+    def __init__(self, command="bell"):
+        self.command = command
+
+    def __call__(self, alert):
+        if self.command == "bell":
+            print("\a", end="", flush=True)
+        else:
+            subprocess.Popen(shlex.split(self.command), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+class WebhookSink:
+    def __init__(self, url, timeout=2):
+        self.url = url
+        self.timeout = timeout
+
+    def __call__(self, alert):
+        request = urllib.request.Request(self.url, data=json.dumps(alert.as_dict()).encode(), method="POST",
+                                         headers={"Content-Type": "application/json"})
+        with urllib.request.urlopen(request, timeout=self.timeout):
+            pass
+
+
+class AlertScheduler:
+    # Deadlines are kept in a heap of (deadline_ns, sequence, (event, offset)). Events which disappear from
+    # the plan are only dropped from the armed dict, their heap entries are skipped when they come up
+    def __init__(self, backend, sinks, offsets=ALERT_OFFSETS, horizon=100, version_check_s=5):
+        self.backend = backend
+        self.sinks = list(sinks)
+        self.offsets = offsets
+        self.horizon = horizon
+        self.version_check_s = version_check_s
+
+        self._heap = []
+        self._armed = {}
+        self._sequence = itertools.count()
+        self._alert_ids = itertools.count(1)
+        self._condition = threading.Condition()
+        self._version = None
+        self._rearm_ns = None
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name="alert-scheduler", daemon=True)
+
+    def start(self):
+        self.rearm()
+        self._thread.start()
+        return self
+
+    def stop(self):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+        self._thread.join()
+
+    def rearm(self):
+        version = self.backend.data_version()
+        now = clock.now()
+        now_ns = int(now.timestamp() * 1e9)
+        events = self.backend.query_schedule(now=now, k=self.horizon)
+        wanted = {}
+        for event in events:
+            for offset in self.offsets:
+                deadline_ns = event.time_ns - int(offset.total_seconds() * 1e9)
+                if deadline_ns > now_ns:
+                    wanted[(event, offset)] = deadline_ns
+
+        # Only the next horizon events are armed. The deadlines of later events are at least the largest offset
+        # before the last armed event, so the window is moved on a bit before that
+        rearm_ns = None
+        if len(events) >= self.horizon:
+            lead_ns = int((max(self.offsets).total_seconds() + self.version_check_s) * 1e9)
+            rearm_ns = max(events[-1].time_ns - lead_ns, now_ns + int(self.version_check_s * 1e9))
+
+        with self._condition:
+            for key in wanted.keys() - self._armed.keys():
+                heapq.heappush(self._heap, (wanted[key], next(self._sequence), key))
+            self._armed = wanted
+            self._version = version
+            self._rearm_ns = rearm_ns
+            # Discard the skipped entries once they make up most of the heap
+            if len(self._heap) > 2 * len(self._armed) + 100:
+                self._heap = [entry for entry in self._heap if self._armed.get(entry[2]) == entry[0]]
+                heapq.heapify(self._heap)
+            self._condition.notify()
+
+    def armed(self):
+        with self._condition:
+            return sorted((deadline_ns, key) for key, deadline_ns in self._armed.items())
+
+    def _pop_due(self, now_ns):
+        due = []
+        while self._heap and self._heap[0][0] <= now_ns:
+            deadline_ns, _, key = heapq.heappop(self._heap)
+            if self._armed.get(key) == deadline_ns:
+                del self._armed[key]
+                due.append(Alert(next(self._alert_ids), *key))
+        return due
+
+    def _run(self):
+        while True:
+            with self._condition:
+                if self._stopped:
+                    return
+                # Sleep until the next deadline. Writes of other processes (e.g. the api) are only noticed
+                # by the data version, which is a single row lookup
+                timeout = self.version_check_s
+                for deadline_ns in (self._heap[0][0] if self._heap else None, self._rearm_ns):
+                    if deadline_ns is not None:
+                        timeout = min(timeout, (deadline_ns - clock.now().timestamp() * 1e9) / 1e9)
+                if timeout > 0:
+                    self._condition.wait(timeout)
+                if self._stopped:
+                    return
+                now_ns = int(clock.now().timestamp() * 1e9)
+                due = self._pop_due(now_ns)
+                window_ended = self._rearm_ns is not None and now_ns >= self._rearm_ns
+
+            for alert in due:
+                self.dispatch(alert)
+
+            try:
+                if window_ended or self.backend.data_version() != self._version:
+                    self.rearm()
+            except Exception:
+                logger.exception("Re-arming the alerts failed")
+
+    def dispatch(self, alert):
+        for sink in self.sinks:
+            try:
+                sink(alert)
+            except Exception:
+                logger.exception("Alert sink %r failed for %s", sink, alert.message)
+
+
+def configured_sinks():
+    sinks = []
+    if os.environ.get("CT_TRACKER_ALERT_SOUND"):
+        sinks.append(SoundSink(os.environ["CT_TRACKER_ALERT_SOUND"]))
+    if os.environ.get("CT_TRACKER_ALERT_WEBHOOK"):
+        sinks.append(WebhookSink(os.environ["CT_TRACKER_ALERT_WEBHOOK"]))
+    return sinks
+
+
+@st.cache_resource
+def get_alert_scheduler():
+    # One scheduler per server process, shared by all sessions
+    toast_sink = ToastSink()
+    scheduler = AlertScheduler(get_storage(), [toast_sink] + configured_sinks()).start()
+    return scheduler, toast_sink
+
+
+@st.fragment(run_every="1s")
+def alert_toasts():
+    # Only reads the in-memory toast sink, the deadlines themselves are kept by the scheduler thread
+    _, toast_sink = get_alert_scheduler()
+    if "seen_alert_id" not in st.session_state:
+        st.session_state["seen_alert_id"] = toast_sink.latest_id()
+
+    for alert in toast_sink.since(st.session_state["seen_alert_id"]):
+        st.toast(alert.message, icon="⏰" if alert.offset else "🔔")
+        if alert.offset:
+            st.balloons()
+        st.session_state["seen_alert_id"] = alert.id
+
+
+class AlertReceiver(BaseHTTPRequestHandler):
+    def do_POST(self):
+        alert = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        print(f"{clock.now():%H:%M:%S} {alert.get('message')}", flush=True)
+        self.send_response(204)
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--webhook", default=os.environ.get("CT_TRACKER_ALERT_WEBHOOK"),
+                        help="POST the alerts to this url")
+    parser.add_argument("--sound", default=os.environ.get("CT_TRACKER_ALERT_SOUND"),
+                        help="'bell' or a command to play a sound")
+    parser.add_argument("--listen", type=int, help="only run a stand-in webhook receiver on this port")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    if args.listen:
+        ThreadingHTTPServer(("127.0.0.1", args.listen), AlertReceiver).serve_forever()
+        return
+
+    sinks = [lambda alert: print(f"{clock.now():%H:%M:%S} {alert.message}", flush=True)]
+    if args.sound:
+        sinks.append(SoundSink(args.sound))
+    if args.webhook:
+        sinks.append(WebhookSink(args.webhook))
+    scheduler = AlertScheduler(get_storage(), sinks).start()
+    print(f"{len(scheduler.armed())} deadlines armed", file=sys.stderr)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        scheduler.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+import numpy as np
+import streamlit as st
+import samples
+from storage import get_storage
+
+
+# Robust z-score above which an interval is flagged (Iglewicz and Hoaglin)
+OUTLIER_THRESHOLD = 3.5
+
+
+def compute_interval_stats(sag_df):
+    # Per interval durations and latencies of the wide SAG table (parsed timestamps). Everything is done
+    # column wise, no python loop over samples or intervals
+    stats_df = sag_df[["sample", "interval", "T", "t_start_target", "t_end_target", "t_start_is", "t_end_is"]].copy()
+    stats_df["step"] = stats_df.groupby("sample", sort=False).cumcount() + 1
+
+    stats_df["actual_min"] = (stats_df["t_end_is"] - stats_df["t_start_is"]).dt.total_seconds() / 60
+    stats_df["deviation_min"] = stats_df["actual_min"] - stats_df["interval"]
+    stats_df["start_latency_s"] = (stats_df["t_start_is"] - stats_df["t_start_target"]).dt.total_seconds()
+    stats_df["end_latency_s"] = (stats_df["t_end_is"] - stats_df["t_end_target"]).dt.total_seconds()
+
+    # Cumulative leaching time only counts finished intervals
+    stats_df["cumulative_leaching_min"] = stats_df["actual_min"].fillna(0).groupby(stats_df["sample"],
+                                                                                      sort=False).cumsum()
+    stats_df.loc[stats_df["actual_min"].isna(), "cumulative_leaching_min"] = np.nan
+
+    solutions = {sample: sample_info.get("solution", "-") for sample, sample_info in samples.sag_samples.items()}
+    stats_df["solution"] = stats_df["sample"].map(solutions).fillna("-")
+
+    return stats_df
+
+
+def flag_outliers(stats_df, threshold=OUTLIER_THRESHOLD):
+    # Median/MAD z-scores of the duration deviation and the start latency within each temperature
+    stats_df = stats_df.copy()
+    groups = stats_df.groupby("T", sort=False)
+    is_outlier = np.zeros(len(stats_df), dtype=bool)
+
+    for col in ("deviation_min", "start_latency_s"):
+        median = groups[col].transform("median")
+        mad = (stats_df[col] - median).abs().groupby(stats_df["T"], sort=False).transform("median")
+        z_score = 0.6745 * (stats_df[col] - median) / mad.replace(0, np.nan)
+        stats_df[f"{col}_z"] = z_score
+        is_outlier |= (z_score.abs() > threshold).to_numpy()
+
+    stats_df["outlier"] = is_outlier
+    return stats_df
+
+
+def aggregate_by_condition(stats_df):
+    # Summary per temperature and solution
+    finished_df = stats_df[stats_df["actual_min"].notna()]
+    summary_df = finished_df.groupby(["T", "solution"]).agg(
+        samples=("sample", "nunique"),
+        intervals=("actual_min", "size"),
+        mean_actual_min=("actual_min", "mean"),
+        mean_deviation_min=("deviation_min", "mean"),
+        max_abs_deviation_min=("deviation_min", lambda x: x.abs().max()),
+        median_start_latency_s=("start_latency_s", "median"),
+        p95_start_latency_s=("start_latency_s", lambda x: x.quantile(0.95)),
+        total_leaching_h=("actual_min", lambda x: x.sum() / 60),
+    )
+    if "outlier" in finished_df:
+        summary_df["outliers"] = finished_df.groupby(["T", "solution"])["outlier"].sum()
+    return summary_df.reset_index()
+
+
+def compute_campaign_analytics(sag_df):
+    stats_df = flag_outliers(compute_interval_stats(sag_df))
+    return stats_df, aggregate_by_condition(stats_df)
+
+
+@st.cache_data(max_entries=4)
+def get_campaign_analytics(version):
+    # Recomputed only when the data version changes
+    return compute_campaign_analytics(get_storage().query_history())
+
+
+def analytics_dashboard(version):
+    stats_df, summary_df = get_campaign_analytics(version)
+    if stats_df.empty or stats_df["actual_min"].notna().sum() == 0:
+        st.info("No finished intervals yet.")
+        return
+
+    st.write("##### By temperature and solution")
+    st.dataframe(summary_df.round(2), hide_index=True)
+
+    st.write("##### Cumulative leaching time")
+    st.dataframe(stats_df.groupby("sample")["cumulative_leaching_min"].max().div(60).round(2)
+                 .rename("leaching_h").reset_index(), hide_index=True)
+
+    outlier_df = stats_df[stats_df["outlier"]]
+    st.write(f"##### Outliers ({len(outlier_df)})")
+    st.dataframe(outlier_df[["sample", "step", "interval", "T", "actual_min", "deviation_min", "start_latency_s"]]
+                 .round(2), hide_index=True)
@@ -0,0 +1,167 @@
+# Headless JSON api over the data layer, so the CT acquisition software can record events without the UI.
+# Runs as a sibling process of the streamlit app on the same storage: python api.py --port 8502
+# Events are recorded through the storage backend, with campaigns into the shard of each sample.
+#
+#   GET  /version                       -> current data version
+#   GET  /schedule?k=10                 -> next k planned events of all samples
+#   POST /samples/<sample>/intervals    -> initialize the next leaching interval
+#   POST /samples/<sample>/start        -> stamp the actual leaching start ({"timestamp": ISO 8601} is optional)
+#   POST /samples/<sample>/end          -> stamp the actual leaching end
+#   POST /events                        -> bulk: {"events": [{"sample": ..., "action": "interval|start|end",
+#                                          "timestamp": ...}, ...]} in one transaction
+#
+# POST requests may carry an "Idempotency-Key" header. Retries with the same key return the stored results
+# and are not applied twice.
+import argparse
+import json
+import sqlite3
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+from zoneinfo import ZoneInfo
+import samples
+from archive import is_archived
+from storage import NothingToStampError, get_storage
+
+
+# Actions of the api and the backend action they stamp
+ACTIONS = {
+    "intervals": "interval",
+    "interval": "interval",
+    "start": "start",
+    "end": "end",
+}
+
+
+class ApiError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def parse_timestamp(value):
+    # Scanner timestamps without timezone are local lab time
+    if value is None:
+        return None
+    try:
+        timestamp = datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        raise ApiError(400, f"Invalid timestamp: {value!r}")
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=ZoneInfo("Europe/Berlin"))
+    return timestamp.astimezone(ZoneInfo("Europe/Berlin"))
+
+
+def parse_event(backend, event):
+    if not isinstance(event, dict):
+        raise ApiError(400, f"Every event must be a json object, not {event!r}")
+    # Sample names end up in the sql as table names, so only known samples are accepted
+    sample = event.get("sample")
+    if sample not in samples.sag_samples:
+        raise ApiError(404, f"Unknown sample: {sample!r}")
+    if event.get("action") not in ACTIONS:
+        raise ApiError(400, f"Unknown action: {event.get('action')!r}. Must be one of {sorted(ACTIONS)}")
+    if is_archived(sample, backend.campaign_of(sample)):
+        raise ApiError(409, f"{sample} is archived, no more events can be recorded")
+    return sample, ACTIONS[event["action"]], parse_timestamp(event.get("timestamp"))
+
+
+def apply_events(backend, events, idempotency_key=None):
+    # All events of one request are written in one transaction per db together with the idempotency key, see
+    # StorageBackend.stamp_events
+    batch = [parse_event(backend, event) for event in events]
+    try:
+        results = backend.stamp_events(batch, idempotency_key, required=True)
+    except NothingToStampError as e:
+        raise ApiError(409, str(e)) from e
+    except KeyError as e:
+        raise ApiError(404, f"{e.args[0]}, it is created when the app is opened") from e
+    except sqlite3.OperationalError as e:
+        if "no such table" in str(e).lower():
+            raise ApiError(404, "A sample of the request has no intervals yet, it is created when the app is "
+                                "opened") from e
+        raise
+    return {"results": [{"sample": event["sample"], "action": event["action"], **result}
+                        for event, result in zip(events, results)]}
+
+
+class TrackerRequestHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        try:
+            backend = self.server.backend
+            if url.path == "/version":
+                self.send_json(200, {"version": backend.data_version()})
+            elif url.path == "/schedule":
+                k = int(parse_qs(url.query).get("k", ["10"])[0])
+                events = [{**event.as_dict(), "time": event.time.isoformat()} for event in backend.query_schedule(k=k)]
+                self.send_json(200, {"version": backend.data_version(), "events": events})
+            else:
+                raise ApiError(404, f"Unknown path: {url.path}")
+        except ApiError as e:
+            self.send_json(e.status, {"error": str(e)})
+        except ValueError as e:
+            self.send_json(400, {"error": str(e)})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        parts = url.path.strip("/").split("/")
+        try:
+            body = self.read_json()
+            if len(parts) == 3 and parts[0] == "samples":
+                events = [{"sample": parts[1], "action": parts[2], "timestamp": body.get("timestamp")}]
+            elif parts == ["events"]:
+                events = body.get("events")
+                if not isinstance(events, list) or not events:
+                    raise ApiError(400, "'events' must be a non-empty list")
+            else:
+                raise ApiError(404, f"Unknown path: {url.path}")
+
+            response = apply_events(self.server.backend, events, self.headers.get("Idempotency-Key"))
+            self.send_json(200, {**response, "version": self.server.backend.data_version()})
+        except ApiError as e:
+            self.send_json(e.status, {"error": str(e)})
+        except sqlite3.OperationalError as e:
+            self.send_json(503, {"error": str(e)})
+        except Exception as e:
+            # The client always gets an answer, also for unexpected errors
+            self.log_error("%s failed: %r", url.path, e)
+            self.send_json(500, {"error": str(e)})
+
+    def read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if not length:
+            return {}
+        try:
+            body = json.loads(self.rfile.read(length))
+        except json.JSONDecodeError as e:
+            raise ApiError(400, f"Invalid json: {e}")
+        if not isinstance(body, dict):
+            raise ApiError(400, "Request body must be a json object")
+        return body
+
+    def send_json(self, status, payload):
+        data = json.dumps(payload, default=str).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def create_api_server(host="127.0.0.1", port=8502, backend=None):
+    server = ThreadingHTTPServer((host, port), TrackerRequestHandler)
+    server.backend = backend or get_storage()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8502)
+    args = parser.parse_args()
+
+    server = create_api_server(args.host, args.port)
+    print(f"CT-Tracker api listening on http://{args.host}:{args.port}")
+    server.serve_forever()
@@ -0,0 +1,85 @@
+import os
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.fs as fs
+import pyarrow.parquet as pq
+import data_handling_functions as dhf
+from data_handling_functions import (DEFAULT_CAMPAIGN, SAG_COLUMNS, SAG_TIME_COLUMNS, TIME_FORMAT, get_archive_path,
+                                     is_archived, to_utc_timestamp)
+from storage import get_storage
+
+
+# Columnar layout of an archived SAG sample. Timestamps are stored as real UTC timestamps so that
+# time range filters can be pushed down into the parquet row groups
+ARCHIVE_SCHEMA = pa.schema([
+    ("sample", pa.string()),
+    ("interval", pa.int64()),
+    ("t_start_target", pa.timestamp("us", tz="UTC")),
+    ("t_end_target", pa.timestamp("us", tz="UTC")),
+    ("t_start_is", pa.timestamp("us", tz="UTC")),
+    ("t_end_is", pa.timestamp("us", tz="UTC")),
+    ("T", pa.int64()),
+])
+
+
+def list_archived_samples(campaign=DEFAULT_CAMPAIGN):
+    # The flat files of older versions belong to the default campaign
+    campaign_dir = os.path.join(dhf.ARCHIVE_DIR, campaign)
+    file_names = os.listdir(campaign_dir) if os.path.isdir(campaign_dir) else []
+    if campaign == DEFAULT_CAMPAIGN and os.path.isdir(dhf.ARCHIVE_DIR):
+        file_names += os.listdir(dhf.ARCHIVE_DIR)
+    return sorted({file_name.removesuffix(".parquet") for file_name in file_names if file_name.endswith(".parquet")})
+
+
+def archive_sag_samples(sample_names, backend=None):
+    # Move the given SAG samples from the live storage into compressed parquet files, one directory per
+    # campaign
+    backend = backend or get_storage()
+    archived = []
+
+    for sample in sample_names:
+        sample_df = backend.bulk_export([sample])
+        if sample_df.empty:
+            continue
+
+        for col in SAG_TIME_COLUMNS:
+            sample_df[col] = pd.to_datetime(sample_df[col], format=TIME_FORMAT, errors="coerce", utc=True)
+        table = pa.Table.from_pandas(sample_df[ARCHIVE_SCHEMA.names], schema=ARCHIVE_SCHEMA,
+                                     preserve_index=False)
+
+        # Write to a temporary file first, so a crash never leaves a half written archive behind
+        archive_path = get_archive_path(sample, backend.campaign_of(sample))
+        os.makedirs(os.path.dirname(archive_path), exist_ok=True)
+        pq.write_table(table, f"{archive_path}.tmp", compression="zstd")
+        os.replace(f"{archive_path}.tmp", archive_path)
+
+        # Only remove the live intervals once the archive is safely on disk
+        backend.drop_samples([sample])
+        archived.append(sample)
+
+    return archived
+
+
+def load_archived_sag_df(sample_names=None, start=None, end=None, campaign=DEFAULT_CAMPAIGN):
+    # Memory map the archive of the campaign and only read the row groups matching the sample and time range
+    archived_samples = list_archived_samples(campaign)
+    if sample_names is not None:
+        archived_samples = [sample for sample in archived_samples if sample in sample_names]
+    if not archived_samples:
+        return pd.DataFrame(columns=SAG_COLUMNS + ["sample"])
+
+    dataset = ds.dataset([get_archive_path(sample, campaign) for sample in archived_samples], schema=ARCHIVE_SCHEMA,
+                         format="parquet", filesystem=fs.LocalFileSystem(use_mmap=True))
+
+    filter_expression = ds.field("sample").isin(archived_samples)
+    if start is not None:
+        filter_expression &= ds.field("t_end_target") >= to_utc_timestamp(start)
+    if end is not None:
+        filter_expression &= ds.field("t_start_target") <= to_utc_timestamp(end)
+
+    sag_df = dataset.to_table(columns=SAG_COLUMNS + ["sample"], filter=filter_expression).to_pandas()
+    for col in SAG_TIME_COLUMNS:
+        sag_df[col] = sag_df[col].dt.tz_convert("Europe/Berlin")
+
+    return sag_df
@@ -0,0 +1,297 @@
+# Continuous online backup of scans.sqlite. Snapshots are copied with the sqlite backup api in small page
+# steps, so the writers of the app and the api are never blocked for long. A snapshot is taken on a schedule
+# and after a number of writes, the newest generations are kept and verified with an integrity check in a
+# separate thread.
+#
+#   CT_TRACKER_BACKUP_DIR       directory of the generations (default "backups")
+#   CT_TRACKER_BACKUP_MINUTES   snapshot at least every n minutes while data changes (default 15)
+#   CT_TRACKER_BACKUP_WRITES    snapshot after n writes (default 50)
+#   CT_TRACKER_BACKUP_KEEP      generations to keep (default 24)
+#
+# Standalone: python backup.py [--now] [--restore <file>]
+import argparse
+import logging
+import os
+import queue
+import re
+import sqlite3
+import threading
+import time
+import streamlit as st
+import clock
+import data_handling_functions as dhf
+
+logger = logging.getLogger(__name__)
+
+BACKUP_DIR = os.environ.get("CT_TRACKER_BACKUP_DIR", "backups")
+BACKUP_FILE_PATTERN = re.compile(r"^scans_(\d{8}_\d{6}_\d{6})_v(\d+)\.sqlite$")
+PAGES_PER_STEP = 64
+
+
+def campaign_backup_dir(campaign, backup_dir=BACKUP_DIR):
+    return os.path.join(backup_dir, campaign)
+
+
+def backup_path(backup_dir, version):
+    return os.path.join(backup_dir, f"scans_{clock.now():%Y%m%d_%H%M%S_%f}_v{version}.sqlite")
+
+
+def copy_database(source_path, target_path, pages=PAGES_PER_STEP, sleep=0.005):
+    # Every step copies a few pages and releases the read lock again, writers can go in between. Changes
+    # during the copy restart it, so the snapshot is always consistent
+    source = sqlite3.connect(source_path)
+    target = sqlite3.connect(target_path)
+    try:
+        source.backup(target, pages=pages, sleep=sleep)
+    finally:
+        target.close()
+        source.close()
+
+
+def database_version(db_path):
+    # Read only, a db which is gone (e.g. a deleted campaign) must not be created again
+    if not os.path.exists(db_path):
+        return 0
+    connection = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        row = connection.execute("SELECT version FROM data_versions WHERE name = '_all'").fetchone()
+    except sqlite3.OperationalError:
+        row = None
+    finally:
+        connection.close()
+    return row[0] if row else 0
+
+
+def snapshot(db_path=None, backup_dir=BACKUP_DIR):
+    db_path = db_path or dhf.DB_PATH
+    os.makedirs(backup_dir, exist_ok=True)
+    path = backup_path(backup_dir, database_version(db_path))
+    tmp_path = f"{path}.tmp"
+    copy_database(db_path, tmp_path)
+    os.replace(tmp_path, path)
+    return path
+
+
+def verify(path):
+    # The result is kept next to the generation, "ok" or the first reported problem
+    connection = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        rows = connection.execute("PRAGMA integrity_check").fetchall()
+        result = "ok" if rows == [("ok",)] else "; ".join(row[0] for row in rows[:5])
+    except sqlite3.DatabaseError as e:
+        result = str(e)
+    finally:
+        connection.close()
+    with open(f"{path}.check", "w") as file:
+        file.write(result)
+    return result
+
+
+def list_backups(backup_dir=BACKUP_DIR):
+    # Newest generation first
+    if not os.path.isdir(backup_dir):
+        return []
+    backups = []
+    for file_name in os.listdir(backup_dir):
+        match = BACKUP_FILE_PATTERN.match(file_name)
+        if not match:
+            continue
+        path = os.path.join(backup_dir, file_name)
+        check_path = f"{path}.check"
+        check = open(check_path).read() if os.path.exists(check_path) else None
+        backups.append({"path": path, "created": time.strptime(match[1][:15], "%Y%m%d_%H%M%S"),
+                        "stamp": match[1], "version": int(match[2]), "size": os.path.getsize(path),
+                        "check": check})
+    return sorted(backups, key=lambda backup: backup["stamp"], reverse=True)
+
+
+def list_campaign_backups(backup_dir=BACKUP_DIR):
+    # With campaigns every campaign keeps its generations in a subdirectory, also after it was deleted
+    if not os.path.isdir(backup_dir):
+        return []
+    campaign_dirs = {name: campaign_backup_dir(name, backup_dir) for name in sorted(os.listdir(backup_dir))
+                     if os.path.isdir(campaign_backup_dir(name, backup_dir))}
+    return [{**backup, "campaign": name} for name, path in campaign_dirs.items() for backup in list_backups(path)]
+
+
+def rotate(backup_dir=BACKUP_DIR, keep=24):
+    for backup in list_backups(backup_dir)[keep:]:
+        for path in (backup["path"], f"{backup['path']}.check"):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def restore(path, db_path=None, backup_dir=BACKUP_DIR):
+    # Point in time restore into the live database. The current state is saved as a generation first.
+    # Afterwards every version is moved past both the current and the restored one, so no cache keyed by
+    # a version mistakes the restored data for data it has already seen
+    db_path = db_path or dhf.DB_PATH
+    if verify(path) != "ok":
+        raise sqlite3.DatabaseError(f"{os.path.basename(path)} failed the integrity check")
+    safety_path = snapshot(db_path, backup_dir) if os.path.exists(db_path) else None
+
+    connection = dhf.establish_db_connection(db_path)
+    current_versions = dict(connection.execute("SELECT name, version FROM data_versions").fetchall())
+    source = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        source.backup(connection, pages=PAGES_PER_STEP)
+    finally:
+        source.close()
+
+    cursor = connection.cursor()
+    cursor.execute("BEGIN IMMEDIATE")
+    cursor.execute("CREATE TABLE IF NOT EXISTS data_versions (name TEXT PRIMARY KEY, version INTEGER NOT NULL)")
+    restored_versions = dict(cursor.execute("SELECT name, version FROM data_versions").fetchall())
+    dhf.advance_data_versions(cursor, current_versions, restored_versions)
+    connection.commit()
+    connection.close()
+    return safety_path
+
+
+class BackupService:
+    # Checks the data version every few seconds. A snapshot is taken when enough writes piled up or when
+    # the last snapshot is too old and anything changed since
+    def __init__(self, db_path=None, backup_dir=BACKUP_DIR, interval_minutes=15, every_writes=50, keep=24,
+                 check_s=5):
+        self.db_path = db_path or dhf.DB_PATH
+        self.backup_dir = backup_dir
+        self.interval_s = interval_minutes * 60
+        self.every_writes = every_writes
+        self.keep = keep
+        self.check_s = check_s
+        self.last_error = None
+
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._verify_queue = queue.Queue()
+        backups = list_backups(backup_dir)
+        self._last_version = backups[0]["version"] if backups else None
+        self._last_time = time.monotonic()
+        self._threads = [threading.Thread(target=self._run, name="backup", daemon=True),
+                         threading.Thread(target=self._verify, name="backup-verify", daemon=True)]
+
+    def start(self):
+        for thread in self._threads:
+            thread.start()
+        # Generations of an earlier run which were never checked
+        for backup in list_backups(self.backup_dir):
+            if backup["check"] is None:
+                self._verify_queue.put(backup["path"])
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._verify_queue.put(None)
+        for thread in self._threads:
+            thread.join()
+
+    def backup_now(self):
+        with self._lock:
+            path = snapshot(self.db_path, self.backup_dir)
+            self._last_version = int(BACKUP_FILE_PATTERN.match(os.path.basename(path))[2])
+            self._last_time = time.monotonic()
+            rotate(self.backup_dir, self.keep)
+        self._verify_queue.put(path)
+        return path
+
+    def is_due(self, version):
+        if version == self._last_version or not os.path.exists(self.db_path):
+            return False
+        if self._last_version is None or version < self._last_version:
+            return True
+        return (version - self._last_version >= self.every_writes
+                or time.monotonic() - self._last_time >= self.interval_s)
+
+    def _run(self):
+        while not self._stop.wait(self.check_s):
+            try:
+                if os.path.exists(self.db_path) and self.is_due(database_version(self.db_path)):
+                    self.backup_now()
+                self.last_error = None
+            except Exception as e:
+                self.last_error = e
+                logger.exception("Backup failed")
+
+    def _verify(self):
+        # Off the hot path: the integrity check reads the whole file
+        while (path := self._verify_queue.get()) is not None:
+            if os.path.exists(path):
+                result = verify(path)
+                if result != "ok":
+                    logger.error("Backup %s failed the integrity check: %s", path, result)
+
+
+# Running services by (db_path, backup_dir), so the one of a deleted database can be stopped
+_services = {}
+
+
+@st.cache_resource
+def get_backup_service(db_path=None, backup_dir=BACKUP_DIR):
+    # One service per database, e.g. per campaign shard
+    service = BackupService(db_path, backup_dir,
+                            interval_minutes=float(os.environ.get("CT_TRACKER_BACKUP_MINUTES", 15)),
+                            every_writes=int(os.environ.get("CT_TRACKER_BACKUP_WRITES", 50)),
+                            keep=int(os.environ.get("CT_TRACKER_BACKUP_KEEP", 24))).start()
+    _services[(db_path, backup_dir)] = service
+    return service
+
+
+def stop_backup_service(db_path=None, backup_dir=BACKUP_DIR):
+    # Stops the service of the database and drops it from the cache, the next get_backup_service starts a new one
+    service = _services.pop((db_path, backup_dir), None)
+    if service:
+        service.stop()
+    get_backup_service.clear(db_path, backup_dir)
+
+
+@st.dialog("Restore Backup")
+def restore_dialog(backend=None):
+    # The generations of the campaigns are restored into their shards by the sharded backend
+    backups = list_campaign_backups() if hasattr(backend, "restore_campaign") else list_backups()
+    if not backups:
+        st.info("No backups yet.")
+        return
+
+    by_path = {backup["path"]: backup for backup in backups}
+    labels = {backup["path"]: f"{backup['campaign'] + ' - ' if 'campaign' in backup else ''}"
+                              f"{time.strftime('%d.%m.%Y %H:%M:%S', backup['created'])} - version "
+                              f"{backup['version']} - {backup['size'] / 1e6:.1f} MB - "
+                              f"{'verified' if backup['check'] == 'ok' else backup['check'] or 'not verified yet'}"
+              for backup in backups}
+    path = st.selectbox("Restore the state of", options=list(labels), format_func=labels.get)
+    st.warning("The current data is replaced. It is saved as a new backup before.")
+    if st.button("Restore", type="primary", use_container_width=True):
+        try:
+            if "campaign" in by_path[path]:
+                backend.restore_campaign(by_path[path]["campaign"], path)
+            else:
+                restore(path)
+        except sqlite3.DatabaseError as e:
+            st.error(e)
+            return
+        st.rerun()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--now", action="store_true", help="take one snapshot and exit")
+    parser.add_argument("--restore", help="restore this generation into the live database")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    if args.restore:
+        print(f"Restored {args.restore}, the previous state was saved to {restore(args.restore)}")
+    elif args.now:
+        path = snapshot()
+        print(f"{path}: {verify(path)}")
+        rotate(keep=int(os.environ.get("CT_TRACKER_BACKUP_KEEP", 24)))
+    else:
+        service = get_backup_service()
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            service.stop()
+
+
+if __name__ == "__main__":
+    main()
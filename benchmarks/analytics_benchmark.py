@@ -0,0 +1,64 @@
+# Times the campaign analytics on synthetic SAG data. Run from the repo root:
+# python benchmarks/analytics_benchmark.py --samples 1000
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import samples
+from analytics import compute_campaign_analytics
+
+
+def synthetic_sag_df(n_samples, seed=0):
+    # Every sample runs the interval profile of sample20 with random operator delays
+    rng = np.random.default_rng(seed)
+    template = samples.sag_samples["sample20"]
+    intervals = np.tile(template["intervals"], n_samples)
+    temperatures = np.tile(template["T"], n_samples)
+    sample_names = np.repeat([f"bench{i}" for i in range(n_samples)], len(template["intervals"]))
+
+    start_latency = pd.to_timedelta(rng.gamma(2, 20, len(intervals)), unit="s")
+    duration = pd.to_timedelta(intervals * 60 + rng.normal(30, 20, len(intervals)), unit="s")
+    gap = pd.to_timedelta(rng.uniform(60, 300, len(intervals)), unit="s")
+
+    # Each interval starts after the actual end of the previous one of the same sample
+    step_time = pd.Series((duration + start_latency + gap).total_seconds()).groupby(sample_names).cumsum()
+    t_start_target = (pd.Timestamp("2025-06-10 08:00", tz="Europe/Berlin")
+                      + pd.to_timedelta(step_time.to_numpy(), unit="s") - duration - start_latency - gap)
+
+    return pd.DataFrame({
+        "interval": intervals,
+        "t_start_target": t_start_target,
+        "t_end_target": t_start_target + pd.to_timedelta(intervals, unit="min"),
+        "t_start_is": t_start_target + start_latency,
+        "t_end_is": t_start_target + start_latency + duration,
+        "T": temperatures,
+        "sample": sample_names,
+    })
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--samples", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    sag_df = synthetic_sag_df(args.samples)
+    timings = []
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        stats_df, summary_df = compute_campaign_analytics(sag_df)
+        timings.append(time.perf_counter() - start)
+
+    print(f"samples: {args.samples}, intervals: {len(sag_df)}, outliers: {int(stats_df['outlier'].sum())}")
+    print(f"compute_campaign_analytics: best {min(timings) * 1000:.1f} ms, median {np.median(timings) * 1000:.1f} ms")
+    print(summary_df.round(2).to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
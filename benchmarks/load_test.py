@@ -0,0 +1,179 @@
+# Load test of the shared scans.sqlite with many simulated sessions. Every session loops over the data layer
+# like an open tab does: reads (countdown refresh, i.e. data version + upcoming events) and, with the given
+# ratio, writes (stamp events of a random sample). Run from the repo root:
+#
+#   python benchmarks/load_test.py --sessions 1 2 5 10 20 50 100 --mode threads --write-ratio 0.05
+#   python benchmarks/load_test.py --sessions 1 5 20 --mode processes --duration 10 --csv scaling.csv
+#   python benchmarks/load_test.py --sessions 1 5 --mode apptest
+#
+# Reported per step: throughput, p50/p99 latencies of reads and writes and the "database is locked" errors.
+import argparse
+import csv
+import multiprocessing
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import samples
+import data_handling_functions as dhf
+from catalog import SagSample
+from storage import SQLiteBackend
+
+N_SAMPLES = 20
+N_INTERVALS = 2000
+SAMPLE_NAMES = [f"load{i}" for i in range(N_SAMPLES)]
+
+
+def register_samples():
+    # Long synthetic samples, so the writers never run out of open intervals
+    for sample in SAMPLE_NAMES:
+        samples.sag_samples[sample] = SagSample(sample, intervals=(10,) * N_INTERVALS, T=(80,) * N_INTERVALS)
+
+
+def prepare_db(db_path):
+    dhf.DB_PATH = db_path
+    register_samples()
+    SQLiteBackend().seed_samples(SAMPLE_NAMES)
+
+
+def run_session(db_path, duration, write_ratio, seed, backend=None):
+    # One simulated session. Returns the latencies of reads and writes and the number of lock errors.
+    # Sessions of one streamlit process share the backend (st.cache_resource), separate processes do not
+    dhf.DB_PATH = db_path
+    register_samples()
+    backend = backend or SQLiteBackend()
+    backend.query_schedule(k=10)
+    rng = random.Random(seed)
+    reads, writes = [], []
+    locked = 0
+    other_errors = 0
+
+    stop_at = time.perf_counter() + duration
+    while time.perf_counter() < stop_at:
+        is_write = rng.random() < write_ratio
+        start = time.perf_counter()
+        try:
+            if is_write:
+                backend.stamp_event(rng.choice(SAMPLE_NAMES), rng.choice(("interval", "start", "end")))
+            else:
+                backend.data_version()
+                backend.query_schedule(k=10)
+        except sqlite3.OperationalError as e:
+            if "locked" in str(e):
+                locked += 1
+            else:
+                other_errors += 1
+            continue
+        (writes if is_write else reads).append(time.perf_counter() - start)
+
+    return reads, writes, locked, other_errors
+
+
+def run_session_args(args):
+    return run_session(*args)
+
+
+def run_apptest_session(duration, write_ratio, seed):
+    # A full streamlit script run per iteration, clicking one of the buttons for writes
+    from streamlit.testing.v1 import AppTest
+
+    app_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "ct_tracker.py")
+    rng = random.Random(seed)
+    app_test = AppTest.from_file(app_path, default_timeout=60)
+    app_test.run()
+    reads, writes = [], []
+    locked = 0
+    other_errors = 0
+
+    stop_at = time.perf_counter() + duration
+    while time.perf_counter() < stop_at:
+        is_write = rng.random() < write_ratio
+        start = time.perf_counter()
+        if is_write:
+            app_test.button[rng.randrange(6)].click()
+        app_test.run()
+        errors = [str(exception.value) for exception in app_test.exception]
+        locked += sum("locked" in error for error in errors)
+        other_errors += sum("locked" not in error for error in errors)
+        (writes if is_write else reads).append(time.perf_counter() - start)
+
+    return reads, writes, locked, other_errors
+
+
+def run_step(n_sessions, mode, duration, write_ratio, seed):
+    db_path = os.path.join(tempfile.mkdtemp(), "scans.sqlite")
+    session_args = [(db_path, duration, write_ratio, seed + i) for i in range(n_sessions)]
+
+    start = time.perf_counter()
+    if mode == "processes":
+        prepare_db(db_path)
+        with multiprocessing.get_context("spawn").Pool(n_sessions) as pool:
+            results = pool.map(run_session_args, session_args)
+    elif mode == "apptest":
+        # The app reads CT_TRACKER_DB when data_handling_functions is imported
+        os.environ["CT_TRACKER_DB"] = db_path
+        dhf.DB_PATH = db_path
+        with ThreadPoolExecutor(n_sessions) as executor:
+            results = list(executor.map(lambda i: run_apptest_session(duration, write_ratio, seed + i),
+                                        range(n_sessions)))
+    else:
+        prepare_db(db_path)
+        backend = SQLiteBackend()
+        with ThreadPoolExecutor(n_sessions) as executor:
+            results = list(executor.map(lambda args: run_session(*args, backend=backend), session_args))
+    elapsed = time.perf_counter() - start
+
+    reads = np.concatenate([np.asarray(result[0]) for result in results]) * 1000
+    writes = np.concatenate([np.asarray(result[1]) for result in results]) * 1000
+    percentile = lambda values, q: float(np.percentile(values, q)) if len(values) else float("nan")
+
+    return {
+        "sessions": n_sessions,
+        "ops_per_s": (len(reads) + len(writes)) / elapsed,
+        "writes_per_s": len(writes) / elapsed,
+        "read_p50_ms": percentile(reads, 50),
+        "read_p99_ms": percentile(reads, 99),
+        "write_p50_ms": percentile(writes, 50),
+        "write_p99_ms": percentile(writes, 99),
+        "locked_errors": sum(result[2] for result in results),
+        "other_errors": sum(result[3] for result in results),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sessions", type=int, nargs="+", default=[1, 2, 5, 10, 20, 50, 100])
+    parser.add_argument("--mode", choices=["threads", "processes", "apptest"], default="threads")
+    parser.add_argument("--duration", type=float, default=5, help="seconds per step")
+    parser.add_argument("--write-ratio", type=float, default=0.05)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--csv", help="write the scaling curve to this file")
+    args = parser.parse_args()
+
+    rows = []
+    print(f"{'sessions':>8} {'ops/s':>9} {'writes/s':>9} {'read p50':>9} {'read p99':>9} "
+          f"{'write p50':>10} {'write p99':>10} {'locked':>7} {'errors':>7}")
+    for n_sessions in args.sessions:
+        row = run_step(n_sessions, args.mode, args.duration, args.write_ratio, args.seed)
+        rows.append(row)
+        print(f"{row['sessions']:>8} {row['ops_per_s']:>9.1f} {row['writes_per_s']:>9.1f} "
+              f"{row['read_p50_ms']:>7.2f}ms {row['read_p99_ms']:>7.2f}ms {row['write_p50_ms']:>8.2f}ms "
+              f"{row['write_p99_ms']:>8.2f}ms {row['locked_errors']:>7} {row['other_errors']:>7}", flush=True)
+
+    if args.csv:
+        with open(args.csv, "w", newline="") as file:
+            writer = csv.DictWriter(file, fieldnames=list(rows[0]))
+            writer.writeheader()
+            writer.writerows(rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+# Compares the per-session memory of the old session_state copies (total_sag_df + long_sag_df) with the
+# shared event store. The allocations of one session rerun are traced with tracemalloc: the peak while the
+# rerun builds its frames and what the session keeps afterwards.
+# Run from the repo root: python benchmarks/memory_benchmark.py --samples 200 --sessions 30
+import argparse
+import gc
+import os
+import sys
+import tempfile
+import tracemalloc
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+import pyarrow as pa
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ["CT_TRACKER_DB"] = os.path.join(tempfile.mkdtemp(), "scans.sqlite")
+
+import samples
+import data_handling_functions as dhf
+from event_store import EventStore
+
+
+def seed_samples(n_samples):
+    # Synthetic SAG samples with the interval profile of sample20, fully planned and tracked
+    template = samples.sag_samples["sample20"]
+    sample_names = [f"bench{i}" for i in range(n_samples)]
+    start_time = datetime(2025, 6, 10, 8, 0, tzinfo=ZoneInfo("Europe/Berlin"))
+    time_format = dhf.TIME_FORMAT
+
+    for sample in sample_names:
+        samples.sag_samples[sample] = template
+        dhf.create_new_sag_in_db(sample)
+
+        rows = []
+        t = start_time
+        for rowid, interval in enumerate(template["intervals"], start=1):
+            end = t + timedelta(minutes=interval)
+            rows.append((t.strftime(time_format), end.strftime(time_format),
+                         (t + timedelta(seconds=40)).strftime(time_format),
+                         (end + timedelta(seconds=70)).strftime(time_format), rowid))
+            t = end + timedelta(minutes=2)
+
+        connection = dhf.establish_db_connection()
+        connection.executemany(f"""
+            UPDATE {sample} SET t_start_target = ?, t_end_target = ?, t_start_is = ?, t_end_is = ?
+            WHERE ROWID = ?""", rows)
+        connection.commit()
+        connection.close()
+
+    return sample_names
+
+
+def trace_rerun(session_rerun):
+    # Returns what the session keeps, the bytes still held by it and the peak during the rerun. The string
+    # columns of pandas live in arrow buffers, which tracemalloc does not see, so they are counted separately
+    gc.collect()
+    arrow_before = pa.total_allocated_bytes()
+    tracemalloc.start()
+    kept = session_rerun()
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    arrow_retained = pa.total_allocated_bytes() - arrow_before
+    return kept, retained + arrow_retained, peak + arrow_retained
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--samples", type=int, default=200)
+    parser.add_argument("--sessions", type=int, default=30)
+    args = parser.parse_args()
+
+    sample_names = seed_samples(args.samples)
+
+    # Old layout: every session reads the wide frame, builds the long one and keeps both in session_state
+    def old_rerun():
+        total_sag_df = dhf.get_total_sag_df(sample_names)
+        return total_sag_df, dhf.format_sag_df(total_sag_df.copy())
+
+    # New layout: one store for the process. A rerun builds the long frame for the plot from it and the
+    # session only keeps the version number
+    store = EventStore.from_frames(1, dhf.get_total_sag_df(sample_names))
+
+    def new_rerun():
+        long_sag_df = store.to_long_df(sample_names)
+        return store.version if len(long_sag_df) else None
+
+    _, old_retained, old_peak = trace_rerun(old_rerun)
+    _, new_retained, new_peak = trace_rerun(new_rerun)
+
+    print(f"samples: {args.samples}, events: {len(store)}, sessions: {args.sessions}")
+    print(f"session_state copies: {old_retained / 1e6:8.2f} MB kept per session, {old_peak / 1e6:8.2f} MB peak "
+          f"per rerun, {old_retained * args.sessions / 1e6:8.2f} MB total")
+    print(f"shared event store:   {new_retained / 1e6:8.2f} MB kept per session, {new_peak / 1e6:8.2f} MB peak "
+          f"per rerun, {(store.nbytes + new_retained * args.sessions) / 1e6:8.2f} MB total "
+          f"({store.nbytes / 1e6:.2f} MB shared)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+import json
+import os
+import threading
+import tomllib
+from dataclasses import dataclass
+import yaml
+
+
+class CatalogError(ValueError):
+    pass
+
+
+class RecordAccess:
+    # Records can still be read like the former sample dicts, e.g. sample_info["T"]
+    __slots__ = ()
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def __contains__(self, key):
+        return hasattr(self, key)
+
+    def get(self, key, default=None):
+        return getattr(self, key, default)
+
+
+@dataclass(frozen=True, slots=True)
+class PlanSample(RecordAccess):
+    name: str
+    T: str
+    solution: str
+    profile: str
+    duration: int
+    initial_repetitions: int = 1
+
+
+@dataclass(frozen=True, slots=True)
+class SagSample(RecordAccess):
+    # No interval offsets are precomputed: the planned times are only set when an interval is initialized, so
+    # intervals never run back to back from a fixed start
+    name: str
+    intervals: tuple
+    T: tuple
+    solution: str | None = None
+    profile: str | None = None
+
+
+def read_catalog_file(path):
+    extension = os.path.splitext(path)[1].lower()
+    try:
+        with open(path, "rb") as file:
+            if extension in (".yaml", ".yml"):
+                return yaml.safe_load(file) or {}
+            if extension == ".toml":
+                return tomllib.load(file)
+            if extension == ".json":
+                return json.load(file)
+    except (yaml.YAMLError, tomllib.TOMLDecodeError, json.JSONDecodeError) as e:
+        raise CatalogError(f"{path} could not be parsed: {e}") from e
+    except OSError as e:
+        raise CatalogError(f"{path} could not be read: {e}") from e
+    raise CatalogError(f"Unsupported catalog format: {extension}. Use .yaml, .toml or .json")
+
+
+def require(condition, message):
+    if not condition:
+        raise CatalogError(message)
+
+
+def is_int(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def parse_plan_sample(name, definition):
+    require(isinstance(definition, dict), f"samples.{name} must be a table")
+    definition = dict(definition)
+
+    # Old definitions used the misspelled key
+    if "inital_repetitions" in definition:
+        definition.setdefault("initial_repetitions", definition.pop("inital_repetitions"))
+
+    unknown = set(definition) - {"T", "solution", "profile", "duration", "initial_repetitions"}
+    require(not unknown, f"samples.{name} has unknown keys: {sorted(unknown)}")
+    for key in ("T", "solution", "profile"):
+        require(isinstance(definition.get(key), str), f"samples.{name}.{key} must be a string")
+    require(is_int(definition.get("duration")) and definition["duration"] > 0,
+            f"samples.{name}.duration must be a positive integer (hours)")
+    require(is_int(definition.get("initial_repetitions", 1)) and definition.get("initial_repetitions", 1) > 0,
+            f"samples.{name}.initial_repetitions must be a positive integer")
+
+    return PlanSample(name=name, **definition)
+
+
+def parse_sag_sample(name, definition):
+    require(isinstance(definition, dict), f"sag_samples.{name} must be a table")
+    unknown = set(definition) - {"intervals", "T", "solution", "profile"}
+    require(not unknown, f"sag_samples.{name} has unknown keys: {sorted(unknown)}")
+
+    intervals = definition.get("intervals")
+    temperatures = definition.get("T")
+    require(isinstance(intervals, list) and intervals and all(is_int(i) and i > 0 for i in intervals),
+            f"sag_samples.{name}.intervals must be a non-empty list of positive integers (minutes)")
+    require(isinstance(temperatures, list) and all(is_int(T) for T in temperatures),
+            f"sag_samples.{name}.T must be a list of integers (°C)")
+    require(len(intervals) == len(temperatures),
+            f"sag_samples.{name}: intervals and T must have the same length "
+            f"({len(intervals)} != {len(temperatures)})")
+    for key in ("solution", "profile"):
+        require(definition.get(key) is None or isinstance(definition[key], str),
+                f"sag_samples.{name}.{key} must be a string")
+
+    return SagSample(name=name, intervals=tuple(intervals), T=tuple(temperatures),
+                     solution=definition.get("solution"), profile=definition.get("profile"))
+
+
+def parse_catalog(data):
+    require(isinstance(data, dict), "The catalog must be a table with 'samples' and 'sag_samples'")
+    unknown = set(data) - {"samples", "sag_samples"}
+    require(not unknown, f"Unknown top level keys in the catalog: {sorted(unknown)}")
+
+    plan_samples = {name: parse_plan_sample(name, definition)
+                    for name, definition in (data.get("samples") or {}).items()}
+    sag_samples = {name: parse_sag_sample(name, definition)
+                   for name, definition in (data.get("sag_samples") or {}).items()}
+
+    # Sample names are used as table and column names in the db
+    for name in list(plan_samples) + list(sag_samples):
+        require(name.isidentifier(), f"Invalid sample name: {name!r}. Use letters, digits and underscores")
+    require(not set(plan_samples) & set(sag_samples),
+            f"Samples defined twice: {sorted(set(plan_samples) & set(sag_samples))}")
+
+    return plan_samples, sag_samples
+
+
+class Catalog:
+    # Holds the compiled records. The dicts are updated in place, so modules keeping a reference
+    # (samples.samples, samples.sag_samples) always see the current definitions
+    def __init__(self, path):
+        self.path = path
+        self.samples = {}
+        self.sag_samples = {}
+        self._mtime = None
+        self._lock = threading.Lock()
+        self.reload_if_changed()
+
+    def reload_if_changed(self):
+        # Returns the names of the samples whose definition changed since the last load
+        # Editors replace the file on save, for a moment it may not exist
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError as e:
+            raise CatalogError(f"{self.path} could not be read: {e}") from e
+        if mtime == self._mtime:
+            return set()
+
+        with self._lock:
+            if mtime == self._mtime:
+                return set()
+            plan_samples, sag_samples = parse_catalog(read_catalog_file(self.path))
+
+            changed = set()
+            for current, new in ((self.samples, plan_samples), (self.sag_samples, sag_samples)):
+                changed |= {name for name in set(current) | set(new) if current.get(name) != new.get(name)}
+                current.update(new)
+                for name in set(current) - set(new):
+                    del current[name]
+
+            self._mtime = mtime
+            return changed
@@ -0,0 +1,55 @@
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+
+
+TIMEZONE = ZoneInfo("Europe/Berlin")
+
+
+class SystemClock:
+    def now(self):
+        return datetime.now(TIMEZONE)
+
+
+class SimulatedClock:
+    # Only moves when it is told to, e.g. by the replay engine
+    def __init__(self, start=None):
+        self._now = (start or datetime.now(TIMEZONE)).astimezone(TIMEZONE)
+        self._lock = threading.Lock()
+
+    def now(self):
+        with self._lock:
+            return self._now
+
+    def set(self, timestamp):
+        with self._lock:
+            if timestamp < self._now:
+                raise ValueError(f"The clock cannot go back from {self._now} to {timestamp}")
+            self._now = timestamp.astimezone(TIMEZONE)
+
+    def advance(self, delta):
+        self.set(self.now() + (delta if isinstance(delta, timedelta) else timedelta(seconds=delta)))
+
+
+# Everything asks this module for the current time instead of calling datetime.now directly
+_clock = SystemClock()
+
+
+def now():
+    return _clock.now()
+
+
+def set_clock(clock):
+    global _clock
+    previous, _clock = _clock, clock
+    return previous
+
+
+@contextmanager
+def use_clock(clock):
+    previous = set_clock(clock)
+    try:
+        yield clock
+    finally:
+        set_clock(previous)
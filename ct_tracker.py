@@ -2,20 +2,50 @@ import numpy as np
 import streamlit as st
 import pandas as pd
 import plotly.express as px
-from datetime import datetime, timedelta
-from zoneinfo import ZoneInfo
+from datetime import timedelta
 from data_handling_functions import *
+import clock
+from archive import archive_sag_samples, list_archived_samples, load_archived_sag_df
+from storage import ShardedBackend, SQLiteBackend, get_storage
+from shards import campaign_controls
+from telemetry import add_telemetry_overlay
+from analytics import analytics_dashboard
+from alerts import alert_toasts
+from reports import report_builder
+from backup import campaign_backup_dir, get_backup_service, restore_dialog
 import gspread
 from oauth2client.service_account import ServiceAccountCredentials
-from samples import samples
+from samples import catalog
+from catalog import CatalogError
 import streamlit_authenticator as stauth
 import yaml
 from yaml.loader import SafeLoader
 
 st.set_page_config(layout="wide")
 
-create_new_sag_in_db("sample20")
-create_new_sag_in_db("sample21")
+backend = get_storage()
+
+# Snapshots of scans.sqlite in the background, see backup.py. With campaigns the shard of the active campaign
+# is backed up, the services of campaigns which were active before keep running
+if isinstance(backend, SQLiteBackend):
+    get_backup_service()
+elif isinstance(backend, ShardedBackend):
+    active_campaign = backend.catalog.active_campaign()
+    get_backup_service(backend.catalog.shard_path(active_campaign), campaign_backup_dir(active_campaign))
+
+# Pick up edits of samples.yaml and reschedule only the samples whose definition changed
+try:
+    changed_samples = catalog.reload_if_changed()
+except CatalogError as e:
+    st.error(f"The sample catalog could not be loaded, the previous definitions are kept: {e}")
+    changed_samples = set()
+if changed_samples:
+    backend.reschedule_samples(changed_samples)
+
+backend.seed_samples(["sample20", "sample21"])
+# Archived samples have no live intervals anymore, their controls are disabled
+archive_campaign = backend.active_campaign()
+archived_samples = set(list_archived_samples(archive_campaign))
 
 #
 # # Login functionality
@@ -36,13 +66,10 @@ create_new_sag_in_db("sample21")
 #         st.error(e)
 #     st.stop()
 
-if "total_sag_df" not in st.session_state:
-    st.session_state["total_sag_df"] = get_total_sag_df(["sample20", "sample21"])
-total_sag_df = st.session_state["total_sag_df"]
-
-if "long_sag_df" not in st.session_state:
-    st.session_state["long_sag_df"] = format_sag_df(total_sag_df)
-long_sag_df = st.session_state["long_sag_df"]
+# All sessions share one event store per data version, a session only looks up the current version
+st.session_state["seen_data_version"] = backend.data_version()
+event_store = get_event_store(st.session_state["seen_data_version"])
+long_sag_df = event_store.to_long_df(["sample20", "sample21"])
 
 # # Get the complete plan_df from docs and save it to session state. Only reload, if the docs have been changed
 # if "plan_track_df" not in st.session_state:
@@ -63,54 +90,63 @@ widget_cols = st.columns(2)
 sample20_container = widget_cols[0].container(border=True)
 sample20_container.write("### Sample20")
 sample20_cols = sample20_container.columns(2)
-init_interval_20_button = sample20_cols[0].button("Initialize new leaching interval", use_container_width=True)
-add_leaching_start_20_button = sample20_cols[0].button("Add leaching start", use_container_width=True)
-add_leaching_end_20_button = sample20_cols[0].button("Add leaching end", use_container_width=True)
+sample20_archived = "sample20" in archived_samples
+init_interval_20_button = sample20_cols[0].button("Initialize new leaching interval", use_container_width=True,
+                                                  disabled=sample20_archived)
+add_leaching_start_20_button = sample20_cols[0].button("Add leaching start", use_container_width=True,
+                                                       disabled=sample20_archived)
+add_leaching_end_20_button = sample20_cols[0].button("Add leaching end", use_container_width=True,
+                                                     disabled=sample20_archived)
+if sample20_archived:
+    sample20_cols[0].caption("Archived, see the archive in \"Data\"")
 
 def update_sag_state():
-    total_sag_df = get_total_sag_df(["sample20", "sample21"])
-    long_sag_df = format_sag_df(total_sag_df)
-    st.session_state["total_sag_df"] = total_sag_df
-    st.session_state["long_sag_df"] = long_sag_df
+    # The write bumped the data version, so the rerun picks up the new event store
     st.rerun()
 
 if init_interval_20_button:
-    start_next_leaching_interval("sample20")
+    backend.stamp_event("sample20", "interval")
     update_sag_state()
 
 if add_leaching_start_20_button:
-    add_leaching_start_time("sample20")
+    backend.stamp_event("sample20", "start")
     update_sag_state()
 
 if add_leaching_end_20_button:
-    add_leaching_end_time("sample20")
+    backend.stamp_event("sample20", "end")
     update_sag_state()
 
 with sample20_cols[1]:
-    sample20_countdown()
+    sag_countdown("sample20")
 
 sample21_container = widget_cols[1].container(border=True)
 sample21_container.write("### Sample21")
 sample21_cols = sample21_container.columns(2)
-init_interval_21_button = sample21_cols[0].button("Initialize new leaching interval", use_container_width=True, key="add_int_21")
-add_leaching_start_21_button = sample21_cols[0].button("Add leaching start", use_container_width=True, key="add_start_21")
-add_leaching_end_21_button = sample21_cols[0].button("Add leaching end", use_container_width=True, key="add_end_21")
+sample21_archived = "sample21" in archived_samples
+init_interval_21_button = sample21_cols[0].button("Initialize new leaching interval", use_container_width=True, key="add_int_21",
+                                                  disabled=sample21_archived)
+add_leaching_start_21_button = sample21_cols[0].button("Add leaching start", use_container_width=True, key="add_start_21",
+                                                       disabled=sample21_archived)
+add_leaching_end_21_button = sample21_cols[0].button("Add leaching end", use_container_width=True, key="add_end_21",
+                                                     disabled=sample21_archived)
+if sample21_archived:
+    sample21_cols[0].caption("Archived, see the archive in \"Data\"")
 
 
 if init_interval_21_button:
-    start_next_leaching_interval("sample21")
+    backend.stamp_event("sample21", "interval")
     update_sag_state()
 
 if add_leaching_start_21_button:
-    add_leaching_start_time("sample21")
+    backend.stamp_event("sample21", "start")
     update_sag_state()
 
 if add_leaching_end_21_button:
-    add_leaching_end_time("sample21")
+    backend.stamp_event("sample21", "end")
     update_sag_state()
 
 with sample21_cols[1]:
-    sample21_countdown()
+    sag_countdown("sample21")
 
 # sample_container = widget_cols[0].container(border=True)
 # countdown_container = widget_cols[1].container(border=True)
@@ -147,14 +183,27 @@ with sample21_cols[1]:
 
 
 
-if not long_sag_df.empty:
+# Archived samples are only read from the parquet archive when they are selected in the "Data" expander
+archived_selection = st.session_state.get("archived_selection", [])
+if archived_selection:
+    archived_range = st.session_state.get("archived_range", ())
+    archived_start, archived_end = (archived_range[0], archived_range[1] + timedelta(days=1)) \
+        if len(archived_range) == 2 else (None, None)
+    archived_sag_df = load_archived_sag_df(archived_selection, archived_start, archived_end, archive_campaign)
+    plot_sag_df = pd.concat([long_sag_df, format_sag_df(archived_sag_df)], ignore_index=True) \
+        if not archived_sag_df.empty else long_sag_df
+else:
+    archived_sag_df = None
+    plot_sag_df = long_sag_df
+
+if plot_sag_df is not None and not plot_sag_df.empty:
     # Create the plot
     # fig = px.scatter(plan_track_df, x="timestamp", y="sample", color="source", color_discrete_map={
     # "planned": "#f39c12",  # orange
     # "tracked": "#2ecc71"  # greenish
     #    },
     #                  symbol="source", )
-    fig = px.scatter(long_sag_df, x="timestamp", y="sample", color="source", color_discrete_map = {
+    fig = px.scatter(plot_sag_df, x="timestamp", y="sample", color="source", color_discrete_map = {
     "planned": "#f39c12",  # orange
     "start": "#2ecc71",    # green
     "end": "#3498db"       # blue
@@ -189,7 +238,7 @@ if not long_sag_df.empty:
     # )
 
     # Add time indicator with red horizontal line
-    now = datetime.now(ZoneInfo("Europe/Berlin"))
+    now = clock.now()
     fig.add_shape(
         type="line",
         x0=now,
@@ -205,6 +254,12 @@ if not long_sag_df.empty:
         )
     )
 
+    # Measured bath temperatures on a second axis, decimated on the server (see telemetry.py)
+    plot_times = plot_sag_df["timestamp"].dropna()
+    if not plot_times.empty:
+        add_telemetry_overlay(fig, plot_sag_df["sample"].unique().tolist(), plot_times.min(),
+                              max(plot_times.max(), pd.Timestamp(now)))
+
     # Beautify styling of the plot
     fig.update_traces(marker=dict(size=10))  # 🔍 Adjust marker size here
     fig.update_layout(
@@ -241,6 +296,19 @@ if not long_sag_df.empty:
 # else:
 #     countdown_container.info("No experiment initialized yet.")
 
+# Pick up events recorded by other sessions or the api
+watch_data_version()
+# Toasts of the T-5 min and T-0 alerts of the server side scheduler
+alert_toasts()
+
+overview_tabs = st.tabs(["Upcoming scans", "Analytics", "Reports"])
+with overview_tabs[0]:
+    next_scan_countdown()
+with overview_tabs[1]:
+    analytics_dashboard(st.session_state["seen_data_version"])
+with overview_tabs[2]:
+    report_builder(["sample20", "sample21"] + list_archived_samples(archive_campaign))
+
 st.divider()
 
 # Show sample info
@@ -261,20 +329,41 @@ st.divider()
 #     unformatted_plan_track_df.drop(columns=["id"], inplace=True)
 # tabs[1].container().dataframe(unformatted_plan_track_df, hide_index=True)
 with st.expander("Data"):
-    st.dataframe(total_sag_df, hide_index=True)
+    sag_data_browser(["sample20", "sample21"])
+
+    # Browse the archive of completed samples
+    archive_cols = st.columns(2)
+    archive_cols[0].multiselect("Archived samples", options=list_archived_samples(archive_campaign),
+                                 key="archived_selection")
+    archive_cols[1].date_input("Archive time range", value=(), key="archived_range")
+    if archived_sag_df is not None:
+        st.dataframe(archived_sag_df, hide_index=True)
 
 # Options to download/upload/delete data
 data_actions_expander = st.expander("Data actions")
+if isinstance(backend, ShardedBackend):
+    with data_actions_expander:
+        campaign_controls(backend)
 data_action_cols = data_actions_expander.columns(5)
 #csv_data = get_plan_track_table().to_csv(index=False)
-csv_data = st.session_state["total_sag_df"].to_csv(index=False)
+csv_data = backend.bulk_export(["sample20", "sample21"]).to_csv(index=False)
 data_action_cols[0].download_button("Download Backup", disabled=True,
-                                    file_name=f"scans_{datetime.now(ZoneInfo("Europe/Berlin")).strftime("%Y-%m-%d_%H-%M-%S")}.csv",
+                                    file_name=f"scans_{clock.now().strftime('%Y-%m-%d_%H-%M-%S')}.csv",
                                     data=csv_data, use_container_width=True)
 
 
 if data_action_cols[1].button("Upload Backup", use_container_width=True, disabled=True):
     upload_backup()
 
-if data_action_cols[4].button("Delete All Data", use_container_width=True):
+if data_action_cols[2].button("Archive completed samples", use_container_width=True):
+    archived_samples = archive_sag_samples(backend.completed_samples(["sample20", "sample21"]), backend)
+    st.toast(f"Archived: {', '.join(archived_samples)}" if archived_samples else "No completed samples to archive")
+    update_sag_state()
+
+if data_action_cols[3].button("Restore Backup", use_container_width=True):
+    restore_dialog(backend)
+
+# With campaigns the data is deleted per campaign, see the campaign controls above
+if data_action_cols[4].button("Delete All Data", use_container_width=True,
+                              disabled=isinstance(backend, ShardedBackend)):
     delete_dialog()
@@ -1,19 +1,52 @@
 import time
 import sqlite3
 import pandas as pd
-from datetime import datetime, timedelta
+from datetime import timedelta
 import streamlit as st
 import json
 import gspread
 from oauth2client.service_account import ServiceAccountCredentials
 import os
-from zoneinfo import ZoneInfo
+import clock
 import samples
+from event_store import EventStore
+import storage
+import backup
+
+DB_PATH = os.environ.get("CT_TRACKER_DB", "scans.sqlite")
+ARCHIVE_DIR = "archive"
+# Campaign of the backends without campaigns. shards.DEFAULT_CAMPAIGN is the same, shards imports this module
+DEFAULT_CAMPAIGN = "default"
+SAG_COLUMNS = ["interval", "t_start_target", "t_end_target", "t_start_is", "t_end_is", "T"]
+SAG_TIME_COLUMNS = ["t_start_target", "t_end_target", "t_start_is", "t_end_is"]
+TIME_FORMAT = "%d.%m.%Y %H:%M:%S%z"
+
+def get_archive_path(sample, campaign=DEFAULT_CAMPAIGN, archive_dir=None):
+    # The archive is kept per campaign, so a name used again in a later campaign is archived next to the
+    # earlier one. Flat files of older versions belong to the default campaign
+    archive_dir = archive_dir or ARCHIVE_DIR
+    path = os.path.join(archive_dir, campaign, f"{sample}.parquet")
+    flat_path = os.path.join(archive_dir, f"{sample}.parquet")
+    if campaign == DEFAULT_CAMPAIGN and not os.path.exists(path) and os.path.exists(flat_path):
+        return flat_path
+    return path
+
+
+def is_archived(sample, campaign=DEFAULT_CAMPAIGN):
+    return os.path.exists(get_archive_path(sample, campaign))
+
+
+def to_utc_timestamp(value):
+    # Naive dates coming from the date inputs are interpreted as local lab time
+    timestamp = pd.Timestamp(value)
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.tz_localize("Europe/Berlin")
+    return timestamp.tz_convert("UTC")
 
 
 # Connect to local sqlite. Create it if it does not exist
-def establish_db_connection():
-    connection = sqlite3.connect("scans.sqlite", check_same_thread=False)
+def establish_db_connection(db_path=None):
+    connection = sqlite3.connect(db_path or DB_PATH, check_same_thread=False)
     cursor = connection.cursor()
 
     # Create a minimal placeholder table (optional, safe)
@@ -22,10 +55,73 @@ def establish_db_connection():
             id INTEGER PRIMARY KEY AUTOINCREMENT
         )
     ''')
+
+    # Every write bumps the version of the changed sample and the global version ("_all")
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS data_versions (
+            name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL
+        )
+    ''')
+
+    # Idempotency keys of stamped batches (e.g. retried api requests) with their results by event index
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS stamp_requests (
+            idempotency_key TEXT PRIMARY KEY,
+            results TEXT NOT NULL,
+            created TEXT NOT NULL
+        )
+    ''')
     connection.commit()
 
     return connection
 
+
+def bump_data_version(cursor, sample):
+    # Must be called inside the transaction of the write, so readers never see data without its version
+    cursor.executemany('''
+        INSERT INTO data_versions (name, version) VALUES (?, 1)
+        ON CONFLICT(name) DO UPDATE SET version = version + 1
+    ''', [(sample,), ("_all",)])
+
+
+def advance_data_versions(cursor, *version_maps):
+    # Moves every version past the given ones, e.g. of a deleted or replaced db, so the versions never go back
+    names = set().union(*version_maps) | {"_all"}
+    cursor.executemany('''
+        INSERT INTO data_versions (name, version) VALUES (?, ?)
+        ON CONFLICT(name) DO UPDATE SET version = MAX(version, excluded.version)
+    ''', [(name, max(versions.get(name, 0) for versions in version_maps) + 1) for name in names])
+
+
+def get_data_version():
+    connection = establish_db_connection()
+    row = connection.execute("SELECT version FROM data_versions WHERE name = '_all'").fetchone()
+    connection.close()
+    return row[0] if row else 0
+
+
+def get_sample_versions(connection=None):
+    own_connection = connection is None
+    if own_connection:
+        connection = establish_db_connection()
+    rows = connection.execute("SELECT name, version FROM data_versions WHERE name != '_all'").fetchall()
+    if own_connection:
+        connection.close()
+    return dict(rows)
+
+
+@st.cache_resource(max_entries=2)
+def get_event_store(version):
+    # One store per data version for the whole process. Sessions only pass the version number around
+    backend = storage.get_storage()
+    return EventStore.from_frames(version, backend.query_history(), backend.query_plan_track())
+
+
+def get_upcoming_events(k=10):
+    # The backend keeps a process wide queue of the next planned events, updated per changed sample
+    return storage.get_storage().query_schedule(k=k)
+
 @st.dialog("Delete All Data")
 def delete_dialog():
     st.error("Caution! THIS WILL DELETE ALL DATA! EVERYTHING WILL BE LOST IF YOU DONT HAVE A BACKUP!")
@@ -36,10 +132,22 @@ def delete_dialog():
         delete_db()
 
 def delete_db():
-    if os.path.exists("scans.sqlite"):
+    if os.path.exists(DB_PATH):
         if "plan_track_df" in st.session_state:
             del st.session_state["plan_track_df"]
-        os.remove("scans.sqlite")
+        # Last generation before the data is gone, it can be restored from "Data actions"
+        backup.snapshot(DB_PATH)
+        connection = establish_db_connection()
+        versions = dict(connection.execute("SELECT name, version FROM data_versions").fetchall())
+        connection.close()
+        os.remove(DB_PATH)
+
+        # The new db goes on from the versions of the deleted one, so nothing cached under a version (event
+        # stores, analytics, reports, alerts) is served for the new data
+        connection = establish_db_connection()
+        advance_data_versions(connection.cursor(), versions)
+        connection.commit()
+        connection.close()
         st.rerun()
 
 
@@ -65,18 +173,25 @@ def get_db_table_as_df(sample):
 
 
 def format_plan_track_table():
-    connection = establish_db_connection()
-
     plan_track_df = get_plan_track_table()
 
     # Drop the id col, if it exists
     if "id" in plan_track_df.columns:
         plan_track_df.drop(columns=["id"], inplace=True)
 
-    # Convert values to datetime objects
-    time_format = "%d.%m.%Y %H:%M:%S%z"
+    return to_long_plan_track_df(plan_track_df, TIME_FORMAT)
+
+
+def to_long_plan_track_df(plan_track_df, time_format):
+    # Wide plan/track table (one column per "<sample>_plan" and "<sample>_track") to the long format of the
+    # timeline. Used for the sqlite table and the Google Sheets worksheets, whose times have no timezone
     for col in plan_track_df.columns:
-        plan_track_df[col] = pd.to_datetime(plan_track_df[col], format=time_format, errors="coerce", utc=True).dt.tz_convert("Europe/Berlin")
+        if "%z" in time_format:
+            plan_track_df[col] = pd.to_datetime(plan_track_df[col], format=time_format, errors="coerce",
+                                                utc=True).dt.tz_convert("Europe/Berlin")
+        else:
+            plan_track_df[col] = pd.to_datetime(plan_track_df[col], format=time_format,
+                                                errors="coerce").dt.tz_localize("Europe/Berlin")
 
     # Reshape the df into long format
     long_plan_track_df = plan_track_df.melt(var_name="sample", value_name="timestamp")
@@ -90,13 +205,18 @@ def format_plan_track_table():
         long_plan_track_df["sample"] = long_plan_track_df["sample"].str.replace("_track", "")
         long_plan_track_df.sort_values(by="timestamp", inplace=True)
 
-    connection.close()
     return long_plan_track_df
 
 
-def create_new_sag_in_db(sag_sample):
-    # connect to db
-    connection = establish_db_connection()
+def create_new_sag_in_db(sag_sample, connection=None, campaign=DEFAULT_CAMPAIGN):
+    # Archived samples of the campaign live in the parquet archive and must not be recreated
+    if is_archived(sag_sample, campaign):
+        return
+
+    # connect to db. A passed connection belongs to the caller, who also commits
+    own_connection = connection is None
+    if own_connection:
+        connection = establish_db_connection()
     cursor = connection.cursor()
 
     # get sample information
@@ -116,21 +236,66 @@ def create_new_sag_in_db(sag_sample):
     )
     ''')
 
+    # Only seed the intervals once, otherwise every rerun would append them again
+    cursor.execute(f"SELECT COUNT(*) FROM {sag_sample}")
+    if cursor.fetchone()[0] > 0:
+        if own_connection:
+            connection.commit()
+            connection.close()
+        return
+
     # Insert values into the table: only 'interval' is set, others remain NULL
     data_to_insert = list(zip(interval_list, T_list))
     cursor.executemany(f'''
     INSERT INTO {sag_sample} (interval, t_start_target, t_end_target, t_start_is, t_end_is, T)
     VALUES (?, NULL, NULL, NULL, NULL, ?)
     ''', data_to_insert)
+    bump_data_version(cursor, sag_sample)
 
     # Commit and close
-    connection.commit()
-    connection.close()
+    if own_connection:
+        connection.commit()
+        connection.close()
 
 
-def start_next_leaching_interval(sag_sample):
-    # connect to db
-    connection = establish_db_connection()
+def reschedule_sag_sample(sag_sample, connection=None, campaign=DEFAULT_CAMPAIGN):
+    # Replace the intervals without any recorded time with the current catalog definition
+    sample_info = samples.sag_samples.get(sag_sample)
+    if sample_info is None:
+        return
+
+    own_connection = connection is None
+    if own_connection:
+        connection = establish_db_connection()
+    cursor = connection.cursor()
+    cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = ?", (sag_sample,))
+    if cursor.fetchone() is None:
+        if own_connection:
+            connection.close()
+            connection = None
+        return create_new_sag_in_db(sag_sample, connection, campaign)
+
+    # Rows with any recorded time are kept, e.g. a start stamped before the interval was initialized
+    untouched = " AND ".join(f"{col} IS NULL" for col in SAG_TIME_COLUMNS)
+    cursor.execute(f"SELECT COUNT(*) FROM {sag_sample} WHERE NOT ({untouched})")
+    n_kept = cursor.fetchone()[0]
+    cursor.execute(f"DELETE FROM {sag_sample} WHERE {untouched}")
+    cursor.executemany(f'''
+    INSERT INTO {sag_sample} (interval, t_start_target, t_end_target, t_start_is, t_end_is, T)
+    VALUES (?, NULL, NULL, NULL, NULL, ?)
+    ''', list(zip(sample_info.intervals, sample_info.T))[n_kept:])
+    bump_data_version(cursor, sag_sample)
+
+    if own_connection:
+        connection.commit()
+        connection.close()
+
+
+def start_next_leaching_interval(sag_sample, timestamp=None, connection=None):
+    # A passed connection belongs to the caller, who commits several writes at once (e.g. bulk api requests)
+    own_connection = connection is None
+    if own_connection:
+        connection = establish_db_connection()
     cursor = connection.cursor()
 
     # Get the ROWID and interval of the first row with NULL t_start_target
@@ -143,13 +308,14 @@ def start_next_leaching_interval(sag_sample):
     result = cursor.fetchone()
 
     if result is None:
-        connection.close()
+        if own_connection:
+            connection.close()
         return None  # No more intervals to process
 
     rowid, next_interval = result
 
     # Define the scantimes
-    start_time = datetime.now(ZoneInfo("Europe/Berlin")) # Experiment starts now
+    start_time = timestamp or clock.now() # Experiment starts now
     end_time = start_time+timedelta(minutes=next_interval) # First 15min -> scan every 3min
     start_time_string = start_time.strftime("%d.%m.%Y %H:%M:%S%z")
     end_time_string = end_time.strftime("%d.%m.%Y %H:%M:%S%z")
@@ -161,118 +327,158 @@ def start_next_leaching_interval(sag_sample):
         SET t_start_target = ?, t_end_target = ?
         WHERE ROWID = ?
     ''', (start_time_string, end_time_string, rowid))
+    bump_data_version(cursor, sag_sample)
 
-    connection.commit()
-    connection.close()
-
-
-def add_leaching_start_time(sample):
-    # Connect to DB
-    connection = establish_db_connection()
-    cursor = connection.cursor()
-
-    # Get the ROWID of the first row with NULL t_start_is
-    cursor.execute(f'''
-        SELECT ROWID FROM {sample}
-        WHERE t_start_is IS NULL
-        ORDER BY ROWID ASC
-        LIMIT 1
-    ''')
-    result = cursor.fetchone()
-
-    if result is None:
+    if own_connection:
+        connection.commit()
         connection.close()
-        return None  # No unmarked rows found
 
-    rowid = result[0]
+    return {
+        "rowid": rowid,
+        "t_start_target": start_time_string,
+        "t_end_target": end_time_string
+    }
 
-    # Generate the current timestamp
-    timestamp = datetime.now(ZoneInfo("Europe/Berlin")).strftime("%d.%m.%Y %H:%M:%S%z")
 
-    # Update the row with the timestamp
-    cursor.execute(f'''
-        UPDATE {sample}
-        SET t_start_is = ?
-        WHERE ROWID = ?
-    ''', (timestamp, rowid))
+def add_leaching_start_time(sample, timestamp=None, connection=None):
+    return stamp_first_empty(sample, "t_start_is", timestamp, connection)
 
-    connection.commit()
-    connection.close()
 
-    return {
-        "rowid": rowid,
-        "t_start_is": timestamp
-    }
+def add_leaching_end_time(sample, timestamp=None, connection=None):
+    return stamp_first_empty(sample, "t_end_is", timestamp, connection)
 
 
-def add_leaching_end_time(sample):
-    # Connect to DB
-    connection = establish_db_connection()
+def stamp_first_empty(sample, column, timestamp=None, connection=None):
+    # A passed connection belongs to the caller, who commits several writes at once (e.g. bulk api requests)
+    own_connection = connection is None
+    if own_connection:
+        connection = establish_db_connection()
     cursor = connection.cursor()
 
-    # Get the ROWID of the first row with NULL t_start_is
+    # Get the ROWID of the first row with NULL in the given column
     cursor.execute(f'''
         SELECT ROWID FROM {sample}
-        WHERE t_end_is IS NULL
+        WHERE {column} IS NULL
         ORDER BY ROWID ASC
         LIMIT 1
     ''')
     result = cursor.fetchone()
 
     if result is None:
-        connection.close()
+        if own_connection:
+            connection.close()
         return None  # No unmarked rows found
 
     rowid = result[0]
 
-    # Generate the current timestamp
-    timestamp = datetime.now(ZoneInfo("Europe/Berlin")).strftime("%d.%m.%Y %H:%M:%S%z")
+    # Generate the current timestamp, unless the actual time is reported (e.g. by the scanner)
+    timestamp = (timestamp or clock.now()).strftime("%d.%m.%Y %H:%M:%S%z")
 
     # Update the row with the timestamp
     cursor.execute(f'''
         UPDATE {sample}
-        SET t_end_is = ?
+        SET {column} = ?
         WHERE ROWID = ?
     ''', (timestamp, rowid))
+    bump_data_version(cursor, sample)
 
-    connection.commit()
-    connection.close()
+    if own_connection:
+        connection.commit()
+        connection.close()
 
     return {
         "rowid": rowid,
-        "t_end_is": timestamp
+        column: timestamp
     }
 
 
-def get_total_sag_df(table_names):
+def get_total_sag_df(table_names, connection=None):
 
-    connection = establish_db_connection()
+    own_connection = connection is None
+    if own_connection:
+        connection = establish_db_connection()
+    sample_dfs = []
 
     try:
-        # Read from sample20 and tag source
-        df1 = pd.read_sql("SELECT * FROM sample20", connection)
-        df1["sample"] = "sample20"
-
-        # Read from sample21 and tag source
-        df2 = pd.read_sql("SELECT * FROM sample21", connection)
-        df2["sample"] = "sample21"
-
-        # Concatenate vertically
-        combined_df = pd.concat([df1, df2], axis=0, ignore_index=True)
+        # Read every live sample table and tag it with its source
+        for table_name in table_names:
+            try:
+                sample_df = pd.read_sql(f"SELECT * FROM {table_name}", connection)
+            except (pd.io.sql.DatabaseError, sqlite3.OperationalError) as e:
+                # Archived or not yet created samples have no table
+                if "no such table" in str(e).lower():
+                    continue
+                raise
+            sample_df["sample"] = table_name
+            sample_dfs.append(sample_df)
 
     except (pd.io.sql.DatabaseError, sqlite3.OperationalError) as e:
         print(f"Error reading tables: {e}")
-        combined_df = None
 
     finally:
-        connection.close()
+        if own_connection:
+            connection.close()
+
+    if not sample_dfs:
+        return pd.DataFrame(columns=SAG_COLUMNS + ["sample"])
+
+    # Concatenate vertically
+    combined_df = pd.concat(sample_dfs, axis=0, ignore_index=True)
 
     return combined_df
 
 
+def get_live_sag_samples(connection=None):
+    own_connection = connection is None
+    if own_connection:
+        connection = establish_db_connection()
+    cursor = connection.cursor()
+    cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+    table_names = {row[0] for row in cursor.fetchall()}
+    if own_connection:
+        connection.close()
+
+    return [sample for sample in samples.sag_samples if sample in table_names]
+
+
+def drop_sag_sample(sag_sample, connection=None):
+    # Removes the live intervals of a sample, e.g. once it is archived
+    own_connection = connection is None
+    if own_connection:
+        connection = establish_db_connection()
+    cursor = connection.cursor()
+    cursor.execute(f"DROP TABLE IF EXISTS {sag_sample}")
+    bump_data_version(cursor, sag_sample)
+    if own_connection:
+        connection.commit()
+        connection.close()
+
+
+def get_completed_sag_samples(table_names, connection=None):
+    # A sample is completed once every interval has an actual end time
+    own_connection = connection is None
+    if own_connection:
+        connection = establish_db_connection()
+    cursor = connection.cursor()
+    completed = []
+
+    for table_name in table_names:
+        try:
+            cursor.execute(f"SELECT COUNT(*), COUNT(t_end_is) FROM {table_name}")
+        except sqlite3.OperationalError:
+            continue
+        n_rows, n_ended = cursor.fetchone()
+        if n_rows > 0 and n_rows == n_ended:
+            completed.append(table_name)
+
+    if own_connection:
+        connection.close()
+    return completed
+
+
 def format_sag_df(sag_df):
 
-    if not sag_df.empty:
+    if sag_df is not None and not sag_df.empty:
         time_cols = ["t_start_target", "t_end_target", "t_start_is", "t_end_is"]
         time_format = "%d.%m.%Y %H:%M:%S%z"
         for col in time_cols:
@@ -310,21 +516,130 @@ def format_sag_df(sag_df):
         return long_sag_df
 
     else:
-        return None
+        return pd.DataFrame(columns=["sample", "source", "timestamp"])
+
+
+# Maps the time columns of the SAG tables onto the sources used in the long format
+SAG_SOURCES = {"t_start_target": "planned", "t_end_target": "planned", "t_start_is": "start", "t_end_is": "end"}
+SAG_PAGE_SORT_COLUMNS = {"timestamp": "timestamp_utc", "sample": "sample", "source": "source",
+                         "interval": "interval", "T": "T"}
+
+
+def sql_utc_datetime(col):
+    # Turn a "%d.%m.%Y %H:%M:%S%z" string into a sortable UTC datetime inside sqlite
+    return (f"datetime(substr({col}, 7, 4) || '-' || substr({col}, 4, 2) || '-' || substr({col}, 1, 2) || 'T' || "
+            f"substr({col}, 12, 8) || substr({col}, 20, 3) || ':' || substr({col}, 23, 2))")
+
+
+def build_long_sag_query(table_names):
+    # One select per sample and time column, so the long format is produced by sqlite and not by pandas
+    selects = []
+    for table_name in table_names:
+        for col, source in SAG_SOURCES.items():
+            selects.append(f"""
+                SELECT '{table_name}' AS sample, '{source}' AS source, interval, T, {col} AS timestamp,
+                       {sql_utc_datetime(col)} AS timestamp_utc
+                FROM {table_name} WHERE {col} IS NOT NULL""")
+    return " UNION ALL ".join(selects)
+
+
+def get_sag_page(table_names, sources=None, start=None, end=None, sort_by="timestamp", descending=False,
+                 page=0, page_size=50, connection=None):
+    # Return one page of the long SAG table together with the total number of matching rows
+    columns = ["sample", "source", "interval", "T", "timestamp"]
+    conditions = []
+    params = []
+    if sources:
+        conditions.append(f"source IN ({', '.join('?' * len(sources))})")
+        params.extend(sources)
+    if start is not None:
+        conditions.append("timestamp_utc >= ?")
+        params.append(pd.Timestamp(start).tz_convert("UTC").strftime("%Y-%m-%d %H:%M:%S"))
+    if end is not None:
+        conditions.append("timestamp_utc < ?")
+        params.append(pd.Timestamp(end).tz_convert("UTC").strftime("%Y-%m-%d %H:%M:%S"))
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+    # Only whitelisted columns can be used for sorting, everything else is passed as parameter
+    order = f"{SAG_PAGE_SORT_COLUMNS[sort_by]} {'DESC' if descending else 'ASC'}, sample, interval"
+
+    own_connection = connection is None
+    if own_connection:
+        connection = establish_db_connection()
+    try:
+        live_samples = [sample for sample in get_live_sag_samples(connection) if sample in table_names]
+        if not live_samples:
+            return pd.DataFrame(columns=columns), 0
+
+        long_query = build_long_sag_query(live_samples)
+        total_rows = connection.execute(f"SELECT COUNT(*) FROM ({long_query}) {where}", params).fetchone()[0]
+        page_df = pd.read_sql(f"""
+            SELECT {', '.join(columns)} FROM ({long_query}) {where}
+            ORDER BY {order}
+            LIMIT ? OFFSET ?""", connection, params=params + [page_size, page * page_size])
+    finally:
+        if own_connection:
+            connection.close()
+
+    return page_df, total_rows
+
+
+@st.fragment
+def sag_data_browser(table_names):
+    # Streamlit executes the content of collapsed expanders as well, so nothing is queried until requested
+    if not st.toggle("Load data", key="sag_browser_enabled"):
+        return
+
+    filter_cols = st.columns([0.3, 0.3, 0.4])
+    selected_samples = filter_cols[0].multiselect("Sample", options=table_names, default=table_names,
+                                                  key="sag_browser_samples")
+    selected_sources = filter_cols[1].multiselect("Source", options=["planned", "start", "end"],
+                                                  key="sag_browser_sources")
+    date_range = filter_cols[2].date_input("Time range", value=(), key="sag_browser_range")
+
+    sort_cols = st.columns(4)
+    sort_by = sort_cols[0].selectbox("Sort by", options=list(SAG_PAGE_SORT_COLUMNS), key="sag_browser_sort")
+    descending = sort_cols[1].toggle("Descending", key="sag_browser_descending")
+    page_size = sort_cols[2].selectbox("Rows per page", options=[25, 50, 100, 250], index=1,
+                                       key="sag_browser_page_size")
+    page = sort_cols[3].number_input("Page", min_value=1, step=1, key="sag_browser_page")
+
+    start, end = None, None
+    if len(date_range) == 2:
+        start = pd.Timestamp(date_range[0]).tz_localize("Europe/Berlin")
+        end = pd.Timestamp(date_range[1]).tz_localize("Europe/Berlin") + timedelta(days=1)
+
+    page_df, total_rows = storage.get_storage().query_page(selected_samples, selected_sources, start, end, sort_by,
+                                                           descending, int(page) - 1, page_size)
+    n_pages = max(1, -(-total_rows // page_size))
+
+    st.dataframe(page_df, hide_index=True, use_container_width=True)
+    st.caption(f"Page {int(page)} of {n_pages} ({total_rows} rows)")
+
+
+# Worksheets / columns of the plan/track experiment
+PLANNED_SAMPLES = [f"sample{i}_plan" for i in range(1, 10)]
+TRACKED_SAMPLES = [f"sample{i}_track" for i in range(1, 10)]
+
+
+def get_plan_times(sample, start_time):
+    # The initial repetitions every 20 min, then hourly for the duration of the sample
+    sample_info = samples.samples[sample]
+    initial_scantimes = pd.date_range(start=start_time, periods=sample_info.initial_repetitions, freq="20min")
+    long_term_scantimes = pd.date_range(start=start_time + timedelta(hours=1), periods=sample_info.duration,
+                                        freq="h")
+    return initial_scantimes.append(long_term_scantimes)
 
 
 # Add a plan_df to the db as a new column
 def add_plan_df_to_db(sample):
     connection = establish_db_connection()
     planned_sample = f"{sample}_plan"
-    sample_info = samples.samples[sample]
 
     cursor = connection.cursor()
 
-    planned_sample_list = ["sample1_plan", "sample2_plan", "sample3_plan", "sample4_plan", "sample5_plan", "sample6_plan", "sample7_plan", "sample8_plan", "sample9_plan"]
-
-    if planned_sample not in planned_sample_list:
-        st.toast(f"{planned_sample} is an invalid name. Must be one of:\n {planned_sample_list}")
+    if planned_sample not in PLANNED_SAMPLES:
+        st.toast(f"{planned_sample} is an invalid name. Must be one of:\n {PLANNED_SAMPLES}")
         connection.close()
         return
 
@@ -341,19 +656,8 @@ def add_plan_df_to_db(sample):
             connection.close()
             raise e
 
-    # Get information about this sample from samples.py
-    duration = sample_info["duration"]
-    if "inital_repetitions" in sample_info:
-        initial_reps = sample_info["inital_repetitions"]
-    else:
-        initial_reps = 1
-
-    # Define the scantimes
-    start_time = datetime.now(ZoneInfo("Europe/Berlin")) # Experiment starts now
-    initial_scantimes = pd.date_range(start=start_time, periods=initial_reps, freq="20min") # First 15min -> scan every 3min
-    long_term_scantimes = pd.date_range(start=start_time+timedelta(hours=1), periods=duration, freq="h")  # after >1h interval = 1h for 24h
-    all_scantimes = initial_scantimes.append(long_term_scantimes)
-    plan_times = all_scantimes.strftime("%d.%m.%Y %H:%M:%S%z").tolist()
+    # Define the scantimes, the experiment starts now
+    plan_times = get_plan_times(sample, clock.now()).strftime(TIME_FORMAT).tolist()
 
     # Write to the db
     # Get the current number of rows in plan_track
@@ -369,6 +673,7 @@ def add_plan_df_to_db(sample):
     # Update the new column row by row with the values from plan_times
     for i, time in enumerate(plan_times):
         cursor.execute(f"UPDATE plan_track SET {planned_sample} = ? WHERE rowid = ?", (time, i+1))
+    bump_data_version(cursor, sample)
     connection.commit()
 
     st.session_state["plan_track_df"] = format_plan_track_table()
@@ -380,14 +685,13 @@ def add_plan_df_to_db(sample):
 def add_scan_to_db(tracked_sample):
     connection = establish_db_connection()
     cursor = connection.cursor()
-    tracked_sample_list = ["sample1_track", "sample2_track", "sample3_track", "sample4_track", "sample5_track", "sample6_track", "sample7_track", "sample8_track", "sample9_track"]
 
-    if tracked_sample not in tracked_sample_list:
+    if tracked_sample not in TRACKED_SAMPLES:
         connection.close()
-        return f"{tracked_sample} is an invalid name. Must be one of:\n {tracked_sample_list}"
+        return f"{tracked_sample} is an invalid name. Must be one of:\n {TRACKED_SAMPLES}"
 
     # Get the current time
-    now = datetime.now(ZoneInfo("Europe/Berlin"))
+    now = clock.now()
     now_string = now.strftime("%d.%m.%Y %H:%M:%S%z")
 
     # Add the current time to the samples record worksheet
@@ -418,6 +722,7 @@ def add_scan_to_db(tracked_sample):
         cursor.execute(f"""
                 INSERT INTO plan_track ({tracked_sample}) VALUES (?)
             """, (now_string,))
+    bump_data_version(connection.cursor(), tracked_sample.removesuffix("_track"))
 
     connection.commit()
 
@@ -435,6 +740,8 @@ def overwrite_db_with_csv(uploaded_file, connection):
 
             # 2. Overwrite plan_track table with the DataFrame
             df.to_sql("plan_track", connection, if_exists="replace", index=False)
+            bump_data_version(connection.cursor(), "plan_track")
+            connection.commit()
 
             st.toast("CSV imported successfully and plan_track table overwritten.")
             # Reload the plan_track_df
@@ -447,130 +754,61 @@ def overwrite_db_with_csv(uploaded_file, connection):
 @st.fragment(run_every="1s")
 def next_scan_countdown():
     # Get current time
-    now = datetime.now(ZoneInfo("Europe/Berlin"))
+    now = clock.now()
 
-    # Get all future planned scan times
-    if "plan_track_df" in st.session_state:
+    # The queue already holds the next planned events of every sample incl. their metadata
+    upcoming_events = get_upcoming_events(k=10)
 
-        plan_track_df = st.session_state["plan_track_df"]
-        future_scans = plan_track_df[plan_track_df["timestamp"] > now].sort_values("timestamp", ascending=True)
-        next_sample = future_scans["sample"].values[0]
-        next_scan_time = future_scans["timestamp"].iloc[0]
+    if upcoming_events:
+        next_event = upcoming_events[0]
+        next_scan_time = next_event.time
 
-        next_sample_T = samples.samples[next_sample]["T"]
-        next_sample_solution = samples.samples[next_sample]["solution"]
-        next_sample_profile = samples.samples[next_sample]["profile"]
+        time_diff = next_scan_time - now
+        mins, secs = divmod(int(time_diff.total_seconds()), 60)
 
-        if next_scan_time:
-            time_diff = next_scan_time - now
-            mins, secs = divmod(int(time_diff.total_seconds()), 60)
+        st.write(f"#### Next Scan: {next_event.sample}")
+        cols = st.columns([0.55, 0.45])
 
-            st.write(f"#### Next Scan: {next_sample}")
-            cols = st.columns([0.55, 0.45])
+        cols[0].write(f"""
+            - **Scheduled: {next_scan_time.strftime("%H:%M:%S (%A)")}**
+            - **Countdown: `{mins:02d}:{secs:02d}` remaining**
+        """)
 
-            cols[0].write(f"""
-                - **Scheduled: {next_scan_time.strftime("%H:%M:%S (%A)")}**
-                - **Countdown: `{mins:02d}:{secs:02d}` remaining**
-            """)
+        cols[1].info(f""" 
+        - T: {next_event.T}  
+        - Solution: {next_event.solution or "-"}  
+        - Profile: {next_event.profile}""")
 
-            cols[1].info(f""" 
-            - T: {next_sample_T}  
-            - Solution: {next_sample_solution}  
-            - Profile: {next_sample_profile}""")
+        st.dataframe(pd.DataFrame([event.as_dict() for event in upcoming_events]), hide_index=True)
 
-            if (mins <= 5) and (mins >=4) and (secs%5 == 0):
-                st.balloons()
-
-        else:
-            st.success("✅ No upcoming scans found.")
-
-
-@st.fragment(run_every="1s")
-def sample20_countdown():
-    # Get current time
-    now = datetime.now(ZoneInfo("Europe/Berlin"))
-
-    # Get all future planned scan times
-    if "long_sag_df" in st.session_state:
-
-        total_sag_df = st.session_state["long_sag_df"]
-        sample_20_df = total_sag_df[total_sag_df["sample"]=="sample20"]
-        sample_20_planned_df = sample_20_df[sample_20_df["source"] == "planned"]
-
-        if not sample_20_planned_df["timestamp"].isna().all():
-            future_scans = sample_20_planned_df[sample_20_planned_df["timestamp"] > now].sort_values("timestamp", ascending=True)
-            #next_sample = future_scans["sample"].values[0]
-            #next_sample = future_scans["sample"].values[0]
-            if not future_scans.empty:
-                next_scan_time = future_scans["timestamp"].iloc[0]
-            else:
-                next_scan_time = None
-        else:
-            next_scan_time = None
-
-        # next_sample_T = samples.samples[next_sample]["T"]
-        # next_sample_solution = samples.samples[next_sample]["solution"]
-        # next_sample_profile = samples.samples[next_sample]["profile"]
-
-        if next_scan_time:
-            time_diff = next_scan_time - now
-            mins, secs = divmod(int(time_diff.total_seconds()), 60)
-
-            st.error(f"#  {mins:02d}:{secs:02d}")
+    else:
+        st.success("✅ No upcoming scans found.")
 
-            # cols[1].info(f"""
-            # - T: {next_sample_T}
-            # - Solution: {next_sample_solution}
-            # - Profile: {next_sample_profile}""")
 
-            if (mins <= 5) and (mins >=4) and (secs%5 == 0):
-                st.balloons()
+@st.fragment(run_every="2s")
+def watch_data_version():
+    # Writes from other sessions or the api bump the data version. Only then the whole app is rerun
+    if storage.get_storage().data_version() != st.session_state.get("seen_data_version"):
+        st.rerun(scope="app")
 
-        else:
-            st.success("✅ No upcoming events found.")
 
-def sample21_countdown():
+@st.fragment(run_every="1s")
+def sag_countdown(sag_sample):
     # Get current time
-    now = datetime.now(ZoneInfo("Europe/Berlin"))
-
-    # Get all future planned scan times
-    if "long_sag_df" in st.session_state:
-
-        total_sag_df = st.session_state["long_sag_df"]
-        sample_21_df = total_sag_df[total_sag_df["sample"]=="sample21"]
-        sample_21_planned_df = sample_21_df[sample_21_df["source"] == "planned"]
-        if not sample_21_planned_df["timestamp"].isna().all():
-            future_scans = sample_21_planned_df[sample_21_planned_df["timestamp"] > now].sort_values("timestamp", ascending=True)
-
-            #next_sample = future_scans["sample"].values[0]
-            if not future_scans.empty:
-                next_scan_time = future_scans["timestamp"].iloc[0]
-            else:
-                next_scan_time = None
-        else:
-            next_scan_time = None
-        # next_sample_T = samples.samples[next_sample]["T"]
-        # next_sample_solution = samples.samples[next_sample]["solution"]
-        # next_sample_profile = samples.samples[next_sample]["profile"]
-
+    now = clock.now()
 
-        if next_scan_time:
-            time_diff = next_scan_time - now
-            mins, secs = divmod(int(time_diff.total_seconds()), 60)
+    # Look up the next planned event in the shared store of the current data version
+    event_store = get_event_store(storage.get_storage().data_version())
+    next_scan_time = event_store.next_event(sag_sample, now)
 
-            st.error(f"#  {mins:02d}:{secs:02d}")
+    if next_scan_time:
+        time_diff = next_scan_time - now
+        mins, secs = divmod(int(time_diff.total_seconds()), 60)
 
-            # cols[1].info(f"""
-            # - T: {next_sample_T}
-            # - Solution: {next_sample_solution}
-            # - Profile: {next_sample_profile}""")
-
-            if (mins <= 5) and (mins >=4) and (secs%5 == 0):
-                st.balloons()
-
-        else:
-            st.success("✅ No upcoming events found.")
+        st.error(f"#  {mins:02d}:{secs:02d}")
 
+    else:
+        st.success("✅ No upcoming events found.")
 
 
 @st.dialog("Upload Backup")
@@ -585,6 +823,9 @@ def upload_backup():
         st.rerun()
 
 
+SHEETS_TIME_FORMAT = "%d.%m.%Y %H:%M:%S"
+
+
 def connect_to_docs():
     creds_dict = dict(st.secrets["gcp_service_account"])
     scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
@@ -598,17 +839,14 @@ def connect_to_docs():
 def create_plan_df(planned_sample):
 
     spreadsheet = st.session_state["spreadsheet"]
-    planned_sample_list = ["sample1_plan", "sample2_plan", "sample3_plan", "sample4_plan", "sample5_plan", "sample6_plan", "sample7_plan", "sample8_plan", "sample9_plan"]
 
-    if planned_sample not in planned_sample_list:
-        st.toast(f"{planned_sample} is an invalid name. Must be one of:\n {planned_sample_list}")
+    if planned_sample not in PLANNED_SAMPLES:
+        st.toast(f"{planned_sample} is an invalid name. Must be one of:\n {PLANNED_SAMPLES}")
+        return
 
-    start_time = datetime.now(ZoneInfo("Europe/Berlin")) # Experiment starts now
-    initial_scantimes = pd.date_range(start=start_time, periods=5, freq="3min") # First 15min -> scan every 3min
-    long_term_scantimes = pd.date_range(start=start_time+timedelta(hours=1), periods=24, freq="h")  # after >1h interval = 1h for 24h
-    all_scantimes = initial_scantimes.append(long_term_scantimes)
-    plan_df = pd.DataFrame({planned_sample: all_scantimes})
-    plan_df[planned_sample] = plan_df[planned_sample].dt.strftime("%d.%m.%Y %H:%M:%S") # convert datetime to strings
+    # Same plan as in the db, the worksheets keep local times without timezone
+    plan_times = get_plan_times(planned_sample.removesuffix("_plan"), clock.now())
+    plan_df = pd.DataFrame({planned_sample: plan_times.strftime(SHEETS_TIME_FORMAT)})
 
     # Write plan_df to the corresponding worksheet
     sample_worksheet = spreadsheet.worksheet(planned_sample)
@@ -629,14 +867,12 @@ def create_plan_df(planned_sample):
 def add_scan_to_track_df(tracked_sample):
 
     spreadsheet = st.session_state["spreadsheet"]
-    tracked_sample_list = ["sample1_track", "sample2_track", "sample3_track", "sample4_track", "sample5_track", "sample6_track", "sample7_track", "sample8_track", "sample9_track"]
 
-    if tracked_sample not in tracked_sample_list:
-        return f"{tracked_sample} is an invalid name. Must be one of:\n {tracked_sample_list}"
+    if tracked_sample not in TRACKED_SAMPLES:
+        return f"{tracked_sample} is an invalid name. Must be one of:\n {TRACKED_SAMPLES}"
 
     # Get the current time
-    now = datetime.now(ZoneInfo("Europe/Berlin"))
-    now_string = now.strftime("%d.%m.%Y %H:%M:%S")
+    now_string = clock.now().strftime(SHEETS_TIME_FORMAT)
 
     # Add the current time to the samples record worksheet
     sample_worksheet = spreadsheet.worksheet(tracked_sample)
@@ -655,43 +891,8 @@ def add_scan_to_track_df(tracked_sample):
 #@st.cache_data(ttl=60)
 def aggregate_plan_and_track_data():
     spreadsheet = st.session_state["spreadsheet"]
-    plan_df = pd.DataFrame()
-    planned_sample_list = ["sample1_plan", "sample2_plan", "sample3_plan", "sample4_plan", "sample5_plan", "sample6_plan", "sample7_plan", "sample8_plan", "sample9_plan"]
-    # collect the plan data from all _plan worksheets
-    for planned_sample in planned_sample_list:
-        sample_worksheet = spreadsheet.worksheet(planned_sample)
-        records =  sample_worksheet.get_all_records()
-        records_df = pd.DataFrame(records)
-        plan_df = pd.concat([plan_df, records_df], axis=1)
-
-
-    track_df = pd.DataFrame()
-    tracked_sample_list = ["sample1_track", "sample2_track", "sample3_track", "sample4_track", "sample5_track", "sample6_track", "sample7_track", "sample8_track", "sample9_track"]
-    # collect the plan data from all _plan worksheets
-    for tracked_sample in tracked_sample_list:
-        sample_worksheet = spreadsheet.worksheet(tracked_sample)
-        records =  sample_worksheet.get_all_records()
-        records_df = pd.DataFrame(records)
-        track_df = pd.concat([track_df, records_df], axis=1)
-
-    plan_track_df = pd.concat([plan_df, track_df], axis=1)
-
-    # Convert values to datetime objects
-    time_format = "%d.%m.%Y %H:%M:%S"
-    for col in plan_track_df.columns:
-        plan_track_df[col] = pd.to_datetime(plan_track_df[col], format=time_format, errors="coerce")
-
-
-    # Reshape the df into long format
-    long_plan_track_df = plan_track_df.melt(var_name="sample", value_name="timestamp")
-
-    if not long_plan_track_df.empty:
-        # Split the sample_name into 'sample' and 'source' -> plan/track
-        long_plan_track_df["source"] = long_plan_track_df["sample"].apply(
-            lambda x: "planned" if "_plan" in x else "tracked"
-        )
-        long_plan_track_df["sample"] = long_plan_track_df["sample"].str.replace("_plan", "")
-        long_plan_track_df["sample"] = long_plan_track_df["sample"].str.replace("_track", "")
-        long_plan_track_df.sort_values(by="timestamp", inplace=True)
+    # collect the plan and track data from all worksheets
+    plan_track_df = pd.concat([pd.DataFrame(spreadsheet.worksheet(name).get_all_records())
+                               for name in PLANNED_SAMPLES + TRACKED_SAMPLES], axis=1)
 
-    return long_plan_track_df
\ No newline at end of file
+    return to_long_plan_track_df(plan_track_df, SHEETS_TIME_FORMAT)
@@ -0,0 +1,101 @@
+import numpy as np
+import pandas as pd
+
+
+# Smallest int64 is the NaT sentinel of numpy/pandas, so missing timestamps survive the round trip
+NAT = np.iinfo(np.int64).min
+SOURCES = ("planned", "start", "end", "tracked")
+
+
+class EventStore:
+    # Read-mostly long event table shared by all sessions. Samples and sources are stored as categorical
+    # codes and timestamps as int64 epoch nanoseconds (UTC), instead of object strings and tz-aware columns
+    __slots__ = ("version", "sample_names", "sample_codes", "source_codes", "intervals", "timestamps")
+
+    def __init__(self, version, sample_names, sample_codes, source_codes, intervals, timestamps):
+        self.version = version
+        self.sample_names = sample_names
+        self.sample_codes = sample_codes
+        self.source_codes = source_codes
+        self.intervals = intervals
+        self.timestamps = timestamps
+
+        # Shared arrays must not be changed by a session by accident
+        for array in (sample_codes, source_codes, intervals, timestamps):
+            array.flags.writeable = False
+
+    @classmethod
+    def from_frames(cls, version, sag_df, plan_track_df=None):
+        # sag_df is the raw wide table of get_total_sag_df, plan_track_df the long output of format_plan_track_table
+        sample_parts, source_parts, interval_parts, timestamp_parts = [], [], [], []
+
+        if sag_df is not None and not sag_df.empty:
+            for col, source in (("t_start_target", "planned"), ("t_end_target", "planned"),
+                                ("t_start_is", "start"), ("t_end_is", "end")):
+                sample_parts.append(sag_df["sample"].to_numpy())
+                source_parts.append(np.full(len(sag_df), SOURCES.index(source), dtype=np.int8))
+                interval_parts.append(sag_df["interval"].to_numpy(dtype=np.int32))
+                timestamp_parts.append(to_epoch_ns(sag_df[col]))
+
+        if plan_track_df is not None and not plan_track_df.empty:
+            sample_parts.append(plan_track_df["sample"].to_numpy())
+            source_parts.append(plan_track_df["source"].map(SOURCES.index).to_numpy(dtype=np.int8))
+            interval_parts.append(np.full(len(plan_track_df), -1, dtype=np.int32))
+            timestamp_parts.append(to_epoch_ns(plan_track_df["timestamp"]))
+
+        if not sample_parts:
+            return cls(version, (), np.empty(0, dtype=np.int16), np.empty(0, dtype=np.int8),
+                       np.empty(0, dtype=np.int32), np.empty(0, dtype=np.int64))
+
+        sample_codes, sample_names = pd.factorize(np.concatenate(sample_parts), sort=True)
+        timestamps = np.concatenate(timestamp_parts)
+
+        # Keep the events ordered by time (missing timestamps first), so lookups can use searchsorted
+        order = np.argsort(timestamps, kind="stable")
+
+        return cls(version, tuple(sample_names), sample_codes.astype(np.int16)[order],
+                   np.concatenate(source_parts)[order], np.concatenate(interval_parts)[order], timestamps[order])
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    @property
+    def nbytes(self):
+        return sum(array.nbytes for array in (self.sample_codes, self.source_codes, self.intervals, self.timestamps))
+
+    def sample_mask(self, sample_names):
+        codes = [self.sample_names.index(sample) for sample in sample_names if sample in self.sample_names]
+        return np.isin(self.sample_codes, codes)
+
+    def next_event(self, sample, now, source="planned"):
+        # Next timestamp of the given sample and source after now, or None
+        if sample not in self.sample_names:
+            return None
+        now_ns = pd.Timestamp(now).value
+        start = np.searchsorted(self.timestamps, now_ns, side="right")
+        mask = ((self.sample_codes[start:] == self.sample_names.index(sample))
+                & (self.source_codes[start:] == SOURCES.index(source)))
+        hits = np.flatnonzero(mask)
+        if hits.size == 0:
+            return None
+        return pd.Timestamp(self.timestamps[start + hits[0]], tz="UTC").tz_convert("Europe/Berlin")
+
+    def to_long_df(self, sample_names=None):
+        # Build a transient long frame (e.g. for plotting). Categories keep it small
+        mask = self.timestamps != NAT
+        if sample_names is not None:
+            mask &= self.sample_mask(sample_names)
+        return pd.DataFrame({
+            "sample": pd.Categorical.from_codes(self.sample_codes[mask], categories=list(self.sample_names) or [""]),
+            "source": pd.Categorical.from_codes(self.source_codes[mask], categories=list(SOURCES)),
+            "timestamp": pd.to_datetime(self.timestamps[mask], utc=True).tz_convert("Europe/Berlin"),
+        })
+
+
+def to_epoch_ns(series):
+    # Accepts the raw "%d.%m.%Y %H:%M:%S%z" strings of the db as well as parsed datetimes
+    if not pd.api.types.is_datetime64_any_dtype(series):
+        series = pd.to_datetime(series, format="%d.%m.%Y %H:%M:%S%z", errors="coerce", utc=True)
+    elif series.dt.tz is None:
+        series = series.dt.tz_localize("Europe/Berlin")
+    return series.dt.tz_convert("UTC").dt.tz_localize(None).to_numpy(dtype="datetime64[ns]").view(np.int64)
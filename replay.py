@@ -0,0 +1,204 @@
+# Replays whole SAG campaigns on a simulated clock, far faster than real time. The operators and the CT are
+# simulated, all events go through a storage backend like in the app. Used to validate plans and to size
+# how many samples one CT can handle:
+#
+#   python replay.py --copies 1 2 4 8 --scan-minutes 15
+#   python replay.py --samples sample20 --history     (operator delays taken from the recorded data)
+import argparse
+import heapq
+import itertools
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+import clock
+import samples
+import data_handling_functions as dhf
+from catalog import SagSample
+from storage import MemoryBackend, get_storage
+
+
+class OperatorModel:
+    # Delays of the operators in seconds. Recorded delays are resampled, otherwise they follow gamma
+    # distributions with the given means
+    def __init__(self, start_latency_s=30, end_delay_s=60, handling_s=120, seed=0, recorded_start_latency=None,
+                 recorded_end_delay=None):
+        self.start_latency_s = start_latency_s
+        self.end_delay_s = end_delay_s
+        self.handling_s = handling_s
+        self.recorded_start_latency = recorded_start_latency
+        self.recorded_end_delay = recorded_end_delay
+        self.rng = np.random.default_rng(seed)
+
+    @classmethod
+    def from_history(cls, sag_df, **kwargs):
+        from analytics import compute_interval_stats
+
+        stats_df = compute_interval_stats(sag_df)
+        start_latency = stats_df["start_latency_s"].dropna().clip(lower=0).to_numpy()
+        end_delay = stats_df["end_latency_s"].dropna().clip(lower=0).to_numpy()
+        return cls(recorded_start_latency=start_latency if start_latency.size else None,
+                   recorded_end_delay=end_delay if end_delay.size else None, **kwargs)
+
+    def _draw(self, recorded, mean):
+        if recorded is not None:
+            return float(self.rng.choice(recorded))
+        return float(self.rng.gamma(2, mean / 2)) if mean > 0 else 0.0
+
+    def start_latency(self):
+        return timedelta(seconds=self._draw(self.recorded_start_latency, self.start_latency_s))
+
+    def end_delay(self):
+        return timedelta(seconds=self._draw(self.recorded_end_delay, self.end_delay_s))
+
+    def handling(self):
+        return timedelta(seconds=self._draw(None, self.handling_s))
+
+
+class ReplayEngine:
+    # Discrete event simulation of a campaign: initialize interval -> start leaching -> end leaching ->
+    # wait for a free CT -> scan -> handling -> next interval
+    def __init__(self, sample_names, operator=None, backend=None, start=None, scan_minutes=15, scanners=1):
+        self.sample_names = list(sample_names)
+        self.operator = operator or OperatorModel()
+        self.backend = backend or MemoryBackend()
+        self.clock = clock.SimulatedClock(start)
+        self.scan_duration = timedelta(minutes=scan_minutes)
+        self.scanners = scanners
+
+        self._events = []
+        self._sequence = itertools.count()
+        self._waiting = []
+        self._free_scanners = scanners
+        self._scanner_busy = timedelta()
+        self._scan_waits = []
+        self._target_ends = {}
+        self._started = {}
+        self._finished = {}
+        self._n_scans = 0
+
+    def schedule(self, at, sample, action):
+        heapq.heappush(self._events, (at, next(self._sequence), sample, action))
+
+    def run(self):
+        wall_start = time.perf_counter()
+        t0 = self.clock.now()
+
+        with clock.use_clock(self.clock):
+            self.backend.seed_samples(self.sample_names)
+            for sample in self.sample_names:
+                self._started[sample] = t0
+                self.schedule(t0, sample, "interval")
+
+            while self._events:
+                at, _, sample, action = heapq.heappop(self._events)
+                self.clock.set(at)
+                getattr(self, f"_on_{action}")(sample)
+
+        return self.summarize(t0, time.perf_counter() - wall_start)
+
+    def _on_interval(self, sample):
+        result = self.backend.stamp_event(sample, "interval")
+        if result is None:
+            self._finished[sample] = self.clock.now()
+            return
+        self._target_ends[sample] = datetime.strptime(result["t_end_target"], dhf.TIME_FORMAT)
+        self.schedule(self.clock.now() + self.operator.start_latency(), sample, "start")
+
+    def _on_start(self, sample):
+        self.backend.stamp_event(sample, "start")
+        # The leaching is stopped once the countdown of the target end ran out
+        end = max(self._target_ends[sample], self.clock.now()) + self.operator.end_delay()
+        self.schedule(end, sample, "end")
+
+    def _on_end(self, sample):
+        self.backend.stamp_event(sample, "end")
+        self._waiting.append((self.clock.now(), sample))
+        self._start_scans()
+
+    def _on_scan_done(self, sample):
+        self._free_scanners += 1
+        self._n_scans += 1
+        self.schedule(self.clock.now() + self.operator.handling(), sample, "interval")
+        self._start_scans()
+
+    def _start_scans(self):
+        # First come, first served on the free CTs
+        while self._waiting and self._free_scanners:
+            waiting_since, sample = self._waiting.pop(0)
+            self._free_scanners -= 1
+            self._scan_waits.append(self.clock.now() - waiting_since)
+            self._scanner_busy += self.scan_duration
+            self.schedule(self.clock.now() + self.scan_duration, sample, "scan_done")
+
+    def summarize(self, t0, wall_seconds):
+        span = self.clock.now() - t0
+        span_h = span.total_seconds() / 3600
+
+        # Slip: how much later a sample finished than without any delays and waiting
+        slips = []
+        for sample in self.sample_names:
+            sample_info = samples.sag_samples[sample]
+            ideal = timedelta(minutes=sum(sample_info.intervals)) + len(sample_info.intervals) * self.scan_duration
+            slips.append((self._finished.get(sample, self.clock.now()) - self._started[sample] - ideal)
+                         .total_seconds() / 60)
+        waits = [wait.total_seconds() / 60 for wait in self._scan_waits] or [0]
+
+        return {
+            "samples": len(self.sample_names),
+            "scans": self._n_scans,
+            "campaign_h": span_h,
+            "scans_per_h": self._n_scans / span_h if span_h else 0,
+            "scanner_idle": 1 - self._scanner_busy / (span * self.scanners) if span else 1,
+            "mean_scan_wait_min": float(np.mean(waits)),
+            "max_scan_wait_min": float(np.max(waits)),
+            "mean_slip_min": float(np.mean(slips)),
+            "max_slip_min": float(np.max(slips)),
+            "speedup": span.total_seconds() / wall_seconds if wall_seconds else float("inf"),
+        }
+
+
+def replicate_samples(sample_names, copies):
+    # Copies of the given samples under new names, to see how many samples one CT can take
+    names = []
+    for sample in sample_names:
+        sample_info = samples.sag_samples[sample]
+        for i in range(copies):
+            name = sample if copies == 1 else f"{sample}_copy{i}"
+            if name not in samples.sag_samples:
+                samples.sag_samples[name] = SagSample(name, sample_info.intervals, sample_info.T,
+                                                      sample_info.solution, sample_info.profile)
+            names.append(name)
+    return names
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--samples", nargs="+", default=None, help="SAG samples to replay (default: all)")
+    parser.add_argument("--copies", type=int, nargs="+", default=[1], help="run with n copies of every sample")
+    parser.add_argument("--scan-minutes", type=float, default=15)
+    parser.add_argument("--scanners", type=int, default=1)
+    parser.add_argument("--history", action="store_true", help="resample the operator delays of the recorded data")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    sample_names = args.samples or list(samples.sag_samples)
+    history_df = get_storage("sqlite").query_history() if args.history else None
+
+    print(f"{'samples':>7} {'scans':>6} {'campaign':>9} {'scans/h':>8} {'CT idle':>8} {'wait avg':>9} "
+          f"{'wait max':>9} {'slip avg':>9} {'slip max':>9} {'speedup':>9}")
+    for copies in args.copies:
+        operator = OperatorModel.from_history(history_df, seed=args.seed) if args.history \
+            else OperatorModel(seed=args.seed)
+        engine = ReplayEngine(replicate_samples(sample_names, copies), operator, scan_minutes=args.scan_minutes,
+                              scanners=args.scanners)
+        result = engine.run()
+        print(f"{result['samples']:>7} {result['scans']:>6} {result['campaign_h']:>8.1f}h "
+              f"{result['scans_per_h']:>8.2f} {result['scanner_idle']:>8.0%} {result['mean_scan_wait_min']:>6.1f}min "
+              f"{result['max_scan_wait_min']:>6.1f}min {result['mean_slip_min']:>6.1f}min "
+              f"{result['max_slip_min']:>6.1f}min {result['speedup']:>8.0f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,262 @@
+# Static reports of finished campaigns: per sample the timeline, the target vs actual table and summary
+# statistics as a standalone html page, plus an index of all samples. The samples are rendered in a process
+# pool, a report is only rendered again when the data version of its sample changed.
+#
+#   python reports.py --samples sample20 sample21 --out reports --png
+import argparse
+import io
+import json
+import multiprocessing
+import os
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from html import escape
+import pandas as pd
+import plotly.express as px
+import plotly.offline
+import streamlit as st
+import clock
+import samples
+from analytics import compute_interval_stats, flag_outliers
+from archive import list_archived_samples, load_archived_sag_df
+from data_handling_functions import format_sag_df
+from storage import get_storage
+
+REPORT_DIR = "reports"
+
+PAGE = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>{title}</title>
+<script src="plotly.min.js"></script>
+<style>
+body {{ font-family: sans-serif; background: #1e1e1e; color: #dcdcdc; margin: 2em; }}
+table {{ border-collapse: collapse; margin: 1em 0; }}
+th, td {{ border: 1px solid #444; padding: 4px 8px; text-align: right; }}
+a {{ color: #3498db; }}
+</style>
+</head>
+<body>
+{body}
+</body>
+</html>
+"""
+
+
+def report_path(out_dir, sample, version, extension="html"):
+    return os.path.join(out_dir, f"{sample}_v{version}.{extension}")
+
+
+def summarize_sample(stats_df):
+    finished_df = stats_df[stats_df["actual_min"].notna()]
+    return {
+        "intervals": len(stats_df),
+        "finished": len(finished_df),
+        "leaching_h": round(finished_df["actual_min"].sum() / 60, 2),
+        "mean_deviation_min": round(finished_df["deviation_min"].mean(), 2) if len(finished_df) else None,
+        "max_abs_deviation_min": round(finished_df["deviation_min"].abs().max(), 2) if len(finished_df) else None,
+        "median_start_latency_s": round(stats_df["start_latency_s"].median(), 1)
+        if stats_df["start_latency_s"].notna().any() else None,
+        "outliers": int(stats_df["outlier"].sum()),
+        "first_start": str(stats_df["t_start_is"].min()) if stats_df["t_start_is"].notna().any() else None,
+        "last_end": str(stats_df["t_end_is"].max()) if stats_df["t_end_is"].notna().any() else None,
+    }
+
+
+def timeline_figure(sag_df):
+    fig = px.scatter(format_sag_df(sag_df.copy()), x="timestamp", y="sample", color="source", symbol="source",
+                     color_discrete_map={"planned": "#f39c12", "start": "#2ecc71", "end": "#3498db"})
+    fig.update_traces(marker=dict(size=10))
+    fig.update_layout(plot_bgcolor="#1e1e1e", paper_bgcolor="#1e1e1e", font=dict(color="#dcdcdc"),
+                      xaxis_title_text="Date and Time", height=300, margin=dict(l=60, r=60, t=40, b=60))
+    return fig
+
+
+def render_sample_report(sample, version, sag_df, out_dir, png=False):
+    # Runs in a worker process. Returns the summary, which is also stored next to the report for the index
+    stats_df = flag_outliers(compute_interval_stats(sag_df))
+    summary = {"sample": sample, "version": version, **summarize_sample(stats_df)}
+    sample_info = samples.sag_samples.get(sample)
+
+    fig = timeline_figure(sag_df)
+    if png:
+        # Needs the kaleido package
+        fig.write_image(report_path(out_dir, sample, version, "png"), width=1400, height=300)
+
+    table_df = stats_df[["step", "interval", "T", "t_start_target", "t_start_is", "t_end_target", "t_end_is",
+                         "actual_min", "deviation_min", "start_latency_s", "outlier"]] \
+        .round({"actual_min": 2, "deviation_min": 2, "start_latency_s": 1})
+    summary_df = pd.DataFrame([summary]).drop(columns=["sample", "version"])
+    body = (f"<h1>{escape(sample)}</h1>"
+            f"<p>Solution: {escape(str(sample_info.solution if sample_info else '-'))} &middot; "
+            f"Profile: {escape(str(sample_info.profile if sample_info else '-'))} &middot; "
+            f"Data version {version} &middot; Generated {clock.now():%d.%m.%Y %H:%M}</p>"
+            f"<h2>Summary</h2>{summary_df.to_html(index=False, na_rep='-')}"
+            f"<h2>Timeline</h2>{fig.to_html(full_html=False, include_plotlyjs=False)}"
+            f"<h2>Target vs actual</h2>{table_df.to_html(index=False, na_rep='-')}")
+
+    path = report_path(out_dir, sample, version)
+    with open(path, "w", encoding="utf-8") as file:
+        file.write(PAGE.format(title=escape(sample), body=body))
+    with open(report_path(out_dir, sample, version, "json"), "w") as file:
+        json.dump(summary, file)
+    return summary
+
+
+def render_sample_report_args(args):
+    return render_sample_report(*args)
+
+
+def load_report_data(sample_names):
+    # Live samples come from the backend, archived ones from the parquet archive
+    backend = get_storage()
+    campaign = backend.active_campaign()
+    archived = set(list_archived_samples(campaign)) & set(sample_names)
+    live = [sample for sample in sample_names if sample not in archived]
+    frames = ([backend.query_history(live)] if live else []) \
+        + ([load_archived_sag_df(sorted(archived), campaign=campaign)] if archived else [])
+    if not frames:
+        return {}
+    history_df = pd.concat(frames, ignore_index=True)
+    return {sample: sample_df.reset_index(drop=True) for sample, sample_df in history_df.groupby("sample")}
+
+
+def write_index(out_dir, summaries):
+    rows = "".join(
+        f"<tr><td style='text-align:left'>"
+        f"<a href='{escape(os.path.basename(report_path(out_dir, s['sample'], s['version'])))}'>"
+        f"{escape(s['sample'])}</a></td><td>{s['finished']}/{s['intervals']}</td><td>{s['leaching_h']}</td>"
+        f"<td>{s['mean_deviation_min'] if s['mean_deviation_min'] is not None else '-'}</td>"
+        f"<td>{s['median_start_latency_s'] if s['median_start_latency_s'] is not None else '-'}</td>"
+        f"<td>{s['outliers']}</td></tr>"
+        for s in summaries)
+    body = ("<h1>Campaign report</h1><table><tr><th>Sample</th><th>Finished</th><th>Leaching h</th>"
+            "<th>Mean deviation min</th><th>Median start latency s</th><th>Outliers</th></tr>"
+            f"{rows}</table>")
+    with open(os.path.join(out_dir, "index.html"), "w", encoding="utf-8") as file:
+        file.write(PAGE.format(title="Campaign report", body=body))
+
+
+def generate_reports(sample_names, out_dir=REPORT_DIR, png=False, workers=None):
+    # Returns the paths of the index and all sample reports and how many of them had to be rendered
+    os.makedirs(out_dir, exist_ok=True)
+    # The plotly bundle is shared by all pages instead of being inlined into every report
+    plotly_js_path = os.path.join(out_dir, "plotly.min.js")
+    if not os.path.exists(plotly_js_path):
+        with open(plotly_js_path, "w", encoding="utf-8") as file:
+            file.write(plotly.offline.get_plotlyjs())
+
+    # Only the samples without an up to date report are loaded and rendered
+    versions = get_storage().sample_versions()
+    summaries = {}
+    stale = []
+    for sample in sample_names:
+        version = versions.get(sample, 0)
+        cached_path = report_path(out_dir, sample, version, "json")
+        if os.path.exists(cached_path) and (not png or os.path.exists(report_path(out_dir, sample, version, "png"))):
+            with open(cached_path) as file:
+                summaries[sample] = json.load(file)
+        else:
+            stale.append(sample)
+    report_data = load_report_data(stale)
+    tasks = [(sample, versions.get(sample, 0), report_data[sample], out_dir, png)
+             for sample in stale if sample in report_data]
+
+    if len(tasks) > 1:
+        # Spawned workers, forking the multithreaded streamlit server is not safe
+        with ProcessPoolExecutor(min(workers or os.cpu_count(), len(tasks)),
+                                 mp_context=multiprocessing.get_context("spawn")) as executor:
+            for summary in executor.map(render_sample_report_args, tasks, chunksize=max(1, len(tasks) // 32)):
+                summaries[summary["sample"]] = summary
+    elif tasks:
+        summary = render_sample_report(*tasks[0])
+        summaries[summary["sample"]] = summary
+
+    ordered = [summaries[sample] for sample in sample_names if sample in summaries]
+    write_index(out_dir, ordered)
+    paths = [os.path.join(out_dir, "index.html"), plotly_js_path]
+    for summary in ordered:
+        paths.append(report_path(out_dir, summary["sample"], summary["version"]))
+        if png:
+            paths.append(report_path(out_dir, summary["sample"], summary["version"], "png"))
+    return {"paths": paths, "rendered": len(tasks), "cached": len(ordered) - len(tasks)}
+
+
+def zip_reports(paths):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive_file:
+        for path in paths:
+            archive_file.write(path, os.path.basename(path))
+    return buffer.getvalue()
+
+
+@st.cache_resource
+def get_report_executor():
+    # Report jobs run next to the server, the session only keeps the future
+    return ThreadPoolExecutor(max_workers=1, thread_name_prefix="reports")
+
+
+@st.fragment(run_every="2s")
+def report_progress():
+    # Only polls while a job runs. The finished job is zipped once and the app reruns without this fragment
+    job = st.session_state["report_job"]
+    if not job.done():
+        st.info("Generating reports ...")
+        return
+
+    del st.session_state["report_job"]
+    if job.exception():
+        st.session_state["report_result"] = {"error": job.exception()}
+    else:
+        result = job.result()
+        st.session_state["report_result"] = {**result, "zip": zip_reports(result["paths"]),
+                                             "file_name": f"reports_{clock.now():%Y-%m-%d_%H-%M-%S}.zip"}
+    st.rerun()
+
+
+def report_status():
+    if "report_job" in st.session_state:
+        report_progress()
+        return
+    result = st.session_state.get("report_result")
+    if result is None:
+        return
+    if "error" in result:
+        st.error(f"The reports could not be generated: {result['error']}")
+        return
+
+    st.success(f"{result['rendered']} reports rendered, {result['cached']} unchanged")
+    st.download_button("Download reports", data=result["zip"], file_name=result["file_name"],
+                       use_container_width=True)
+
+
+def report_builder(sample_options):
+    # The same sample can show up as live and archived while it is being archived
+    selected = st.multiselect("Samples", options=list(dict.fromkeys(sample_options)), key="report_selection")
+    if st.button("Generate reports", disabled=not selected, use_container_width=True):
+        st.session_state.pop("report_result", None)
+        st.session_state["report_job"] = get_report_executor().submit(generate_reports, list(selected))
+    report_status()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--samples", nargs="+", default=None, help="default: all live and archived samples")
+    parser.add_argument("--out", default=REPORT_DIR)
+    parser.add_argument("--png", action="store_true", help="also export the timelines as png (needs kaleido)")
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    backend = get_storage()
+    sample_names = args.samples or sorted(set(backend.sample_versions()) & set(samples.sag_samples)
+                                          | set(list_archived_samples(backend.active_campaign())))
+    start = time.perf_counter()
+    result = generate_reports(sample_names, args.out, args.png, args.workers)
+    print(f"{result['rendered']} rendered, {result['cached']} cached in {time.perf_counter() - start:.1f}s: "
+          f"{result['paths'][0]}")
+
+
+if __name__ == "__main__":
+    main()
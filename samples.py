@@ -1,61 +1,11 @@
-samples = {"sample1" : {"T": "90°C",
-           "solution": "KOH + KNa-T",
-           "profile": "2 step",
-           "duration": 24,
-            "inital_repetitions": 4},
+import os
+from catalog import Catalog
 
-"sample2" : {"T": "80°C",
-           "solution": "KOH + KNa-T",
-           "profile": "2 step",
-             "duration": 24},
+# The sample definitions live in samples.yaml (or any .toml/.json file given by CT_TRACKER_CATALOG).
+# samples and sag_samples map the sample names to typed records and follow reloads of the catalog file
+CATALOG_PATH = os.environ.get("CT_TRACKER_CATALOG", os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                                 "samples.yaml"))
 
-"sample3" : {"T": "70°C",
-           "solution": "KOH + KNa-T",
-           "profile": "2 step",
-             "duration": 24},
-
-"sample4" : {"T": "90°C",
-           "solution": "KOH + KNa-T",
-           "profile": "1 step",
-           "duration": 24,
-           "inital_repetitions": 2},
-
-"sample5" : {"T": "80°C",
-           "solution": "KOH + KNa-T",
-           "profile": "1 step",
-             "duration": 24},
-
-"sample6" : {"T": "70°C",
-           "solution": "KOH + KNa-T",
-           "profile": "1 step",
-             "duration": 24},
-
-"sample7" : {"T": "90°C",
-           "solution": "KOH",
-           "profile": "1 step",
-            "duration": 12},
-
-"sample8" : {"T": "80°C",
-           "solution": "KOH",
-           "profile": "1 step",
-           "duration": 12},
-
-"sample9" : {"T": "70°C",
-           "solution": "KOH",
-           "profile": "1 step",
-           "duration": 12},
-}
-
-sag_samples = {"sample20":{"intervals": [10, 10, 10, 10, 20, 30, 30, 10, 10, 10, 10, 20, 30, 30,
-                                         60, 60, 60, 60, 60, 60, 60, 60, 60, 60, 60, 60],
-                           "T": [20, 20, 20, 20, 20, 20, 20, 80, 80, 80, 80, 80, 80, 80,
-                                 80, 80, 80, 80, 80, 80, 80, 80, 80, 80, 80, 80]
-                           },
-
-               "sample21": {"intervals": [10, 10, 10, 10, 20, 30, 30, 60, 60,
-                                          60, 60, 60, 60, 60, 60, 60, 60, 60, 60],
-                            "T": [80, 80, 80, 80, 80, 80, 80, 80, 80, 80,
-                                  80, 80, 80, 80, 80, 80, 80, 80, 80]
-                            }
-
-               }
\ No newline at end of file
+catalog = Catalog(CATALOG_PATH)
+samples = catalog.samples
+sag_samples = catalog.sag_samples
@@ -0,0 +1,291 @@
+# Stamps the actual times from the output of the CT instead of the buttons. Every directory the CT creates in
+# the watched directory is one scan; it is mapped to a sample by its name. The first file of a scan stamps the
+# start, the end is stamped once no file arrived for a while, both with the modification times of the files.
+# Bursts of thousands of projections are debounced into these two events, which are written in one batch.
+#
+#   python scan_watcher.py /data/ct_output
+#   python scan_watcher.py /data/ct_output --pattern "^(?P<sample>sample\d+)_" --quiet 60 --end-action end
+#
+# Without a pattern a directory belongs to the catalog sample its name starts with (e.g. "sample20_scan3").
+# Finished directories are kept in a checkpoint file, a restart only looks at new or unfinished scans.
+# Changes are picked up with inotify (watchdog) where available, otherwise by polling.
+import argparse
+import json
+import logging
+import os
+import re
+import threading
+import time
+from dataclasses import asdict, dataclass
+from datetime import datetime
+import clock
+import samples
+from storage import PartialBatchError, get_storage
+
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+except ImportError:
+    FileSystemEventHandler = object
+    Observer = None
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_FILE = ".scan_watcher.json"
+# Result of an event which could not be recorded
+FAILED = object()
+
+
+def default_pattern():
+    # Longest names first, so "sample2" does not take the directories of "sample20"
+    names = sorted(samples.sag_samples, key=len, reverse=True)
+    return re.compile(rf"^(?P<sample>{'|'.join(map(re.escape, names))})(?:$|[^A-Za-z0-9])")
+
+
+@dataclass
+class OpenScan:
+    sample: str
+    first_mtime: float
+    last_mtime: float
+    n_files: int
+    last_change: float
+    start_sent: bool = False
+
+
+class ScanDebouncer:
+    # Turns file activity per scan directory into one start and one end event
+    def __init__(self, quiet_s=30):
+        self.quiet_s = quiet_s
+        self.scans = {}
+
+    def update(self, key, sample, first_mtime, last_mtime, n_files, now):
+        scan = self.scans.get(key)
+        if scan is None:
+            self.scans[key] = OpenScan(sample, first_mtime, last_mtime, n_files, now)
+        elif n_files != scan.n_files or last_mtime > scan.last_mtime:
+            scan.first_mtime = min(scan.first_mtime, first_mtime)
+            scan.last_mtime = max(scan.last_mtime, last_mtime)
+            scan.n_files = n_files
+            scan.last_change = now
+
+    def due(self, now):
+        # [(key, "start" | "end", sample, mtime)]
+        events = []
+        for key, scan in self.scans.items():
+            if not scan.start_sent:
+                events.append((key, "start", scan.sample, scan.first_mtime))
+            if now - scan.last_change >= self.quiet_s:
+                events.append((key, "end", scan.sample, scan.last_mtime))
+        return events
+
+    def acknowledge(self, events):
+        for key, kind, _, _ in events:
+            if kind == "start":
+                self.scans[key].start_sent = True
+            else:
+                del self.scans[key]
+
+
+class ScanWatcher:
+    def __init__(self, root, backend=None, pattern=None, quiet_s=30, poll_s=2, start_action="start",
+                 end_action="end", checkpoint_path=None, use_inotify=True):
+        self.root = os.path.abspath(root)
+        self.backend = backend or get_storage()
+        self.pattern = re.compile(pattern) if pattern else default_pattern()
+        self.poll_s = poll_s
+        self.actions = {"start": start_action, "end": end_action}
+        self.checkpoint_path = checkpoint_path or os.path.join(self.root, CHECKPOINT_FILE)
+        self.debouncer = ScanDebouncer(quiet_s)
+        self.closed = set()
+        self.use_inotify = use_inotify and Observer is not None
+
+        self._lock = threading.Lock()
+        self._dirty = set()
+        self._stop = threading.Event()
+        self.load_checkpoint()
+
+    def load_checkpoint(self):
+        if not os.path.exists(self.checkpoint_path):
+            return
+        with open(self.checkpoint_path) as file:
+            checkpoint = json.load(file)
+        self.closed = set(checkpoint.get("closed", []))
+        # Unfinished scans continue where they were, their quiet time starts again
+        now = time.monotonic()
+        for key, scan in checkpoint.get("open", {}).items():
+            self.debouncer.scans[key] = OpenScan(**{**scan, "last_change": now})
+
+    def save_checkpoint(self):
+        checkpoint = {"closed": sorted(self.closed),
+                      "open": {key: asdict(scan) for key, scan in self.debouncer.scans.items()}}
+        tmp_path = f"{self.checkpoint_path}.tmp"
+        with open(tmp_path, "w") as file:
+            json.dump(checkpoint, file)
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def sample_of(self, name):
+        match = self.pattern.search(name)
+        if match and match["sample"] in samples.sag_samples:
+            return match["sample"]
+        return None
+
+    def scan_directory(self, name):
+        # Number of files and the first and last modification time below a scan directory
+        n_files, first_mtime, last_mtime = 0, None, None
+        for directory, _, file_names in os.walk(os.path.join(self.root, name)):
+            for file_name in file_names:
+                try:
+                    mtime = os.stat(os.path.join(directory, file_name)).st_mtime
+                except FileNotFoundError:
+                    continue
+                n_files += 1
+                first_mtime = mtime if first_mtime is None else min(first_mtime, mtime)
+                last_mtime = mtime if last_mtime is None else max(last_mtime, mtime)
+        return n_files, first_mtime, last_mtime
+
+    def refresh(self, names=None):
+        # Without names every directory which is not finished yet is looked at (polling and catch up after a
+        # restart), with inotify only the directories that had events
+        if names is None:
+            names = [entry.name for entry in os.scandir(self.root)
+                     if entry.is_dir() and entry.name not in self.closed]
+        now = time.monotonic()
+        for name in names:
+            if name in self.closed:
+                continue
+            sample = self.sample_of(name)
+            if sample is None:
+                logger.info("%s does not belong to any sample, it is ignored", name)
+                self.closed.add(name)
+                continue
+            n_files, first_mtime, last_mtime = self.scan_directory(name)
+            if n_files:
+                self.debouncer.update(name, sample, first_mtime, last_mtime, n_files, now)
+
+    def flush(self):
+        events = self.debouncer.due(time.monotonic())
+        if not events:
+            return []
+        stamps = [(sample, self.actions[kind], datetime.fromtimestamp(mtime, clock.TIMEZONE))
+                  for _, kind, sample, mtime in events]
+        try:
+            results = self.backend.stamp_events(stamps)
+        except PartialBatchError as e:
+            # Only the events which were not written are sent again
+            logger.exception("Recording %d scan events failed in part, retrying the rest one by one", len(events))
+            results = self.stamp_one_by_one(events, stamps, e.committed)
+        except Exception:
+            # The batch was rolled back. One event at a time, so one bad event does not hold back the others
+            logger.exception("Recording %d scan events failed, retrying them one by one", len(events))
+            results = self.stamp_one_by_one(events, stamps)
+
+        recorded = []
+        for event, result in zip(events, results):
+            key, kind, sample, _ = event
+            if result is FAILED:
+                continue
+            if result is None:
+                logger.warning("No open interval left for the %s of %s (%s)", kind, sample, key)
+            else:
+                logger.info("%s %s of %s: %s", key, kind, sample, result)
+            recorded.append(event)
+        # Failed events stay due and are sent again with the next flush
+        self.debouncer.acknowledge(recorded)
+        self.closed |= {key for key, kind, _, _ in recorded if kind == "end"}
+        self.save_checkpoint()
+        return recorded
+
+    def stamp_one_by_one(self, events, stamps, committed=None):
+        # committed: {index: result} of the events which are already written
+        committed = committed or {}
+        results = []
+        failed_keys = set()
+        for i, ((key, kind, sample, _), stamp) in enumerate(zip(events, stamps)):
+            if i in committed:
+                results.append(committed[i])
+                continue
+            # The end of a scan whose start failed would fill the wrong row
+            if key in failed_keys:
+                results.append(FAILED)
+                continue
+            try:
+                results.append(self.backend.stamp_event(*stamp))
+            except Exception:
+                logger.exception("Recording the %s of %s failed (%s)", kind, sample, key)
+                failed_keys.add(key)
+                results.append(FAILED)
+        return results
+
+    def step(self):
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+        if self.use_inotify:
+            self.refresh(dirty)
+        else:
+            self.refresh()
+        return self.flush()
+
+    def mark_dirty(self, path):
+        relative = os.path.relpath(path, self.root)
+        name = relative.split(os.sep, 1)[0]
+        if name not in (os.curdir, os.pardir) and not name.startswith(CHECKPOINT_FILE):
+            with self._lock:
+                self._dirty.add(name)
+
+    def run(self):
+        observer = None
+        if self.use_inotify:
+            observer = Observer()
+            observer.schedule(ChangeHandler(self), self.root, recursive=True)
+            observer.start()
+        # Catch up on everything that happened while the watcher was not running
+        self.refresh()
+        try:
+            while not self._stop.wait(self.poll_s):
+                try:
+                    self.step()
+                except Exception:
+                    # E.g. the share with the scans is gone for a moment, the next step tries again
+                    logger.exception("Scan watcher step failed")
+        finally:
+            if observer:
+                observer.stop()
+                observer.join()
+
+    def stop(self):
+        self._stop.set()
+
+
+class ChangeHandler(FileSystemEventHandler):
+    def __init__(self, watcher):
+        self.watcher = watcher
+
+    def on_any_event(self, event):
+        # Only remembers the scan directory, it is looked at in the next step of the watcher
+        self.watcher.mark_dirty(event.src_path)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("root", help="output directory of the CT")
+    parser.add_argument("--pattern", help="regex with a group 'sample' for the names of the scan directories")
+    parser.add_argument("--quiet", type=float, default=30, help="seconds without new files until a scan has ended")
+    parser.add_argument("--poll", type=float, default=2)
+    parser.add_argument("--start-action", default="start", choices=["interval", "start", "end"])
+    parser.add_argument("--end-action", default="end", choices=["interval", "start", "end"])
+    parser.add_argument("--polling", action="store_true", help="do not use inotify")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+
+    watcher = ScanWatcher(args.root, pattern=args.pattern, quiet_s=args.quiet, poll_s=args.poll,
+                          start_action=args.start_action, end_action=args.end_action,
+                          use_inotify=not args.polling)
+    logger.info("Watching %s (%s)", watcher.root, "inotify" if watcher.use_inotify else "polling")
+    try:
+        watcher.run()
+    except KeyboardInterrupt:
+        watcher.stop()
+
+
+if __name__ == "__main__":
+    main()
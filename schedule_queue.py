@@ -0,0 +1,122 @@
+import heapq
+import threading
+from bisect import bisect_right
+from dataclasses import dataclass
+import pandas as pd
+import samples
+from event_store import to_epoch_ns
+
+
+@dataclass(frozen=True, slots=True, order=True)
+class ScheduledEvent:
+    # Ordered by time first, ties are broken by sample name
+    time_ns: int
+    sample: str
+    kind: str
+    interval: int | None = None
+    T: str | None = None
+    solution: str | None = None
+    profile: str | None = None
+
+    @property
+    def time(self):
+        return pd.Timestamp(self.time_ns, tz="UTC").tz_convert("Europe/Berlin")
+
+    def as_dict(self):
+        return {"time": self.time, "sample": self.sample, "kind": self.kind, "interval": self.interval,
+                "T": self.T, "solution": self.solution, "profile": self.profile}
+
+
+class UpcomingQueue:
+    # Sorted index of all planned events of the plan/track and the SAG experiments. Each sample keeps its own
+    # sorted list, which is only reloaded when the data version of that sample changes
+    def __init__(self, load_sag_df, load_plan_track_df, get_sample_versions):
+        self._load_sag_df = load_sag_df
+        self._load_plan_track_df = load_plan_track_df
+        self._get_sample_versions = get_sample_versions
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._stale = set()
+        self._sample_versions = {}
+        self._sample_events = {}
+        self._events = []
+        self._times = []
+
+    def refresh(self):
+        versions = self._get_sample_versions()
+        with self._lock:
+            all_samples = set(samples.samples) | set(samples.sag_samples)
+            if not self._loaded:
+                changed = all_samples
+            else:
+                changed = {sample for sample in all_samples
+                           if versions.get(sample) != self._sample_versions.get(sample)}
+                # An uploaded plan_track table can change every plan sample at once
+                if versions.get("plan_track") != self._sample_versions.get("plan_track"):
+                    changed |= set(samples.samples)
+                changed |= self._stale & all_samples
+            # Samples removed from the catalog drop out of the queue
+            removed = set(self._sample_events) - all_samples
+            if not changed and not removed:
+                return False
+
+            for sample in removed:
+                del self._sample_events[sample]
+            changed_sag = [sample for sample in changed if sample in samples.sag_samples]
+            if changed_sag:
+                self._sample_events.update(self._build_sag_events(changed_sag))
+            if changed & set(samples.samples):
+                self._sample_events.update(self._build_plan_events(changed & set(samples.samples)))
+
+            # The per sample lists are already sorted, so merging them is linear
+            self._events = list(heapq.merge(*self._sample_events.values()))
+            self._times = [event.time_ns for event in self._events]
+
+            self._sample_versions = dict(versions)
+            self._stale = set()
+            self._loaded = True
+            return True
+
+    def invalidate(self, sample_names):
+        # E.g. changed metadata in the catalog, which is not covered by the data versions
+        with self._lock:
+            self._stale |= set(sample_names)
+
+    def upcoming(self, now, k=10):
+        # The next k events after now as a ready made list
+        now_ns = pd.Timestamp(now).value
+        with self._lock:
+            start = bisect_right(self._times, now_ns)
+            return self._events[start:start + k]
+
+    def _build_sag_events(self, sample_names):
+        sag_df = self._load_sag_df(sample_names)
+        sample_events = {sample: [] for sample in sample_names}
+        if sag_df is None or sag_df.empty:
+            return sample_events
+
+        for col, kind in (("t_start_target", "start"), ("t_end_target", "end")):
+            times = to_epoch_ns(sag_df[col])
+            for time_ns, sample, interval, T in zip(times, sag_df["sample"], sag_df["interval"], sag_df["T"]):
+                if time_ns != pd.NaT.value:
+                    sample_events[sample].append(ScheduledEvent(int(time_ns), sample, kind, int(interval),
+                                                                f"{T}°C", None, "SAG"))
+
+        return {sample: sorted(events) for sample, events in sample_events.items()}
+
+    def _build_plan_events(self, sample_names):
+        plan_track_df = self._load_plan_track_df()
+        sample_events = {sample: [] for sample in sample_names}
+        if plan_track_df is None or plan_track_df.empty:
+            return sample_events
+
+        planned_df = plan_track_df[(plan_track_df["source"] == "planned")
+                                   & plan_track_df["sample"].isin(sample_names)
+                                   & plan_track_df["timestamp"].notna()]
+        times = to_epoch_ns(planned_df["timestamp"])
+        for time_ns, sample in zip(times, planned_df["sample"]):
+            sample_info = samples.samples[sample]
+            sample_events[sample].append(ScheduledEvent(int(time_ns), sample, "scan", None, sample_info["T"],
+                                                        sample_info["solution"], sample_info["profile"]))
+
+        return {sample: sorted(events) for sample, events in sample_events.items()}
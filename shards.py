@@ -0,0 +1,272 @@
+# Campaign scoped storage. Every campaign (a group of samples) has its own sqlite file, a small catalog db
+# lists the campaigns, which samples belong to which one and mirrors their data versions. Connections are
+# kept open in an LRU bounded pool, so a click only touches the shard of its sample and the catalog, no
+# matter how many campaigns there are.
+#
+#   CT_TRACKER_CAMPAIGNS   catalog db (default "campaigns.sqlite")
+#   CT_TRACKER_SHARD_DIR   directory of the campaign dbs (default "campaigns")
+#
+# The existing scans.sqlite is registered as the campaign "default", so nothing has to be migrated.
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+import streamlit as st
+import clock
+import data_handling_functions as dhf
+
+CAMPAIGN_DB_PATH = os.environ.get("CT_TRACKER_CAMPAIGNS", "campaigns.sqlite")
+SHARD_DIR = os.environ.get("CT_TRACKER_SHARD_DIR", "campaigns")
+DEFAULT_CAMPAIGN = "default"
+# sqlite allows 10 attached dbs by default
+MAX_ATTACHED = 8
+
+
+class ConnectionPool:
+    # Open connections by path, the least recently used one is closed when the pool is full. A connection is
+    # only used by one thread at a time
+    def __init__(self, capacity=8):
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        self._connections = OrderedDict()
+
+    @contextmanager
+    def connection(self, path):
+        with self._lock:
+            if path in self._connections:
+                self._connections.move_to_end(path)
+                entry = self._connections[path]
+            else:
+                entry = (dhf.establish_db_connection(path), threading.Lock())
+                self._connections[path] = entry
+                while len(self._connections) > self.capacity:
+                    self._close(self._connections.popitem(last=False)[1])
+
+        connection, connection_lock = entry
+        with connection_lock:
+            try:
+                yield connection
+            except BaseException:
+                connection.rollback()
+                raise
+
+    def open_paths(self):
+        with self._lock:
+            return list(self._connections)
+
+    def discard(self, path):
+        with self._lock:
+            entry = self._connections.pop(path, None)
+        if entry:
+            self._close(entry)
+
+    def close_all(self):
+        with self._lock:
+            entries = list(self._connections.values())
+            self._connections.clear()
+        for entry in entries:
+            self._close(entry)
+
+    @staticmethod
+    def _close(entry):
+        # Waits until the connection is no longer in use
+        connection, connection_lock = entry
+        with connection_lock:
+            connection.close()
+
+
+class CampaignCatalog:
+    def __init__(self, path=None, shard_dir=None, legacy_db_path=None):
+        self.path = path or CAMPAIGN_DB_PATH
+        self.shard_dir = shard_dir or SHARD_DIR
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(self.path, check_same_thread=False)
+        # Catalogs of older versions keyed campaign_samples by the sample only
+        columns = self._connection.execute("PRAGMA table_info(campaign_samples)").fetchall()
+        migrate = any(name == "sample" and pk == 1 for _, name, _, _, _, pk in columns)
+        if migrate:
+            self._connection.execute("ALTER TABLE campaign_samples RENAME TO campaign_samples_old")
+        self._connection.executescript('''
+            CREATE TABLE IF NOT EXISTS campaigns (
+                name TEXT PRIMARY KEY,
+                path TEXT NOT NULL,
+                created TEXT NOT NULL,
+                active INTEGER NOT NULL DEFAULT 0,
+                version INTEGER NOT NULL DEFAULT 0
+            );
+            -- A sample name can be used again in later campaigns, each campaign keeps its own rows of it
+            CREATE TABLE IF NOT EXISTS campaign_samples (
+                campaign TEXT NOT NULL REFERENCES campaigns(name),
+                sample TEXT NOT NULL,
+                version INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (campaign, sample)
+            );
+            -- Versions of deleted campaigns and switches of the active one, so the total data version never
+            -- goes back and changes whenever another campaign is shown
+            CREATE TABLE IF NOT EXISTS retired_versions (
+                id INTEGER PRIMARY KEY CHECK (id = 0),
+                version INTEGER NOT NULL
+            );
+            INSERT OR IGNORE INTO retired_versions (id, version) VALUES (0, 0);
+        ''')
+        if migrate:
+            self._connection.executescript('''
+                INSERT INTO campaign_samples (campaign, sample, version)
+                SELECT campaign, sample, version FROM campaign_samples_old;
+                DROP TABLE campaign_samples_old;
+            ''')
+        if not self.campaigns():
+            self.create_campaign(DEFAULT_CAMPAIGN, path=legacy_db_path or dhf.DB_PATH)
+
+    def _execute(self, sql, params=()):
+        with self._lock:
+            rows = self._connection.execute(sql, params).fetchall()
+            self._connection.commit()
+            return rows
+
+    def campaigns(self):
+        return [{"name": name, "path": path, "created": created, "active": bool(active), "version": version}
+                for name, path, created, active, version in
+                self._execute("SELECT name, path, created, active, version FROM campaigns ORDER BY created")]
+
+    def create_campaign(self, name, path=None, activate=True):
+        if not name.isidentifier():
+            raise ValueError(f"Invalid campaign name: {name!r}. Use letters, digits and underscores")
+        os.makedirs(self.shard_dir, exist_ok=True)
+        path = path or os.path.join(self.shard_dir, f"{name}.sqlite")
+        self._execute("INSERT INTO campaigns (name, path, created) VALUES (?, ?, ?)",
+                      (name, path, clock.now().isoformat()))
+        if activate or len(self.campaigns()) == 1:
+            self.set_active(name)
+        return path
+
+    def delete_campaign(self, name):
+        with self._lock:
+            self._connection.execute('''
+                UPDATE retired_versions
+                SET version = version + 1 + (SELECT COALESCE(SUM(version), 0) FROM campaigns WHERE name = ?)
+            ''', (name,))
+            self._connection.execute("DELETE FROM campaign_samples WHERE campaign = ?", (name,))
+            self._connection.execute("DELETE FROM campaigns WHERE name = ?", (name,))
+            self._connection.commit()
+
+    def set_active(self, name):
+        with self._lock:
+            self._connection.execute("UPDATE campaigns SET active = (name = ?)", (name,))
+            self._connection.execute("UPDATE retired_versions SET version = version + 1")
+            self._connection.commit()
+
+    def active_campaign(self):
+        rows = self._execute("SELECT name FROM campaigns WHERE active ORDER BY created DESC LIMIT 1")
+        return rows[0][0] if rows else None
+
+    def shard_path(self, campaign):
+        rows = self._execute("SELECT path FROM campaigns WHERE name = ?", (campaign,))
+        if not rows:
+            raise KeyError(f"Unknown campaign: {campaign}")
+        return rows[0][0]
+
+    def _resolved(self, campaigns=None):
+        # {sample: (campaign, version)}, a name is resolved to the active campaign if it is part of it, otherwise
+        # to the latest campaign which has it
+        rows = self._execute('''
+            SELECT cs.sample, cs.campaign, cs.version FROM campaign_samples cs JOIN campaigns c ON c.name = cs.campaign
+            ORDER BY c.active DESC, c.created DESC, c.name DESC
+        ''')
+        resolved = {}
+        for sample, campaign, version in rows:
+            if campaigns is None or campaign in campaigns:
+                resolved.setdefault(sample, (campaign, version))
+        return resolved
+
+    def campaign_of(self, sample):
+        return self._resolved().get(sample, (None, 0))[0]
+
+    def assign(self, sample, campaign):
+        # The sample is added to the campaign, the campaigns which had it before keep their rows
+        self._execute("INSERT OR IGNORE INTO campaign_samples (campaign, sample) VALUES (?, ?)", (campaign, sample))
+
+    def samples_of(self, campaigns=None):
+        # {sample: campaign} of the resolved names
+        return {sample: campaign for sample, (campaign, _) in self._resolved(campaigns).items()}
+
+    def campaign_samples(self, campaigns=None):
+        # [(campaign, sample)] of every campaign, also the names used again in a later one
+        rows = self._execute("SELECT campaign, sample FROM campaign_samples ORDER BY campaign, sample")
+        return [(campaign, sample) for campaign, sample in rows if campaigns is None or campaign in campaigns]
+
+    def sync_versions(self, campaign, sample_versions, total_version):
+        # Mirrors the data versions of a shard, so reading them never opens the shards
+        with self._lock:
+            self._connection.executemany("UPDATE campaign_samples SET version = ? WHERE sample = ? AND campaign = ?",
+                                         [(version, sample, campaign) for sample, version in sample_versions.items()])
+            self._connection.execute("UPDATE campaigns SET version = ? WHERE name = ?", (total_version, campaign))
+            self._connection.commit()
+
+    def data_version(self):
+        return self._execute("SELECT (SELECT COALESCE(SUM(version), 0) FROM campaigns) + version "
+                             "FROM retired_versions")[0][0]
+
+    def sample_versions(self):
+        return {sample: version for sample, (_, version) in self._resolved().items()}
+
+    def max_sample_versions(self, campaigns):
+        # {sample: the highest version of the name in any of the campaigns}
+        rows = self._execute("SELECT campaign, sample, version FROM campaign_samples")
+        versions = {}
+        for campaign, sample, version in rows:
+            if campaign in campaigns:
+                versions[sample] = max(versions.get(sample, 0), version)
+        return versions
+
+
+def read_attached(shard_tables, read):
+    # Cross campaign reads: the shards are attached to a temporary connection in batches. shard_tables maps a
+    # key to the (shard path, table) to read, read() gets the connection and {key: qualified table name}
+    results = []
+    items = list(shard_tables.items())
+    paths = list(dict.fromkeys(path for _, (path, _) in items))
+    for start in range(0, len(paths), MAX_ATTACHED):
+        batch = paths[start:start + MAX_ATTACHED]
+        aliases = {path: f"shard{i}" for i, path in enumerate(batch)}
+        connection = sqlite3.connect(":memory:")
+        try:
+            for path, alias in aliases.items():
+                connection.execute(f"ATTACH DATABASE ? AS {alias}", (path,))
+            tables = {key: f"{aliases[path]}.{table}" for key, (path, table) in items if path in aliases}
+            results.append(read(connection, tables))
+        finally:
+            connection.close()
+    return results
+
+
+@st.dialog("Delete Campaign")
+def delete_campaign_dialog(backend, name):
+    st.error(f"All data of the campaign {name} will be deleted. The other campaigns are kept.")
+    if st.text_input(f"Type '{name}' to proceed") == name:
+        backend.delete_campaign(name)
+        st.rerun()
+
+
+def campaign_controls(backend):
+    campaigns = [campaign["name"] for campaign in backend.catalog.campaigns()]
+    active = backend.catalog.active_campaign()
+    cols = st.columns([0.4, 0.3, 0.15, 0.15], vertical_alignment="bottom")
+
+    selected = cols[0].selectbox("Active campaign", options=campaigns, index=campaigns.index(active))
+    if selected != active:
+        backend.catalog.set_active(selected)
+        st.rerun()
+
+    new_name = cols[1].text_input("New campaign", placeholder="e.g. sag_2025_07")
+    if cols[2].button("Create", disabled=not new_name, use_container_width=True):
+        try:
+            backend.create_campaign(new_name)
+        except (ValueError, sqlite3.IntegrityError) as e:
+            st.error(f"The campaign could not be created: {e}")
+        else:
+            st.rerun()
+
+    if cols[3].button("Delete campaign", use_container_width=True):
+        delete_campaign_dialog(backend, selected)
@@ -0,0 +1,668 @@
+import json
+import os
+import threading
+from datetime import timedelta
+import pandas as pd
+import streamlit as st
+import clock
+import samples
+import data_handling_functions as dhf
+import backup
+import shards
+from schedule_queue import UpcomingQueue
+
+try:
+    import duckdb
+except ImportError:
+    duckdb = None
+
+
+class PartialBatchError(Exception):
+    # Only a part of a batch could be written. committed maps the index of every written event to its result
+    def __init__(self, committed):
+        super().__init__(f"Only {len(committed)} events of the batch were written")
+        self.committed = committed
+
+
+class NothingToStampError(Exception):
+    # A required event of a batch found no open interval, nothing of the batch was written
+    def __init__(self, sample, action):
+        super().__init__(f"No open interval left for {action} of {sample}")
+        self.sample = sample
+        self.action = action
+
+
+# Storage interface of the tracker. The UI only talks to a backend, never to sql:
+#   seed_samples   create the intervals of SAG samples
+#   stamp_event    "interval" (initialize the next interval), "start" or "end" (actual times) of a sample
+#   stamp_events   several (sample, action, timestamp) at once, all or nothing where the backend has transactions.
+#                  A batch with an idempotency key is only written once, a retry returns the stored results.
+#                  With required, an event without an open interval fails the batch instead of returning None
+#   query_schedule next planned events of all samples
+#   query_history  wide SAG table with parsed timestamps, filtered by sample and time range (all live
+#                  samples by default, the duckdb backend also reads archived samples when they are named)
+#   bulk_export    wide SAG table exactly as stored, e.g. for csv backups
+#   query_page     one page of the long SAG table for the data browser and the number of matching rows
+#   completed_samples  the samples whose intervals all have an actual end
+#   drop_samples   remove the live intervals of samples, e.g. once they are archived
+#   active_campaign / campaign_of  campaign new samples are seeded into / a sample is read from, the archive is
+#                  kept per campaign. Backends without campaigns use the default one
+# reschedule_samples applies changed catalog definitions to the intervals without any recorded time.
+class StorageBackend:
+    ACTIONS = ("interval", "start", "end")
+
+    def __init__(self):
+        self._queue = UpcomingQueue(self.bulk_export, self.query_plan_track, self.sample_versions)
+        self._requests = {}
+
+    def seed_samples(self, sample_names):
+        raise NotImplementedError
+
+    def stamp_event(self, sample, action, timestamp=None):
+        raise NotImplementedError
+
+    def stamp_events(self, events, idempotency_key=None, required=False):
+        if idempotency_key is not None and idempotency_key in self._requests:
+            return self._requests[idempotency_key]
+        results = []
+        for sample, action, timestamp in events:
+            results.append(self.stamp_event(sample, action, timestamp))
+            if required and results[-1] is None:
+                raise NothingToStampError(sample, action)
+        if idempotency_key is not None:
+            self._requests[idempotency_key] = results
+        return results
+
+    def reschedule_samples(self, sample_names):
+        # Metadata changes are not covered by the data versions, so the queue is told explicitly
+        self._queue.invalidate(sample_names)
+
+    def query_schedule(self, now=None, k=10):
+        self._queue.refresh()
+        return self._queue.upcoming(now or clock.now(), k)
+
+    def query_history(self, sample_names=None, start=None, end=None):
+        raise NotImplementedError
+
+    def bulk_export(self, sample_names=None):
+        raise NotImplementedError
+
+    def query_page(self, sample_names, sources=None, start=None, end=None, sort_by="timestamp", descending=False,
+                   page=0, page_size=50):
+        # Paged in pandas from the history, backends with sql page in the db
+        return page_history(self.query_history(sample_names), sources, start, end, sort_by, descending, page,
+                            page_size)
+
+    def completed_samples(self, sample_names):
+        sag_df = self.bulk_export(sample_names)
+        counts = sag_df.groupby("sample").agg(n_rows=("interval", "size"), n_ended=("t_end_is", "count"))
+        return [sample for sample in sample_names
+                if sample in counts.index and 0 < counts.at[sample, "n_rows"] == counts.at[sample, "n_ended"]]
+
+    def drop_samples(self, sample_names):
+        raise NotImplementedError
+
+    def data_version(self):
+        raise NotImplementedError
+
+    def sample_versions(self):
+        raise NotImplementedError
+
+    def query_plan_track(self):
+        # Only the sqlite backend still carries the legacy plan/track experiment
+        return None
+
+    def active_campaign(self):
+        return dhf.DEFAULT_CAMPAIGN
+
+    def campaign_of(self, sample):
+        return self.active_campaign()
+
+    def check_action(self, sample, action):
+        if sample not in samples.sag_samples:
+            raise KeyError(f"Unknown sample: {sample}")
+        if action not in self.ACTIONS:
+            raise ValueError(f"Unknown action: {action}. Must be one of {self.ACTIONS}")
+
+
+class SQLiteBackend(StorageBackend):
+    # Transactional path on scans.sqlite, implemented by the functions in data_handling_functions
+
+    def seed_samples(self, sample_names):
+        for sample in sample_names:
+            dhf.create_new_sag_in_db(sample)
+
+    def reschedule_samples(self, sample_names):
+        for sample in sample_names:
+            if sample in samples.sag_samples:
+                dhf.reschedule_sag_sample(sample)
+        super().reschedule_samples(sample_names)
+
+    def stamp_event(self, sample, action, timestamp=None):
+        self.check_action(sample, action)
+        if action == "interval":
+            return dhf.start_next_leaching_interval(sample, timestamp)
+        return dhf.stamp_first_empty(sample, f"t_{action}_is", timestamp)
+
+    def stamp_events(self, events, idempotency_key=None, required=False):
+        for sample, action, _ in events:
+            self.check_action(sample, action)
+        connection = dhf.establish_db_connection()
+        try:
+            connection.execute("BEGIN IMMEDIATE")
+            indexed_events = [(i, *event) for i, event in enumerate(events)]
+            results = stamp_batch(connection, indexed_events, idempotency_key, required)
+            results = [results[i] for i in range(len(events))]
+            connection.commit()
+        except Exception:
+            connection.rollback()
+            raise
+        finally:
+            connection.close()
+        return results
+
+    def query_history(self, sample_names=None, start=None, end=None):
+        sag_df = self.bulk_export(sample_names)
+        return filter_history(parse_sag_times(sag_df), start, end)
+
+    def bulk_export(self, sample_names=None):
+        return dhf.get_total_sag_df(dhf.get_live_sag_samples() if sample_names is None else sample_names)
+
+    def query_page(self, sample_names, sources=None, start=None, end=None, sort_by="timestamp", descending=False,
+                   page=0, page_size=50):
+        return dhf.get_sag_page(sample_names, sources, start, end, sort_by, descending, page, page_size)
+
+    def completed_samples(self, sample_names):
+        return dhf.get_completed_sag_samples(sample_names)
+
+    def drop_samples(self, sample_names):
+        for sample in sample_names:
+            dhf.drop_sag_sample(sample)
+
+    def data_version(self):
+        return dhf.get_data_version()
+
+    def sample_versions(self):
+        return dhf.get_sample_versions()
+
+    def query_plan_track(self):
+        return dhf.format_plan_track_table()
+
+
+class MemoryBackend(StorageBackend):
+    # Keeps the SAG tables as lists of rows in memory. Used for tests, benchmarks and simulations
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tables = {}
+        self._versions = {}
+        super().__init__()
+
+    def seed_samples(self, sample_names):
+        with self._lock:
+            for sample in sample_names:
+                if sample in self._tables or dhf.is_archived(sample):
+                    continue
+                sample_info = samples.sag_samples[sample]
+                self._tables[sample] = self._new_rows(sample_info)
+                self._bump(sample)
+
+    def reschedule_samples(self, sample_names):
+        with self._lock:
+            for sample in sample_names:
+                if sample not in self._tables or sample not in samples.sag_samples:
+                    continue
+                kept_rows = [row for row in self._tables[sample]
+                             if any(row[col] is not None for col in dhf.SAG_TIME_COLUMNS)]
+                self._tables[sample] = kept_rows + self._new_rows(samples.sag_samples[sample])[len(kept_rows):]
+                self._bump(sample)
+        super().reschedule_samples(sample_names)
+
+    def stamp_event(self, sample, action, timestamp=None):
+        self.check_action(sample, action)
+        timestamp = timestamp or clock.now()
+        column = "t_start_target" if action == "interval" else f"t_{action}_is"
+
+        with self._lock:
+            rows = self._tables.get(sample, [])
+            rowid = next((i for i, row in enumerate(rows, start=1) if row[column] is None), None)
+            if rowid is None:
+                return None
+
+            row = rows[rowid - 1]
+            if action == "interval":
+                row["t_start_target"] = timestamp.strftime(dhf.TIME_FORMAT)
+                row["t_end_target"] = (timestamp + timedelta(minutes=row["interval"])).strftime(dhf.TIME_FORMAT)
+                result = {"rowid": rowid, "t_start_target": row["t_start_target"],
+                          "t_end_target": row["t_end_target"]}
+            else:
+                row[column] = timestamp.strftime(dhf.TIME_FORMAT)
+                result = {"rowid": rowid, column: row[column]}
+            self._bump(sample)
+
+        return result
+
+    def query_history(self, sample_names=None, start=None, end=None):
+        return filter_history(parse_sag_times(self.bulk_export(sample_names)), start, end)
+
+    def bulk_export(self, sample_names=None):
+        with self._lock:
+            records = [{**row, "sample": sample} for sample, rows in self._tables.items()
+                       if sample_names is None or sample in sample_names for row in rows]
+        return pd.DataFrame(records, columns=dhf.SAG_COLUMNS + ["sample"])
+
+    def drop_samples(self, sample_names):
+        with self._lock:
+            for sample in sample_names:
+                if self._tables.pop(sample, None) is not None:
+                    self._bump(sample)
+
+    def data_version(self):
+        return self._versions.get("_all", 0)
+
+    def sample_versions(self):
+        with self._lock:
+            return {name: version for name, version in self._versions.items() if name != "_all"}
+
+    @staticmethod
+    def _new_rows(sample_info):
+        return [{"interval": interval, "t_start_target": None, "t_end_target": None, "t_start_is": None,
+                 "t_end_is": None, "T": T}
+                for interval, T in zip(sample_info.intervals, sample_info.T)]
+
+    def _bump(self, sample):
+        for name in (sample, "_all"):
+            self._versions[name] = self._versions.get(name, 0) + 1
+
+
+class DuckDBBackend(SQLiteBackend):
+    # Writes stay on the sqlite path, history queries run in an embedded duckdb over the live sqlite file
+    # and the parquet archive
+    def __init__(self, db_path=None, archive_dir=None):
+        if duckdb is None:
+            raise ImportError("The duckdb storage backend needs the 'duckdb' package")
+        super().__init__()
+        self._db_path = db_path or dhf.DB_PATH
+        self._archive_dir = archive_dir or dhf.ARCHIVE_DIR
+        self._lock = threading.Lock()
+        self._connection = duckdb.connect()
+
+        # The sqlite extension lets duckdb scan scans.sqlite directly. Without it (e.g. offline) the live
+        # tables are handed over from the sqlite backend
+        try:
+            self._connection.execute("INSTALL sqlite; LOAD sqlite")
+            self._sqlite_scan = True
+        except duckdb.Error:
+            self._sqlite_scan = False
+
+    def query_history(self, sample_names=None, start=None, end=None):
+        live_samples = [sample for sample in dhf.get_live_sag_samples()
+                        if sample_names is None or sample in sample_names]
+        archive_files = [path for path in (dhf.get_archive_path(sample, archive_dir=self._archive_dir)
+                                           for sample in sample_names or [])
+                         if os.path.exists(path)]
+
+        time_cols = ", ".join(f"strptime({col}, '{dhf.TIME_FORMAT}') AS {col}" for col in dhf.SAG_TIME_COLUMNS)
+        selects = []
+        params = []
+        with self._lock:
+            if live_samples and self._sqlite_scan:
+                for sample in live_samples:
+                    selects.append(f"SELECT interval, {time_cols}, T, ? AS sample FROM sqlite_scan(?, ?)")
+                    params.extend([sample, self._db_path, sample])
+            elif live_samples:
+                self._connection.register("live_sag", dhf.get_total_sag_df(live_samples))
+                selects.append(f"SELECT interval, {time_cols}, T, sample FROM live_sag")
+            if archive_files:
+                selects.append(f"SELECT {', '.join(dhf.SAG_COLUMNS)}, sample FROM read_parquet(?)")
+                params.append(archive_files)
+
+            if not selects:
+                return pd.DataFrame(columns=dhf.SAG_COLUMNS + ["sample"])
+
+            # Overlap of the planned interval with the requested time range
+            conditions = []
+            if start is not None:
+                conditions.append("t_end_target >= ?")
+                params.append(dhf.to_utc_timestamp(start).to_pydatetime())
+            if end is not None:
+                conditions.append("t_start_target <= ?")
+                params.append(dhf.to_utc_timestamp(end).to_pydatetime())
+            where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+            self._connection.execute("SET TimeZone = 'UTC'")
+            sag_df = self._connection.execute(
+                f"SELECT * FROM ({' UNION ALL BY NAME '.join(selects)}) {where} ORDER BY sample, t_start_target",
+                params).df()
+
+        for col in dhf.SAG_TIME_COLUMNS:
+            sag_df[col] = pd.to_datetime(sag_df[col], utc=True).dt.tz_convert("Europe/Berlin")
+        return sag_df[dhf.SAG_COLUMNS + ["sample"]]
+
+
+class ShardedBackend(StorageBackend):
+    # One sqlite file per campaign, see shards.py. New samples are seeded into the active campaign. Writes
+    # and reads of one campaign use its pooled connection, reads over several campaigns attach their shards.
+    # The data versions are read from the mirror in the campaign catalog
+    def __init__(self, catalog=None, pool_size=8):
+        self.catalog = catalog or shards.CampaignCatalog()
+        self.pool = shards.ConnectionPool(pool_size)
+        self._synced_versions = {}
+        super().__init__()
+        # The active campaign is opened right away, the others on first use
+        active = self.catalog.active_campaign()
+        if active:
+            with self._shard(active) as connection:
+                self._sync(active, connection)
+
+    def _shard(self, campaign):
+        return self.pool.connection(self.catalog.shard_path(campaign))
+
+    def _campaign(self, sample):
+        campaign = self.catalog.campaign_of(sample)
+        if campaign is None:
+            raise KeyError(f"{sample} is not part of any campaign")
+        return campaign
+
+    def _campaigns_of(self, sample_names):
+        # {sample: campaign} of the given samples which are part of a campaign
+        return {sample: campaign for sample, campaign in self.catalog.samples_of().items() if sample in sample_names}
+
+    def _group_by_campaign(self, sample_names):
+        groups = {}
+        for sample, campaign in self._campaigns_of(sample_names).items():
+            groups.setdefault(campaign, []).append(sample)
+        return groups
+
+    def _sync(self, campaign, connection):
+        versions = dict(connection.execute("SELECT name, version FROM data_versions").fetchall())
+        if self._synced_versions.get(campaign) != versions:
+            total_version = versions.pop("_all", 0)
+            self.catalog.sync_versions(campaign, versions, total_version)
+            versions["_all"] = total_version
+            self._synced_versions[campaign] = versions
+
+    def _advance_versions(self, campaign, sample_names, past_versions, connection):
+        # A name used in several campaigns resolves to another one after a switch or delete. Its version moves on
+        # past the ones it had there, so it never goes back
+        versions = dict(connection.execute("SELECT name, version FROM data_versions").fetchall())
+        behind = {sample: past_versions[sample] for sample in sample_names
+                  if sample in past_versions and versions.get(sample, 0) <= past_versions[sample]}
+        if behind:
+            dhf.advance_data_versions(connection.cursor(), behind, {"_all": versions.get("_all", 0)})
+            connection.commit()
+        self._sync(campaign, connection)
+
+    def seed_samples(self, sample_names):
+        # The samples are seeded into the active campaign. A name of an earlier campaign is used again, its rows
+        # there are kept and read with bulk_export(campaigns=...)
+        active = self.catalog.active_campaign()
+        others = [campaign["name"] for campaign in self.catalog.campaigns() if campaign["name"] != active]
+        past_versions = self.catalog.max_sample_versions(others)
+        with self._shard(active) as connection:
+            for sample in sample_names:
+                self.catalog.assign(sample, active)
+                dhf.create_new_sag_in_db(sample, connection, active)
+            connection.commit()
+            self._advance_versions(active, sample_names, past_versions, connection)
+
+    def reschedule_samples(self, sample_names):
+        for sample in sample_names:
+            campaign = self.catalog.campaign_of(sample)
+            if campaign is None or sample not in samples.sag_samples:
+                continue
+            with self._shard(campaign) as connection:
+                dhf.reschedule_sag_sample(sample, connection, campaign)
+                connection.commit()
+                self._sync(campaign, connection)
+        super().reschedule_samples(sample_names)
+
+    def stamp_event(self, sample, action, timestamp=None):
+        self.check_action(sample, action)
+        campaign = self._campaign(sample)
+        with self._shard(campaign) as connection:
+            result = stamp_with_connection(connection, sample, action, timestamp)
+            connection.commit()
+            self._sync(campaign, connection)
+        return result
+
+    def stamp_events(self, events, idempotency_key=None, required=False):
+        # All or nothing: every campaign of the batch is written in its own transaction, they are only committed
+        # once all events are written. Should a commit still fail after others went through, the committed
+        # events are reported with a PartialBatchError. The idempotency key is stored in every shard of the
+        # batch, so a retry only writes the events of the shards which were not committed
+        results = {}
+        events_by_campaign = {}
+        for i, (sample, action, timestamp) in enumerate(events):
+            self.check_action(sample, action)
+            events_by_campaign.setdefault(self._campaign(sample), []).append((i, sample, action, timestamp))
+
+        if len(events_by_campaign) == 1:
+            [(campaign, campaign_events)] = events_by_campaign.items()
+            with self._shard(campaign) as connection:
+                connection.execute("BEGIN IMMEDIATE")
+                results.update(stamp_batch(connection, campaign_events, idempotency_key, required))
+                connection.commit()
+                self._sync(campaign, connection)
+            return [results[i] for i in range(len(events))]
+
+        # Several campaigns open their own connections, holding several pooled ones could wait on the pool.
+        # The shards are locked in the order of their names, so two batches never wait for each other
+        campaigns = sorted(events_by_campaign)
+        connections = {campaign: dhf.establish_db_connection(self.catalog.shard_path(campaign))
+                       for campaign in campaigns}
+        committed = []
+        try:
+            try:
+                for campaign in campaigns:
+                    connections[campaign].execute("BEGIN IMMEDIATE")
+                    results.update(stamp_batch(connections[campaign], events_by_campaign[campaign], idempotency_key,
+                                               required))
+                for campaign in campaigns:
+                    connections[campaign].commit()
+                    committed.append(campaign)
+            except Exception as e:
+                for campaign in campaigns:
+                    if campaign not in committed:
+                        connections[campaign].rollback()
+                if committed:
+                    raise PartialBatchError({i: results[i] for campaign in committed
+                                             for i, _, _, _ in events_by_campaign[campaign]}) from e
+                raise
+            finally:
+                for campaign in committed:
+                    self._sync(campaign, connections[campaign])
+        finally:
+            for connection in connections.values():
+                connection.close()
+        return [results[i] for i in range(len(events))]
+
+    def query_history(self, sample_names=None, start=None, end=None, campaigns=None):
+        return filter_history(parse_sag_times(self.bulk_export(sample_names, campaigns)), start, end)
+
+    def bulk_export(self, sample_names=None, campaigns=None):
+        # All samples of the active campaign by default, a name is read from the campaign it resolves to. With
+        # campaigns the rows of every one of them are read, marked with a campaign column
+        if campaigns is not None:
+            pairs = self.catalog.campaign_samples(campaigns)
+            return self._read_shards([(campaign, sample) for campaign, sample in pairs
+                                      if sample_names is None or sample in sample_names])
+
+        sample_campaigns = self.catalog.samples_of(None if sample_names is not None
+                                                   else [self.catalog.active_campaign()])
+        sample_campaigns = {sample: campaign for sample, campaign in sample_campaigns.items()
+                            if (sample in sample_names if sample_names is not None else sample in samples.sag_samples)}
+        campaigns = set(sample_campaigns.values())
+        if not campaigns:
+            return pd.DataFrame(columns=dhf.SAG_COLUMNS + ["sample"])
+
+        if len(campaigns) == 1:
+            with self._shard(campaigns.pop()) as connection:
+                return dhf.get_total_sag_df(list(sample_campaigns), connection)
+        sag_df = self._read_shards([(campaign, sample) for sample, campaign in sample_campaigns.items()])
+        return sag_df[dhf.SAG_COLUMNS + ["sample"]]
+
+    def _read_shards(self, campaign_samples):
+        def read(connection, tables):
+            sample_dfs = []
+            for (campaign, sample), table in tables.items():
+                schema, name = table.split(".")
+                # Archived samples have no table anymore
+                if connection.execute(f"SELECT 1 FROM {schema}.sqlite_master WHERE type = 'table' AND name = ?",
+                                      (name,)).fetchone():
+                    sample_dfs.append(pd.read_sql(f"SELECT * FROM {table}", connection)
+                                      .assign(sample=sample, campaign=campaign))
+            return pd.concat(sample_dfs, ignore_index=True) if sample_dfs else None
+
+        shard_tables = {(campaign, sample): (self.catalog.shard_path(campaign), sample)
+                        for campaign, sample in campaign_samples}
+        sag_dfs = [sag_df for sag_df in shards.read_attached(shard_tables, read) if sag_df is not None]
+        if not sag_dfs:
+            return pd.DataFrame(columns=dhf.SAG_COLUMNS + ["sample", "campaign"])
+        return pd.concat(sag_dfs, ignore_index=True)[dhf.SAG_COLUMNS + ["sample", "campaign"]]
+
+    def query_page(self, sample_names, sources=None, start=None, end=None, sort_by="timestamp", descending=False,
+                   page=0, page_size=50):
+        # Samples of one campaign are paged in their shard, several campaigns in pandas
+        campaigns = set(self._campaigns_of(sample_names).values())
+        if len(campaigns) != 1:
+            return super().query_page(sample_names, sources, start, end, sort_by, descending, page, page_size)
+        with self._shard(campaigns.pop()) as connection:
+            return dhf.get_sag_page(sample_names, sources, start, end, sort_by, descending, page, page_size,
+                                    connection)
+
+    def completed_samples(self, sample_names):
+        completed = set()
+        for campaign, campaign_samples in self._group_by_campaign(sample_names).items():
+            with self._shard(campaign) as connection:
+                completed |= set(dhf.get_completed_sag_samples(campaign_samples, connection))
+        return [sample for sample in sample_names if sample in completed]
+
+    def drop_samples(self, sample_names):
+        for campaign, campaign_samples in self._group_by_campaign(sample_names).items():
+            with self._shard(campaign) as connection:
+                for sample in campaign_samples:
+                    dhf.drop_sag_sample(sample, connection)
+                connection.commit()
+                self._sync(campaign, connection)
+
+    def data_version(self):
+        return self.catalog.data_version()
+
+    def active_campaign(self):
+        return self.catalog.active_campaign()
+
+    def campaign_of(self, sample):
+        return self.catalog.campaign_of(sample) or self.catalog.active_campaign()
+
+    def sample_versions(self):
+        return self.catalog.sample_versions()
+
+    def create_campaign(self, name):
+        self.catalog.create_campaign(name)
+        with self._shard(name) as connection:
+            self._sync(name, connection)
+
+    def delete_campaign(self, name):
+        # Only this campaign is lost, a last backup generation is kept next to the others
+        path = self.catalog.shard_path(name)
+        campaign_samples = [sample for _, sample in self.catalog.campaign_samples([name])]
+        past_versions = self.catalog.max_sample_versions([name])
+        self.pool.discard(path)
+        backup.stop_backup_service(path, backup.campaign_backup_dir(name))
+        if os.path.exists(path):
+            backup.snapshot(path, backup.campaign_backup_dir(name))
+            os.remove(path)
+        self.catalog.delete_campaign(name)
+        self._synced_versions.pop(name, None)
+        super().reschedule_samples(campaign_samples)
+        if self.catalog.active_campaign() is None:
+            remaining = self.catalog.campaigns()
+            if remaining:
+                self.catalog.set_active(remaining[-1]["name"])
+            else:
+                self.create_campaign(shards.DEFAULT_CAMPAIGN)
+        # Names which are also part of another campaign resolve to that one now
+        for campaign, names in self._group_by_campaign(campaign_samples).items():
+            with self._shard(campaign) as connection:
+                self._advance_versions(campaign, names, past_versions, connection)
+
+    def restore_campaign(self, name, path):
+        # Restores a generation of the campaign into its shard, a deleted campaign is created again
+        if name not in {campaign["name"] for campaign in self.catalog.campaigns()}:
+            self.catalog.create_campaign(name, activate=False)
+        backup.restore(path, self.catalog.shard_path(name), backup.campaign_backup_dir(name))
+        with self._shard(name) as connection:
+            self._sync(name, connection)
+
+
+def stamp_with_connection(connection, sample, action, timestamp=None):
+    # Part of a transaction of the caller
+    if action == "interval":
+        return dhf.start_next_leaching_interval(sample, timestamp, connection)
+    return dhf.stamp_first_empty(sample, f"t_{action}_is", timestamp, connection)
+
+
+def stamp_batch(connection, indexed_events, idempotency_key=None, required=False):
+    # Part of a transaction of the caller. [(index, sample, action, timestamp)] -> {index: result}, events which
+    # were already written with the idempotency key return their stored results
+    if idempotency_key is not None:
+        row = connection.execute("SELECT results FROM stamp_requests WHERE idempotency_key = ?",
+                                 (idempotency_key,)).fetchone()
+        if row:
+            return {int(i): result for i, result in json.loads(row[0]).items()}
+    results = {}
+    for i, sample, action, timestamp in indexed_events:
+        results[i] = stamp_with_connection(connection, sample, action, timestamp)
+        if required and results[i] is None:
+            raise NothingToStampError(sample, action)
+    if idempotency_key is not None:
+        connection.execute("INSERT INTO stamp_requests (idempotency_key, results, created) VALUES (?, ?, ?)",
+                           (idempotency_key, json.dumps(results), clock.now().isoformat()))
+    return results
+
+
+def parse_sag_times(sag_df):
+    sag_df = sag_df.copy()
+    for col in dhf.SAG_TIME_COLUMNS:
+        sag_df[col] = pd.to_datetime(sag_df[col], format=dhf.TIME_FORMAT, errors="coerce",
+                                     utc=True).dt.tz_convert("Europe/Berlin")
+    return sag_df
+
+
+def page_history(sag_df, sources=None, start=None, end=None, sort_by="timestamp", descending=False, page=0,
+                 page_size=50):
+    # Same page as dhf.get_sag_page, built from the parsed wide table
+    columns = ["sample", "source", "interval", "T", "timestamp"]
+    long_df = sag_df.melt(id_vars=["sample", "interval", "T"], value_vars=list(dhf.SAG_SOURCES),
+                          var_name="source", value_name="timestamp").dropna(subset=["timestamp"])
+    long_df["source"] = long_df["source"].map(dhf.SAG_SOURCES)
+    if sources:
+        long_df = long_df[long_df["source"].isin(sources)]
+    if start is not None:
+        long_df = long_df[long_df["timestamp"] >= dhf.to_utc_timestamp(start)]
+    if end is not None:
+        long_df = long_df[long_df["timestamp"] < dhf.to_utc_timestamp(end)]
+    if sort_by not in dhf.SAG_PAGE_SORT_COLUMNS:
+        raise KeyError(sort_by)
+    long_df = long_df.sort_values([sort_by, "sample", "interval"], ascending=[not descending, True, True],
+                                  kind="stable")
+    return long_df[columns].iloc[page * page_size:(page + 1) * page_size].reset_index(drop=True), len(long_df)
+
+
+def filter_history(sag_df, start=None, end=None):
+    # Keep the intervals whose planned time overlaps the requested range
+    if start is not None:
+        sag_df = sag_df[sag_df["t_end_target"] >= dhf.to_utc_timestamp(start)]
+    if end is not None:
+        sag_df = sag_df[sag_df["t_start_target"] <= dhf.to_utc_timestamp(end)]
+    return sag_df.reset_index(drop=True)
+
+
+BACKENDS = {"sqlite": SQLiteBackend, "memory": MemoryBackend, "duckdb": DuckDBBackend, "sharded": ShardedBackend}
+
+
+@st.cache_resource
+def get_storage(backend=None):
+    # The backend is chosen with CT_TRACKER_STORAGE (sqlite, memory, duckdb or sharded)
+    return BACKENDS[backend or os.environ.get("CT_TRACKER_STORAGE", "sqlite")]()
@@ -0,0 +1,297 @@
+# Bath temperature telemetry. Readings (about 1 Hz per sample) are buffered and written once per second in
+# one transaction: the raw values plus min/max/mean rollups at several resolutions. The timeline reads the
+# finest source (raw or rollup) with at most 4 points per plotted point for the shown range and decimates it
+# with LTTB, so weeks of data stay a few thousand points.
+#
+# Telemetry has its own db (CT_TRACKER_TELEMETRY_DB, default "telemetry.sqlite"), so it neither bumps the data
+# versions nor bloats the backups of scans.sqlite.
+#
+#   python telemetry.py --listen 8504                  ingest "sample,timestamp,value" lines over tcp
+#   python telemetry.py --tail logger.csv              follow a logger csv with the same columns
+#   python telemetry.py --simulate 8504 --samples sample20 sample21
+import argparse
+import math
+import os
+import queue
+import random
+import socket
+import socketserver
+import sqlite3
+import threading
+import time
+from datetime import datetime
+import numpy as np
+import pandas as pd
+import clock
+
+TELEMETRY_DB_PATH = os.environ.get("CT_TRACKER_TELEMETRY_DB", "telemetry.sqlite")
+# Bucket sizes of the rollups in seconds
+ROLLUP_RESOLUTIONS = (10, 60, 600, 3600)
+RAW_RETENTION_DAYS = 14
+
+
+def establish_telemetry_connection(db_path=None):
+    connection = sqlite3.connect(db_path or TELEMETRY_DB_PATH, check_same_thread=False)
+    connection.executescript('''
+        CREATE TABLE IF NOT EXISTS telemetry_raw (
+            sample TEXT NOT NULL,
+            t_ms INTEGER NOT NULL,
+            value REAL NOT NULL,
+            PRIMARY KEY (sample, t_ms)
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS telemetry_rollup (
+            sample TEXT NOT NULL,
+            resolution INTEGER NOT NULL,
+            bucket INTEGER NOT NULL,
+            n INTEGER NOT NULL,
+            min REAL NOT NULL,
+            max REAL NOT NULL,
+            sum REAL NOT NULL,
+            PRIMARY KEY (sample, resolution, bucket)
+        ) WITHOUT ROWID;
+    ''')
+    return connection
+
+
+def parse_reading(line):
+    # "sample,timestamp,value". The timestamp is ISO 8601 (local lab time without timezone) or epoch seconds
+    sample, timestamp, value = (part.strip() for part in line.split(","))
+    try:
+        t_ms = int(float(timestamp) * 1000)
+    except ValueError:
+        parsed = datetime.fromisoformat(timestamp)
+        t_ms = int((parsed if parsed.tzinfo else parsed.replace(tzinfo=clock.TIMEZONE)).timestamp() * 1000)
+    return sample, t_ms, float(value)
+
+
+def write_readings(connection, readings):
+    # One transaction for the whole batch. Readings which are already stored (e.g. a re-read csv) are dropped
+    # first, so they do not count twice in the rollups
+    if not readings:
+        return
+    cursor = connection.cursor()
+    cursor.execute("CREATE TEMP TABLE IF NOT EXISTS new_readings (sample TEXT, t_ms INTEGER, value REAL, "
+                   "PRIMARY KEY (sample, t_ms))")
+    cursor.execute("BEGIN IMMEDIATE")
+    try:
+        cursor.execute("DELETE FROM new_readings")
+        cursor.executemany("INSERT OR IGNORE INTO new_readings VALUES (?, ?, ?)", readings)
+        cursor.execute('''
+            DELETE FROM new_readings WHERE EXISTS (
+                SELECT 1 FROM telemetry_raw r WHERE r.sample = new_readings.sample AND r.t_ms = new_readings.t_ms)
+        ''')
+        cursor.execute("INSERT INTO telemetry_raw SELECT sample, t_ms, value FROM new_readings")
+        for resolution in ROLLUP_RESOLUTIONS:
+            cursor.execute('''
+                INSERT INTO telemetry_rollup (sample, resolution, bucket, n, min, max, sum)
+                SELECT sample, ?, t_ms / ?, COUNT(*), MIN(value), MAX(value), SUM(value)
+                FROM new_readings WHERE true GROUP BY sample, t_ms / ?
+                ON CONFLICT(sample, resolution, bucket) DO UPDATE SET
+                    n = n + excluded.n, min = MIN(min, excluded.min), max = MAX(max, excluded.max),
+                    sum = sum + excluded.sum
+            ''', (resolution, resolution * 1000, resolution * 1000))
+        connection.commit()
+    except BaseException:
+        connection.rollback()
+        raise
+
+
+def prune_raw(connection, days=RAW_RETENTION_DAYS):
+    # Old raw readings are dropped, their rollups are kept
+    cutoff_ms = int((clock.now().timestamp() - days * 86400) * 1000)
+    connection.execute("DELETE FROM telemetry_raw WHERE t_ms < ?", (cutoff_ms,))
+    connection.commit()
+
+
+class TelemetryIngestor:
+    # Sources put readings into a queue, one writer thread flushes them every second
+    def __init__(self, db_path=None, flush_s=1.0):
+        self.db_path = db_path
+        self.flush_s = flush_s
+        self.written = 0
+        self._queue = queue.SimpleQueue()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="telemetry-writer", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def put(self, sample, t_ms, value):
+        self._queue.put((sample, t_ms, value))
+
+    def _drain(self):
+        readings = []
+        while True:
+            try:
+                readings.append(self._queue.get_nowait())
+            except queue.Empty:
+                return readings
+
+    def _run(self):
+        connection = establish_telemetry_connection(self.db_path)
+        last_prune = 0
+        while not self._stop.wait(self.flush_s):
+            readings = self._drain()
+            write_readings(connection, readings)
+            self.written += len(readings)
+            if time.monotonic() - last_prune > 3600:
+                prune_raw(connection)
+                last_prune = time.monotonic()
+        write_readings(connection, self._drain())
+        connection.close()
+
+
+def tail_csv(path, ingestor, poll_s=0.5, stop=None):
+    # Follows the file like tail -f, starting at the beginning. Lines which are not readings (e.g. a
+    # header) are skipped
+    with open(path, "rb") as file:
+        while stop is None or not stop.is_set():
+            line = file.readline()
+            if not line:
+                time.sleep(poll_s)
+                continue
+            if not line.endswith(b"\n"):
+                # Incomplete line, the logger is still writing it
+                file.seek(-len(line), os.SEEK_CUR)
+                time.sleep(poll_s)
+                continue
+            try:
+                ingestor.put(*parse_reading(line.decode()))
+            except (ValueError, UnicodeDecodeError):
+                continue
+
+
+class TelemetryHandler(socketserver.StreamRequestHandler):
+    # Stand-in for a serial logger: one "sample,timestamp,value" line per reading
+    def handle(self):
+        for line in self.rfile:
+            try:
+                self.server.ingestor.put(*parse_reading(line.decode()))
+            except ValueError:
+                continue
+
+
+def serve_tcp(port, ingestor):
+    server = socketserver.ThreadingTCPServer(("127.0.0.1", port), TelemetryHandler)
+    server.daemon_threads = True
+    server.ingestor = ingestor
+    return server
+
+
+def simulate_logger(port, sample_names, rate_hz=1.0, setpoint=80.0):
+    # Noisy bath temperatures with a slow drift around the setpoint
+    with socket.create_connection(("127.0.0.1", port)) as connection:
+        phase = {sample: random.random() * 2 * math.pi for sample in sample_names}
+        while True:
+            now = time.time()
+            lines = "".join(f"{sample},{now:.3f},"
+                            f"{setpoint + 0.5 * math.sin(now / 600 + phase[sample]) + random.gauss(0, 0.05):.3f}\n"
+                            for sample in sample_names)
+            connection.sendall(lines.encode())
+            time.sleep(1 / rate_hz)
+
+
+def lttb(x, y, n_out):
+    # Largest triangle three buckets: keeps the visual shape of a line with n_out points
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return x, y
+    bucket_edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+    selected = np.empty(n_out, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    previous = 0
+    for i in range(n_out - 2):
+        start, end = bucket_edges[i], bucket_edges[i + 1]
+        next_end = bucket_edges[i + 2] if i + 2 < len(bucket_edges) else n
+        next_x = x[end:next_end].mean() if next_end > end else x[-1]
+        next_y = y[end:next_end].mean() if next_end > end else y[-1]
+        areas = np.abs((x[previous] - next_x) * (y[start:end] - y[previous])
+                       - (x[previous] - x[start:end]) * (next_y - y[previous]))
+        previous = start + int(areas.argmax()) if end > start else start
+        selected[i + 1] = previous
+    return x[selected], y[selected]
+
+
+def query_telemetry(sample_names, start, end, max_points=2000, db_path=None):
+    # Long frame (sample, timestamp, value) with at most max_points per sample
+    if not os.path.exists(db_path or TELEMETRY_DB_PATH):
+        return pd.DataFrame(columns=["sample", "timestamp", "value"])
+    start_ms = int(pd.Timestamp(start).timestamp() * 1000)
+    end_ms = int(pd.Timestamp(end).timestamp() * 1000)
+    span_s = max((end_ms - start_ms) / 1000, 1)
+
+    # The finest source with at most 4 points per output point, LTTB does the rest
+    resolution = next((resolution for resolution in (1,) + ROLLUP_RESOLUTIONS
+                       if span_s / resolution <= 4 * max_points), ROLLUP_RESOLUTIONS[-1])
+    connection = establish_telemetry_connection(db_path)
+    placeholders = ", ".join("?" for _ in sample_names)
+    if resolution == 1:
+        telemetry_df = pd.read_sql(f'''
+            SELECT sample, t_ms, value FROM telemetry_raw
+            WHERE sample IN ({placeholders}) AND t_ms BETWEEN ? AND ?
+            ORDER BY sample, t_ms
+        ''', connection, params=[*sample_names, start_ms, end_ms])
+    else:
+        telemetry_df = pd.read_sql(f'''
+            SELECT sample, bucket * ? + ? / 2 AS t_ms, sum / n AS value FROM telemetry_rollup
+            WHERE sample IN ({placeholders}) AND resolution = ? AND bucket BETWEEN ? AND ?
+            ORDER BY sample, bucket
+        ''', connection, params=[resolution * 1000, resolution * 1000, *sample_names, resolution,
+                                 start_ms // (resolution * 1000), end_ms // (resolution * 1000)])
+    connection.close()
+
+    sample_dfs = []
+    for sample, sample_df in telemetry_df.groupby("sample", sort=False):
+        t_ms, values = lttb(sample_df["t_ms"].to_numpy(dtype=np.float64), sample_df["value"].to_numpy(), max_points)
+        sample_dfs.append(pd.DataFrame({"sample": sample, "timestamp": pd.to_datetime(t_ms, unit="ms", utc=True)
+                                       .tz_convert("Europe/Berlin"), "value": values}))
+    if not sample_dfs:
+        return pd.DataFrame(columns=["sample", "timestamp", "value"])
+    return pd.concat(sample_dfs, ignore_index=True)
+
+
+def add_telemetry_overlay(fig, sample_names, start, end, max_points=2000):
+    # Measured bath temperatures on a second y axis of the timeline
+    telemetry_df = query_telemetry(sample_names, start, end, max_points)
+    for sample, sample_df in telemetry_df.groupby("sample", sort=False):
+        fig.add_scatter(x=sample_df["timestamp"], y=sample_df["value"], mode="lines", name=f"{sample} T",
+                        yaxis="y2", line=dict(width=1), opacity=0.7)
+    if not telemetry_df.empty:
+        fig.update_layout(yaxis2=dict(title_text="T (°C)", overlaying="y", side="right", showgrid=False,
+                                      tickfont=dict(color="#dcdcdc")))
+    return fig
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--listen", type=int, help="ingest readings sent to this tcp port")
+    parser.add_argument("--tail", help="ingest readings appended to this csv file")
+    parser.add_argument("--simulate", type=int, help="send simulated readings to this tcp port")
+    parser.add_argument("--samples", nargs="+", default=["sample20", "sample21"])
+    parser.add_argument("--rate", type=float, default=1.0, help="simulated readings per second and sample")
+    args = parser.parse_args()
+
+    if args.simulate:
+        simulate_logger(args.simulate, args.samples, args.rate)
+        return
+
+    ingestor = TelemetryIngestor().start()
+    if args.listen:
+        threading.Thread(target=serve_tcp(args.listen, ingestor).serve_forever, daemon=True).start()
+    if args.tail:
+        threading.Thread(target=tail_csv, args=(args.tail, ingestor), daemon=True).start()
+    try:
+        while True:
+            time.sleep(10)
+            print(f"{ingestor.written} readings written", flush=True)
+    except KeyboardInterrupt:
+        ingestor.stop()
+
+
+if __name__ == "__main__":
+    main()
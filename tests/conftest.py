@@ -0,0 +1,7 @@
+import os
+import sys
+import tempfile
+
+# The modules live in the repo root. A db created by a test goes to a temporary directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("CT_TRACKER_DB", os.path.join(tempfile.mkdtemp(), "scans.sqlite"))
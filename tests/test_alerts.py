@@ -0,0 +1,44 @@
+import threading
+from datetime import datetime, timedelta
+import clock
+from alerts import AlertScheduler
+from schedule_queue import ScheduledEvent
+
+
+class FixedPlan:
+    # Stand-in for the storage backend with a plan that never changes its data version
+    def __init__(self, events):
+        self.events = sorted(events)
+
+    def data_version(self):
+        return 1
+
+    def query_schedule(self, now=None, k=10):
+        now_ns = int(now.timestamp() * 1e9)
+        return [event for event in self.events if event.time_ns > now_ns][:k]
+
+
+def test_alerts_go_on_after_the_armed_horizon():
+    simulated = clock.SimulatedClock(datetime(2025, 6, 10, 8, 0, tzinfo=clock.TIMEZONE))
+    start_ns = int(simulated.now().timestamp() * 1e9)
+    hour_ns = 3600 * 10**9
+    plan = FixedPlan([ScheduledEvent(start_ns + i * hour_ns, f"sample{i}", "leaching start") for i in range(1, 6)])
+
+    fired = []
+    fired_event = threading.Event()
+
+    def sink(alert):
+        fired.append(alert.event.sample)
+        fired_event.set()
+
+    with clock.use_clock(simulated):
+        scheduler = AlertScheduler(plan, [sink], offsets=(timedelta(0),), horizon=2, version_check_s=0.01).start()
+        try:
+            for i in range(1, 6):
+                fired_event.clear()
+                simulated.advance(timedelta(hours=1))
+                assert fired_event.wait(2), f"no alert for sample{i}"
+        finally:
+            scheduler.stop()
+
+    assert fired == [f"sample{i}" for i in range(1, 6)]
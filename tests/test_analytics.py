@@ -0,0 +1,80 @@
+from datetime import datetime, timedelta
+import numpy as np
+import pandas as pd
+import pytest
+import clock
+import samples
+from analytics import aggregate_by_condition, compute_interval_stats, flag_outliers
+from catalog import SagSample
+
+START = datetime(2025, 6, 10, 8, 0, tzinfo=clock.TIMEZONE)
+
+
+def at(minutes):
+    return pd.Timestamp(START + timedelta(minutes=minutes)) if minutes is not None else pd.NaT
+
+
+@pytest.fixture
+def sag_df(monkeypatch):
+    monkeypatch.setitem(samples.sag_samples, "test_a", SagSample("test_a", (10, 20, 30), (60, 60, 60), "HCl"))
+    monkeypatch.setitem(samples.sag_samples, "test_b", SagSample("test_b", (10, 10), (60, 60)))
+    monkeypatch.setitem(samples.sag_samples, "test_c", SagSample("test_c", (10, 10), (80, 80)))
+    # sample, interval, T, target start/end, actual start/end in minutes after START
+    rows = [("test_a", 10, 60, 0, 10, 0.5, 10.5),
+            ("test_a", 20, 60, 30, 50, 31, 52),
+            ("test_a", 30, 60, 60, 90, 60.25, None),
+            ("test_b", 10, 60, 0, 10, 1, 11),
+            ("test_b", 10, 60, 20, 30, 20, 40),
+            ("test_c", 10, 80, 0, 10, 0, 10),
+            ("test_c", 10, 80, 20, 30, 20, 30)]
+    return pd.DataFrame([{"sample": sample, "interval": interval, "T": T, "t_start_target": at(start_target),
+                          "t_end_target": at(end_target), "t_start_is": at(start_is), "t_end_is": at(end_is)}
+                         for sample, interval, T, start_target, end_target, start_is, end_is in rows])
+
+
+def test_interval_stats(sag_df):
+    stats_df = compute_interval_stats(sag_df)
+    test_a = stats_df[stats_df["sample"] == "test_a"]
+
+    assert test_a["step"].tolist() == [1, 2, 3]
+    assert test_a["actual_min"].tolist()[:2] == [10, 21]
+    assert test_a["deviation_min"].tolist()[:2] == [0, 1]
+    assert test_a["start_latency_s"].tolist() == [30, 60, 15]
+    assert test_a["end_latency_s"].tolist()[:2] == [30, 120]
+    # The unfinished interval has no duration and is not part of the cumulative time
+    assert np.isnan(test_a["actual_min"].iloc[2]) and np.isnan(test_a["cumulative_leaching_min"].iloc[2])
+    assert test_a["cumulative_leaching_min"].tolist()[:2] == [10, 31]
+    assert stats_df["solution"].tolist() == ["HCl"] * 3 + ["-"] * 4
+
+
+def test_outliers_by_median_absolute_deviation(sag_df):
+    stats_df = flag_outliers(compute_interval_stats(sag_df))
+
+    # 60°C deviations 0, 1, 0, 10: median 0.5, MAD 0.5, so 10 minutes is 0.6745 * 9.5 / 0.5 = 12.8
+    assert stats_df["deviation_min_z"].iloc[4] == pytest.approx(0.6745 * 9.5 / 0.5)
+    assert stats_df["deviation_min_z"].iloc[0] == pytest.approx(-0.6745)
+    # 60°C start latencies 30, 60, 15, 60, 0: median 30, MAD 30
+    assert stats_df["start_latency_s_z"].iloc[:5].tolist() == pytest.approx([0, 0.6745, -0.33725, 0.6745, -0.6745])
+    assert stats_df["outlier"].tolist() == [False, False, False, False, True, False, False]
+
+    # All 80°C values are equal: the MAD is 0, nothing is scored or flagged
+    assert stats_df["deviation_min_z"].iloc[5:].isna().all()
+    assert stats_df["start_latency_s_z"].iloc[5:].isna().all()
+
+
+def test_summary_by_condition(sag_df):
+    summary_df = aggregate_by_condition(flag_outliers(compute_interval_stats(sag_df))).set_index(["T", "solution"])
+
+    hcl = summary_df.loc[(60, "HCl")]
+    assert (hcl["samples"], hcl["intervals"], hcl["outliers"]) == (1, 2, 0)
+    assert hcl["mean_actual_min"] == 15.5
+    assert hcl["mean_deviation_min"] == 0.5
+    assert hcl["max_abs_deviation_min"] == 1
+    assert hcl["median_start_latency_s"] == 45
+    assert hcl["p95_start_latency_s"] == pytest.approx(30 + 0.95 * 30)
+    assert hcl["total_leaching_h"] == pytest.approx(31 / 60)
+
+    other = summary_df.loc[(60, "-")]
+    assert (other["samples"], other["intervals"], other["outliers"]) == (1, 2, 1)
+    assert other["max_abs_deviation_min"] == 10
+    assert summary_df.loc[(80, "-"), "total_leaching_h"] == pytest.approx(20 / 60)
@@ -0,0 +1,119 @@
+import json
+import os
+import threading
+import urllib.error
+import urllib.request
+import pytest
+import data_handling_functions as dhf
+import samples
+import shards
+from api import create_api_server
+from catalog import SagSample
+from storage import ShardedBackend, SQLiteBackend
+
+START = "2025-06-10T08:00:00"
+
+
+@pytest.fixture(autouse=True)
+def test_samples(monkeypatch, tmp_path):
+    monkeypatch.setattr(dhf, "DB_PATH", str(tmp_path / "scans.sqlite"))
+    monkeypatch.setattr(dhf, "ARCHIVE_DIR", str(tmp_path / "archive"))
+    monkeypatch.setitem(samples.sag_samples, "test_a", SagSample("test_a", (10, 20), (60, 60)))
+    monkeypatch.setitem(samples.sag_samples, "test_b", SagSample("test_b", (15,), (40,)))
+
+
+@pytest.fixture
+def server():
+    backend = SQLiteBackend()
+    backend.seed_samples(["test_a", "test_b"])
+    yield from serve(backend)
+
+
+@pytest.fixture
+def sharded_server(tmp_path):
+    # test_a in the default campaign, test_b in the active one
+    catalog = shards.CampaignCatalog(str(tmp_path / "campaigns.sqlite"), str(tmp_path / "shards"),
+                                     legacy_db_path=str(tmp_path / "default.sqlite"))
+    backend = ShardedBackend(catalog)
+    backend.seed_samples(["test_a"])
+    backend.create_campaign("second")
+    backend.seed_samples(["test_b"])
+    yield from serve(backend)
+
+
+def serve(backend):
+    server = create_api_server(port=0, backend=backend)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def post(server, path, body, idempotency_key=None):
+    request = urllib.request.Request(f"http://127.0.0.1:{server.server_port}{path}", data=json.dumps(body).encode(),
+                                     headers={"Content-Type": "application/json"}, method="POST")
+    if idempotency_key:
+        request.add_header("Idempotency-Key", idempotency_key)
+    try:
+        with urllib.request.urlopen(request) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read())
+
+
+def started(server, sample):
+    return server.backend.bulk_export([sample])["t_start_is"].notna().sum()
+
+
+def test_a_retry_with_the_same_key_is_not_applied_twice(server):
+    status, first = post(server, "/samples/test_a/start", {"timestamp": START}, "scan-1")
+    assert status == 200
+    status, retry = post(server, "/samples/test_a/start", {"timestamp": START}, "scan-1")
+    assert status == 200
+    assert retry["results"] == first["results"]
+    assert started(server, "test_a") == 1
+
+
+def test_a_bad_event_rolls_back_the_whole_batch(server):
+    # test_b has only one interval, its second start fails after the first events are written
+    events = [{"sample": "test_a", "action": "start", "timestamp": START},
+              {"sample": "test_b", "action": "start", "timestamp": START},
+              {"sample": "test_b", "action": "start", "timestamp": START}]
+    status, response = post(server, "/events", {"events": events}, "batch-1")
+    assert status == 409
+    assert "test_b" in response["error"]
+    assert started(server, "test_a") == 0
+    assert started(server, "test_b") == 0
+
+    # The key of the failed batch was not stored, the corrected batch goes through
+    status, response = post(server, "/events", {"events": events[:2]}, "batch-1")
+    assert status == 200
+    assert [result["sample"] for result in response["results"]] == ["test_a", "test_b"]
+
+
+def test_archived_samples_take_no_events(server):
+    os.makedirs(os.path.dirname(dhf.get_archive_path("test_a")))
+    open(dhf.get_archive_path("test_a"), "wb").close()
+    status, response = post(server, "/samples/test_a/start", {})
+    assert status == 409
+    assert "archived" in response["error"]
+
+
+def test_unknown_samples_are_not_found(server):
+    status, response = post(server, "/samples/no_such_sample/start", {})
+    assert status == 404
+    status, _ = post(server, "/events", {"events": [{"sample": "test_a", "action": "start"},
+                                                     {"sample": "DROP TABLE test_a", "action": "start"}]})
+    assert status == 404
+    assert started(server, "test_a") == 0
+
+
+def test_sharded_batches_are_recorded_once_in_every_campaign(sharded_server):
+    events = [{"sample": "test_a", "action": "start", "timestamp": START},
+              {"sample": "test_b", "action": "start", "timestamp": START}]
+    for _ in range(2):
+        status, response = post(sharded_server, "/events", {"events": events}, "batch-1")
+        assert status == 200
+        assert [result["rowid"] for result in response["results"]] == [1, 1]
+    assert started(sharded_server, "test_a") == 1
+    assert started(sharded_server, "test_b") == 1
@@ -0,0 +1,106 @@
+import os
+import shutil
+from datetime import datetime, timedelta
+import pyarrow.dataset as ds
+import pytest
+import clock
+import data_handling_functions as dhf
+import samples
+import shards
+from archive import archive_sag_samples, list_archived_samples, load_archived_sag_df
+from catalog import SagSample
+from storage import MemoryBackend, ShardedBackend
+
+START = datetime(2025, 6, 10, 8, 0, tzinfo=clock.TIMEZONE)
+
+
+@pytest.fixture(autouse=True)
+def test_samples(monkeypatch, tmp_path):
+    monkeypatch.setattr(dhf, "ARCHIVE_DIR", str(tmp_path / "archive"))
+    monkeypatch.setitem(samples.sag_samples, "test_a", SagSample("test_a", (10, 20, 30), (60, 60, 80)))
+
+
+def run_intervals(backend, sample, start):
+    # Three intervals one day apart, all of them ended
+    for day in range(3):
+        timestamp = start + timedelta(days=day)
+        backend.stamp_event(sample, "interval", timestamp)
+        backend.stamp_event(sample, "start", timestamp)
+        backend.stamp_event(sample, "end", timestamp + timedelta(hours=1))
+
+
+def test_archived_samples_leave_the_live_storage():
+    backend = MemoryBackend()
+    backend.seed_samples(["test_a"])
+    run_intervals(backend, "test_a", START)
+
+    assert archive_sag_samples(["test_a"], backend) == ["test_a"]
+    assert os.path.exists(os.path.join(dhf.ARCHIVE_DIR, dhf.DEFAULT_CAMPAIGN, "test_a.parquet"))
+    assert backend.bulk_export(["test_a"]).empty
+    assert dhf.is_archived("test_a")
+    # Archived samples are not seeded again
+    backend.seed_samples(["test_a"])
+    assert backend.bulk_export(["test_a"]).empty
+
+    sag_df = load_archived_sag_df(["test_a"])
+    assert sag_df["interval"].tolist() == [10, 20, 30]
+    assert sag_df["t_start_is"].tolist() == [(START + timedelta(days=day)) for day in range(3)]
+    assert str(sag_df["t_start_is"].dt.tz) == "Europe/Berlin"
+
+
+def test_the_time_range_is_pushed_down_into_the_row_groups():
+    backend = MemoryBackend()
+    backend.seed_samples(["test_a"])
+    run_intervals(backend, "test_a", START)
+    archive_sag_samples(["test_a"], backend)
+
+    # Intervals overlapping the range are read: the second one runs from day 1 8:00 to 8:20
+    sag_df = load_archived_sag_df(["test_a"], START + timedelta(days=1, minutes=5),
+                                  START + timedelta(days=1, hours=1))
+    assert sag_df["interval"].tolist() == [20]
+    assert load_archived_sag_df(["test_a"], start=START + timedelta(days=2, minutes=31)).empty
+
+    # The parquet statistics rule out the whole file for a range after the campaign
+    fragment = next(ds.dataset(dhf.get_archive_path("test_a"), format="parquet").get_fragments())
+    after = ds.field("t_start_target") > START + timedelta(days=3)
+    assert fragment.split_by_row_group(after) == []
+    assert len(fragment.split_by_row_group(~after)) == 1
+
+
+def test_a_name_is_archived_once_per_campaign(tmp_path):
+    catalog = shards.CampaignCatalog(str(tmp_path / "campaigns.sqlite"), str(tmp_path / "shards"),
+                                     legacy_db_path=str(tmp_path / "scans.sqlite"))
+    backend = ShardedBackend(catalog)
+    backend.seed_samples(["test_a"])
+    run_intervals(backend, "test_a", START)
+    archive_sag_samples(["test_a"], backend)
+
+    # The archive of the default campaign does not block the name in the next one
+    backend.create_campaign("second")
+    backend.seed_samples(["test_a"])
+    assert not backend.bulk_export(["test_a"]).empty
+    run_intervals(backend, "test_a", START + timedelta(days=30))
+    archive_sag_samples(["test_a"], backend)
+
+    assert list_archived_samples(dhf.DEFAULT_CAMPAIGN) == ["test_a"]
+    assert list_archived_samples("second") == ["test_a"]
+    first = load_archived_sag_df(["test_a"], campaign=dhf.DEFAULT_CAMPAIGN)
+    second = load_archived_sag_df(["test_a"], campaign="second")
+    assert first["t_start_is"].min() == START
+    assert second["t_start_is"].min() == START + timedelta(days=30)
+
+
+def test_flat_archives_belong_to_the_default_campaign():
+    backend = MemoryBackend()
+    backend.seed_samples(["test_a"])
+    run_intervals(backend, "test_a", START)
+    archive_sag_samples(["test_a"], backend)
+    # Layout of older versions: the files directly in the archive directory
+    campaign_dir = os.path.join(dhf.ARCHIVE_DIR, dhf.DEFAULT_CAMPAIGN)
+    shutil.move(os.path.join(campaign_dir, "test_a.parquet"), os.path.join(dhf.ARCHIVE_DIR, "test_a.parquet"))
+    os.rmdir(campaign_dir)
+
+    assert dhf.is_archived("test_a")
+    assert not dhf.is_archived("test_a", "second")
+    assert list_archived_samples() == ["test_a"]
+    assert load_archived_sag_df(["test_a"])["interval"].tolist() == [10, 20, 30]
@@ -0,0 +1,47 @@
+import os
+import backup
+import data_handling_functions as dhf
+import shards
+from storage import ShardedBackend
+
+
+def test_restore_goes_into_the_given_db_and_moves_the_versions_on(tmp_path):
+    db_path = str(tmp_path / "campaign.sqlite")
+    backup_dir = str(tmp_path / "backups")
+    connection = dhf.establish_db_connection(db_path)
+    dhf.create_new_sag_in_db("sample20", connection)
+    connection.commit()
+    connection.close()
+    generation = backup.snapshot(db_path, backup_dir)
+
+    connection = dhf.establish_db_connection(db_path)
+    connection.execute("DROP TABLE sample20")
+    connection.commit()
+    connection.close()
+    version = backup.database_version(db_path)
+
+    backup.restore(generation, db_path, backup_dir)
+    connection = dhf.establish_db_connection(db_path)
+    assert connection.execute("SELECT COUNT(*) FROM sample20").fetchone()[0] > 0
+    connection.close()
+    assert backup.database_version(db_path) > version
+    # The state before the restore is kept as a generation of its own
+    assert len(backup.list_backups(backup_dir)) == 2
+
+
+def test_deleting_a_campaign_stops_its_backup_service(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    catalog = shards.CampaignCatalog(str(tmp_path / "campaigns.sqlite"), str(tmp_path / "shards"),
+                                     legacy_db_path=str(tmp_path / "scans.sqlite"))
+    backend = ShardedBackend(catalog)
+    backend.create_campaign("second")
+    path = catalog.shard_path("second")
+    service = backup.get_backup_service(path, backup.campaign_backup_dir("second"))
+
+    backend.delete_campaign("second")
+    assert not any(thread.is_alive() for thread in service._threads)
+    # A version check of the deleted shard does not create it again
+    assert backup.database_version(path) == 0
+    assert not os.path.exists(path)
+    assert backup.get_backup_service(path, backup.campaign_backup_dir("second")) is not service
+    backup.stop_backup_service(path, backup.campaign_backup_dir("second"))
@@ -0,0 +1,41 @@
+import pytest
+from catalog import Catalog, CatalogError
+
+CATALOG = """
+sag_samples:
+  sample_a:
+    intervals: [10, 20]
+    T: [60, 80]
+"""
+
+
+def test_reload_picks_up_changed_samples(tmp_path):
+    path = tmp_path / "samples.yaml"
+    path.write_text(CATALOG)
+    catalog = Catalog(str(path))
+    assert catalog.sag_samples["sample_a"].intervals == (10, 20)
+
+    path.write_text(CATALOG.replace("[10, 20]", "[10, 30]"))
+    catalog._mtime = None
+    assert catalog.reload_if_changed() == {"sample_a"}
+    assert catalog.sag_samples["sample_a"].intervals == (10, 30)
+
+
+def test_missing_file_keeps_the_previous_definitions(tmp_path):
+    # Editors replace the file on save, in between it does not exist
+    path = tmp_path / "samples.yaml"
+    path.write_text(CATALOG)
+    catalog = Catalog(str(path))
+    path.unlink()
+
+    with pytest.raises(CatalogError):
+        catalog.reload_if_changed()
+    assert catalog.sag_samples["sample_a"].intervals == (10, 20)
+
+
+def test_invalid_definitions_are_rejected(tmp_path):
+    path = tmp_path / "samples.yaml"
+    path.write_text(CATALOG.replace("[60, 80]", "[60]"))
+
+    with pytest.raises(CatalogError):
+        Catalog(str(path))
@@ -0,0 +1,64 @@
+from datetime import datetime, timedelta
+import pandas as pd
+import pytest
+import clock
+import data_handling_functions as dhf
+import samples
+from catalog import SagSample
+from event_store import EventStore
+from storage import MemoryBackend
+
+START = datetime(2025, 6, 10, 8, 0, tzinfo=clock.TIMEZONE)
+
+
+@pytest.fixture
+def sag_df(monkeypatch, tmp_path):
+    monkeypatch.setattr(dhf, "ARCHIVE_DIR", str(tmp_path / "archive"))
+    monkeypatch.setitem(samples.sag_samples, "test_a", SagSample("test_a", (10, 20, 30), (60, 60, 80)))
+    monkeypatch.setitem(samples.sag_samples, "test_b", SagSample("test_b", (15,), (40,)))
+    backend = MemoryBackend()
+    backend.seed_samples(["test_a", "test_b"])
+    # Some rows are only planned, some started and one ended, so the wide table has missing times
+    backend.stamp_event("test_a", "interval", START)
+    backend.stamp_event("test_a", "start", START + timedelta(minutes=1))
+    backend.stamp_event("test_a", "end", START + timedelta(minutes=11))
+    backend.stamp_event("test_a", "interval", START + timedelta(minutes=30))
+    backend.stamp_event("test_b", "interval", START + timedelta(minutes=5))
+    backend.stamp_event("test_b", "start", START + timedelta(minutes=6))
+    return backend.bulk_export(["test_a", "test_b"])
+
+
+def events(long_df):
+    return sorted(zip(long_df["sample"].astype(str), long_df["source"].astype(str), long_df["timestamp"]))
+
+
+def test_long_frame_matches_format_sag_df(sag_df):
+    store = EventStore.from_frames(1, sag_df)
+    expected_df = dhf.format_sag_df(sag_df.copy()).dropna(subset=["timestamp"])
+
+    assert events(store.to_long_df()) == events(expected_df)
+    assert events(store.to_long_df(["test_b"])) == events(expected_df[expected_df["sample"] == "test_b"])
+    assert store.to_long_df()["timestamp"].is_monotonic_increasing
+    assert str(store.to_long_df()["timestamp"].dt.tz) == "Europe/Berlin"
+
+
+def test_next_event_is_strictly_after_now(sag_df):
+    store = EventStore.from_frames(1, sag_df)
+    first_end = START + timedelta(minutes=10)
+
+    assert store.next_event("test_a", START) == first_end
+    assert store.next_event("test_a", START - timedelta(days=1)) == START
+    # An event exactly at now is already due, the next one is returned
+    assert store.next_event("test_a", first_end) == START + timedelta(minutes=30)
+    assert store.next_event("test_a", pd.Timestamp(first_end) - pd.Timedelta(1, "ns")) == first_end
+    assert store.next_event("test_a", START + timedelta(minutes=50)) is None
+    assert store.next_event("test_a", START, source="end") == START + timedelta(minutes=11)
+    assert store.next_event("test_b", START + timedelta(minutes=5), source="planned") == START + timedelta(minutes=20)
+    assert store.next_event("unknown", START) is None
+
+
+def test_an_empty_store_has_no_events():
+    store = EventStore.from_frames(0, None)
+    assert len(store) == 0
+    assert store.to_long_df().empty
+    assert store.next_event("test_a", START) is None
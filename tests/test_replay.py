@@ -0,0 +1,61 @@
+from datetime import datetime, timedelta
+import pytest
+import clock
+import data_handling_functions as dhf
+import samples
+from catalog import SagSample
+from replay import OperatorModel, ReplayEngine
+from storage import MemoryBackend
+
+START = datetime(2025, 6, 10, 8, 0, tzinfo=clock.TIMEZONE)
+
+
+@pytest.fixture(autouse=True)
+def test_samples(monkeypatch, tmp_path):
+    monkeypatch.setattr(dhf, "ARCHIVE_DIR", str(tmp_path / "archive"))
+    monkeypatch.setitem(samples.sag_samples, "test_a", SagSample("test_a", (10, 20), (60, 60)))
+    monkeypatch.setitem(samples.sag_samples, "test_b", SagSample("test_b", (15,), (60,)))
+
+
+def at(minutes):
+    return (START + timedelta(minutes=minutes)).strftime(dhf.TIME_FORMAT)
+
+
+def on_system_clock():
+    return abs(clock.now() - datetime.now(clock.TIMEZONE)) < timedelta(minutes=1)
+
+
+def test_replay_without_operator_delays():
+    # Without delays the only waiting is for the CT: test_b ends at 8:15 while test_a is scanned until 8:25
+    backend = MemoryBackend()
+    operator = OperatorModel(start_latency_s=0, end_delay_s=0, handling_s=0)
+    result = ReplayEngine(["test_a", "test_b"], operator, backend, start=START, scan_minutes=15).run()
+
+    sag_df = backend.bulk_export(["test_a", "test_b"])
+    columns = ["sample", "t_start_target", "t_end_target", "t_start_is", "t_end_is"]
+    assert sag_df[columns].values.tolist() == [["test_a", at(0), at(10), at(0), at(10)],
+                                               ["test_a", at(25), at(45), at(25), at(45)],
+                                               ["test_b", at(0), at(15), at(0), at(15)]]
+    assert result["scans"] == 3
+    assert result["campaign_h"] == 1
+    assert result["scanner_idle"] == pytest.approx(0.25)
+    assert (result["mean_scan_wait_min"], result["max_scan_wait_min"]) == pytest.approx((10 / 3, 10))
+    assert (result["mean_slip_min"], result["max_slip_min"]) == (5, 10)
+    assert on_system_clock()
+
+
+class FailingBackend(MemoryBackend):
+    def stamp_event(self, sample, action, timestamp=None):
+        if action == "end":
+            raise RuntimeError("storage went away")
+        return super().stamp_event(sample, action, timestamp)
+
+
+def test_the_clock_is_restored_when_the_replay_fails():
+    engine = ReplayEngine(["test_a"], OperatorModel(seed=1), FailingBackend(), start=START)
+    with pytest.raises(RuntimeError):
+        engine.run()
+    assert on_system_clock()
+    # The simulated clock itself never goes back
+    with pytest.raises(ValueError):
+        engine.clock.set(START)
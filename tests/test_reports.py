@@ -0,0 +1,37 @@
+import io
+import zipfile
+from datetime import datetime, timedelta
+import clock
+import data_handling_functions as dhf
+import samples
+from catalog import SagSample
+from reports import generate_reports, zip_reports
+
+START = datetime(2025, 6, 10, 8, 0, tzinfo=clock.TIMEZONE)
+
+
+def test_two_samples_are_rendered_in_the_pool_and_zipped_once(monkeypatch, tmp_path):
+    monkeypatch.setattr(dhf, "DB_PATH", str(tmp_path / "scans.sqlite"))
+    monkeypatch.setattr(dhf, "ARCHIVE_DIR", str(tmp_path / "archive"))
+    for sample in ("test_a", "test_b"):
+        monkeypatch.setitem(samples.sag_samples, sample, SagSample(sample, (10, 20), (60, 60)))
+        dhf.create_new_sag_in_db(sample)
+        dhf.start_next_leaching_interval(sample, START)
+        dhf.stamp_first_empty(sample, "t_start_is", START)
+        dhf.stamp_first_empty(sample, "t_end_is", START + timedelta(minutes=10))
+    versions = dhf.get_sample_versions()
+    out_dir = str(tmp_path / "reports")
+
+    result = generate_reports(["test_a", "test_b"], out_dir, workers=2)
+    assert (result["rendered"], result["cached"]) == (2, 0)
+    names = zipfile.ZipFile(io.BytesIO(zip_reports(result["paths"]))).namelist()
+    assert sorted(names) == ["index.html", "plotly.min.js", f"test_a_v{versions['test_a']}.html",
+                             f"test_b_v{versions['test_b']}.html"]
+
+    # Unchanged samples are taken from the cache, the zip still lists every sample once
+    again = generate_reports(["test_a", "test_b"], out_dir, workers=2)
+    assert (again["rendered"], again["cached"]) == (0, 2)
+    assert again["paths"] == result["paths"]
+    with open(f"{out_dir}/index.html", encoding="utf-8") as file:
+        index = file.read()
+    assert index.count("test_a_v") == index.count("test_b_v") == 1
@@ -0,0 +1,186 @@
+import os
+import sqlite3
+from datetime import datetime
+import pytest
+import clock
+import data_handling_functions as dhf
+import samples
+import shards
+import storage
+from catalog import SagSample
+from scan_watcher import ScanDebouncer, ScanWatcher
+from storage import MemoryBackend, PartialBatchError, ShardedBackend
+
+
+@pytest.fixture
+def backend(monkeypatch, tmp_path):
+    monkeypatch.setitem(samples.sag_samples, "test_a", SagSample("test_a", (10, 20), (60, 60)))
+    monkeypatch.setattr(dhf, "ARCHIVE_DIR", str(tmp_path / "archive"))
+    backend = MemoryBackend()
+    backend.seed_samples(["test_a"])
+    return backend
+
+
+def write_scan(root, name, mtimes):
+    directory = root / name
+    directory.mkdir()
+    for i, mtime in enumerate(mtimes):
+        path = directory / f"proj_{i:05d}.tif"
+        path.touch()
+        os.utime(path, (mtime, mtime))
+
+
+def test_debouncer_sends_the_start_once_and_the_end_after_the_quiet_time():
+    debouncer = ScanDebouncer(quiet_s=30)
+    debouncer.update("scan1", "test_a", 100.0, 110.0, 50, now=0)
+
+    events = debouncer.due(now=10)
+    assert events == [("scan1", "start", "test_a", 100.0)]
+    debouncer.acknowledge(events)
+
+    # New files postpone the end
+    debouncer.update("scan1", "test_a", 100.0, 140.0, 80, now=20)
+    assert debouncer.due(now=40) == []
+    events = debouncer.due(now=50)
+    assert events == [("scan1", "end", "test_a", 140.0)]
+    debouncer.acknowledge(events)
+    assert debouncer.scans == {}
+
+
+def test_watcher_stamps_a_burst_once_and_resumes_from_the_checkpoint(backend, tmp_path):
+    first_mtime = datetime(2025, 6, 10, 8, 0, tzinfo=clock.TIMEZONE).timestamp()
+    write_scan(tmp_path, "test_a_scan1", [first_mtime + i for i in range(500)])
+    write_scan(tmp_path, "unrelated", [first_mtime])
+
+    watcher = ScanWatcher(tmp_path, backend, quiet_s=0, use_inotify=False)
+    watcher.refresh()
+    assert [kind for _, kind, _, _ in watcher.flush()] == ["start", "end"]
+
+    sag_df = backend.bulk_export(["test_a"])
+    assert sag_df.at[0, "t_start_is"] == datetime.fromtimestamp(first_mtime, clock.TIMEZONE).strftime(dhf.TIME_FORMAT)
+    assert sag_df.at[0, "t_end_is"] == datetime.fromtimestamp(first_mtime + 499,
+                                                              clock.TIMEZONE).strftime(dhf.TIME_FORMAT)
+    assert sag_df["t_start_is"].notna().sum() == 1
+
+    # A restart skips the finished and the ignored directories
+    restarted = ScanWatcher(tmp_path, backend, quiet_s=0, use_inotify=False)
+    assert restarted.closed == {"test_a_scan1", "unrelated"}
+    restarted.refresh()
+    assert restarted.flush() == []
+
+
+class FlakyBackend:
+    # Fails the batch and every event of the failing sample, until it is fixed
+    def __init__(self, backend, failing_sample):
+        self.backend = backend
+        self.failing_sample = failing_sample
+
+    def stamp_events(self, events):
+        if any(sample == self.failing_sample for sample, _, _ in events):
+            raise OSError("disk I/O error")
+        return self.backend.stamp_events(events)
+
+    def stamp_event(self, sample, action, timestamp=None):
+        if sample == self.failing_sample:
+            raise OSError("disk I/O error")
+        return self.backend.stamp_event(sample, action, timestamp)
+
+
+def test_failed_events_do_not_hold_back_the_others_and_are_retried(backend, monkeypatch, tmp_path):
+    monkeypatch.setitem(samples.sag_samples, "test_b", SagSample("test_b", (10,), (60,)))
+    backend.seed_samples(["test_b"])
+    mtime = datetime(2025, 6, 10, 8, 0, tzinfo=clock.TIMEZONE).timestamp()
+    write_scan(tmp_path, "test_a_scan1", [mtime])
+    write_scan(tmp_path, "test_b_scan1", [mtime])
+
+    flaky = FlakyBackend(backend, "test_a")
+    watcher = ScanWatcher(tmp_path, flaky, quiet_s=0, use_inotify=False)
+    watcher.refresh()
+    assert {(key, kind) for key, kind, _, _ in watcher.flush()} == {("test_b_scan1", "start"),
+                                                                    ("test_b_scan1", "end")}
+    assert backend.bulk_export(["test_a"])["t_start_is"].isna().all()
+
+    flaky.failing_sample = None
+    assert {(key, kind) for key, kind, _, _ in watcher.flush()} == {("test_a_scan1", "start"),
+                                                                    ("test_a_scan1", "end")}
+    assert backend.bulk_export(["test_a"])["t_start_is"].notna().sum() == 1
+
+
+def test_run_keeps_going_after_a_failed_step(backend, monkeypatch, tmp_path):
+    watcher = ScanWatcher(tmp_path, backend, poll_s=0.01, use_inotify=False)
+    steps = []
+
+    def step():
+        steps.append(1)
+        if len(steps) == 1:
+            raise OSError("share not mounted")
+        if len(steps) == 3:
+            watcher.stop()
+
+    monkeypatch.setattr(watcher, "step", step)
+    watcher.run()
+    assert len(steps) == 3
+
+
+def test_a_batch_over_campaigns_is_written_once_when_a_campaign_fails(monkeypatch, tmp_path):
+    monkeypatch.setitem(samples.sag_samples, "test_a", SagSample("test_a", (10, 20), (60, 60)))
+    monkeypatch.setitem(samples.sag_samples, "test_b", SagSample("test_b", (10,), (60,)))
+    monkeypatch.setattr(dhf, "ARCHIVE_DIR", str(tmp_path / "archive"))
+    catalog = shards.CampaignCatalog(str(tmp_path / "campaigns.sqlite"), str(tmp_path / "shards"),
+                                     legacy_db_path=str(tmp_path / "scans.sqlite"))
+    sharded = ShardedBackend(catalog)
+    sharded.seed_samples(["test_a"])
+    sharded.create_campaign("second")
+    sharded.seed_samples(["test_b"])
+
+    # The campaign of test_a is written first, then the one of test_b fails
+    failing = {"test_b"}
+    stamp_with_connection = storage.stamp_with_connection
+
+    def flaky_stamp(connection, sample, action, timestamp=None):
+        if sample in failing:
+            raise sqlite3.OperationalError("disk I/O error")
+        return stamp_with_connection(connection, sample, action, timestamp)
+
+    monkeypatch.setattr(storage, "stamp_with_connection", flaky_stamp)
+    scans = tmp_path / "scans"
+    scans.mkdir()
+    mtime = datetime(2025, 6, 10, 8, 0, tzinfo=clock.TIMEZONE).timestamp()
+    write_scan(scans, "test_a_scan1", [mtime])
+    write_scan(scans, "test_b_scan1", [mtime])
+
+    watcher = ScanWatcher(scans, sharded, quiet_s=0, use_inotify=False)
+    watcher.refresh()
+    assert {key for key, _, _, _ in watcher.flush()} == {"test_a_scan1"}
+    failing.clear()
+    assert {key for key, _, _, _ in watcher.flush()} == {"test_b_scan1"}
+
+    sag_df = sharded.bulk_export(["test_a", "test_b"])
+    assert sag_df.groupby("sample")["t_start_is"].count().to_dict() == {"test_a": 1, "test_b": 1}
+    assert sag_df.groupby("sample")["t_end_is"].count().to_dict() == {"test_a": 1, "test_b": 1}
+
+
+class PartlyCommittingBackend:
+    # Writes the first event of the batch and reports the rest as not written
+    def __init__(self, backend):
+        self.backend = backend
+        self.single_events = []
+
+    def stamp_events(self, events):
+        raise PartialBatchError({0: self.backend.stamp_event(*events[0])})
+
+    def stamp_event(self, sample, action, timestamp=None):
+        self.single_events.append((sample, action))
+        return self.backend.stamp_event(sample, action, timestamp)
+
+
+def test_only_the_events_which_were_not_committed_are_sent_again(backend, tmp_path):
+    mtime = datetime(2025, 6, 10, 8, 0, tzinfo=clock.TIMEZONE).timestamp()
+    write_scan(tmp_path, "test_a_scan1", [mtime])
+
+    partial = PartlyCommittingBackend(backend)
+    watcher = ScanWatcher(tmp_path, partial, quiet_s=0, use_inotify=False)
+    watcher.refresh()
+    assert [kind for _, kind, _, _ in watcher.flush()] == ["start", "end"]
+    assert partial.single_events == [("test_a", "end")]
+    assert backend.bulk_export(["test_a"])["t_start_is"].notna().sum() == 1
@@ -0,0 +1,83 @@
+from datetime import datetime, timedelta
+import pandas as pd
+import pytest
+import clock
+import data_handling_functions as dhf
+import samples
+from catalog import SagSample
+from schedule_queue import UpcomingQueue
+
+START = datetime(2025, 6, 10, 8, 0, tzinfo=clock.TIMEZONE)
+
+
+class FakeStorage:
+    # Planned intervals by sample and their data versions, records which samples the queue reads
+    def __init__(self):
+        self.rows = {"test_a": [(10, START, START + timedelta(minutes=10)),
+                                (20, START + timedelta(minutes=30), START + timedelta(minutes=50))],
+                     "test_b": [(15, START + timedelta(minutes=10), START + timedelta(minutes=25))]}
+        self.versions = {"test_a": 1, "test_b": 1}
+        self.loads = []
+
+    def load_sag_df(self, sample_names):
+        self.loads.append(sorted(sample_names))
+        return pd.DataFrame([{"sample": sample, "interval": interval, "T": 60,
+                              "t_start_target": start.strftime(dhf.TIME_FORMAT),
+                              "t_end_target": end.strftime(dhf.TIME_FORMAT)}
+                             for sample in sample_names for interval, start, end in self.rows[sample]])
+
+    def sample_versions(self):
+        return dict(self.versions)
+
+
+@pytest.fixture
+def storage(monkeypatch):
+    monkeypatch.setattr(samples, "samples", {})
+    monkeypatch.setattr(samples, "sag_samples", {"test_a": SagSample("test_a", (10, 20), (60, 60)),
+                                                 "test_b": SagSample("test_b", (15,), (60,))})
+    return FakeStorage()
+
+
+@pytest.fixture
+def queue(storage):
+    queue = UpcomingQueue(storage.load_sag_df, lambda: None, storage.sample_versions)
+    queue.refresh()
+    return queue
+
+
+def schedule(queue, now=START - timedelta(minutes=1), k=10):
+    return [(event.time, event.sample, event.kind) for event in queue.upcoming(now, k)]
+
+
+def test_only_samples_with_a_new_version_are_reloaded(storage, queue):
+    assert storage.loads == [["test_a", "test_b"]]
+    assert not queue.refresh()
+
+    storage.rows["test_a"][1] = (20, START + timedelta(minutes=40), START + timedelta(minutes=60))
+    storage.versions["test_a"] = 2
+    assert queue.refresh()
+    assert storage.loads[1:] == [["test_a"]]
+    assert schedule(queue)[-1] == (START + timedelta(minutes=60), "test_a", "end")
+
+
+def test_invalidated_samples_are_reloaded_without_a_new_version(storage, queue):
+    storage.rows["test_b"] = [(15, START + timedelta(minutes=12), START + timedelta(minutes=27))]
+    queue.invalidate(["test_b"])
+    assert queue.refresh()
+    assert storage.loads[1:] == [["test_b"]]
+    assert (START + timedelta(minutes=12), "test_b", "start") in schedule(queue)
+    assert not queue.refresh()
+
+
+def test_upcoming_merges_the_samples_by_time(queue):
+    # At 8:10 test_a ends and test_b starts, ties are ordered by sample name
+    assert schedule(queue) == [(START, "test_a", "start"),
+                               (START + timedelta(minutes=10), "test_a", "end"),
+                               (START + timedelta(minutes=10), "test_b", "start"),
+                               (START + timedelta(minutes=25), "test_b", "end"),
+                               (START + timedelta(minutes=30), "test_a", "start"),
+                               (START + timedelta(minutes=50), "test_a", "end")]
+    # Events at now are already due
+    assert schedule(queue, START + timedelta(minutes=10), k=2) == [(START + timedelta(minutes=25), "test_b", "end"),
+                                                                    (START + timedelta(minutes=30), "test_a", "start")]
+    assert schedule(queue, START + timedelta(minutes=50)) == []
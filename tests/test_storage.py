@@ -0,0 +1,237 @@
+import sqlite3
+from datetime import datetime, timedelta
+import pytest
+import clock
+import data_handling_functions as dhf
+import samples
+import shards
+from catalog import SagSample
+from storage import MemoryBackend, ShardedBackend, SQLiteBackend, page_history
+
+START = datetime(2025, 6, 10, 8, 0, tzinfo=clock.TIMEZONE)
+
+
+@pytest.fixture
+def backend(monkeypatch, tmp_path):
+    # Small samples of their own, so the tests do not depend on samples.yaml
+    monkeypatch.setitem(samples.sag_samples, "test_a", SagSample("test_a", (10, 20, 30), (60, 60, 80)))
+    monkeypatch.setitem(samples.sag_samples, "test_b", SagSample("test_b", (15,), (40,)))
+    monkeypatch.setattr(dhf, "ARCHIVE_DIR", str(tmp_path / "archive"))
+    backend = MemoryBackend()
+    backend.seed_samples(["test_a", "test_b"])
+    return backend
+
+
+def stamp_interval(backend, sample, timestamp):
+    backend.stamp_event(sample, "interval", timestamp)
+    backend.stamp_event(sample, "start", timestamp + timedelta(seconds=30))
+
+
+def test_interval_sets_the_targets_of_the_next_row(backend):
+    first = backend.stamp_event("test_a", "interval", START)
+    second = backend.stamp_event("test_a", "interval", START + timedelta(minutes=15))
+
+    assert first == {"rowid": 1, "t_start_target": START.strftime(dhf.TIME_FORMAT),
+                     "t_end_target": (START + timedelta(minutes=10)).strftime(dhf.TIME_FORMAT)}
+    assert second["rowid"] == 2
+    assert second["t_end_target"] == (START + timedelta(minutes=35)).strftime(dhf.TIME_FORMAT)
+
+
+def test_start_and_end_fill_the_first_empty_row(backend):
+    assert backend.stamp_event("test_a", "start", START)["rowid"] == 1
+    assert backend.stamp_event("test_a", "start", START)["rowid"] == 2
+    assert backend.stamp_event("test_a", "end", START) == {"rowid": 1, "t_end_is": START.strftime(dhf.TIME_FORMAT)}
+
+
+def test_stamp_returns_none_without_open_row(backend):
+    assert backend.stamp_event("test_b", "interval", START) is not None
+    assert backend.stamp_event("test_b", "interval", START) is None
+
+
+def test_stamps_bump_the_versions(backend):
+    version = backend.data_version()
+    sample_versions = backend.sample_versions()
+    backend.stamp_event("test_a", "start", START)
+
+    assert backend.data_version() == version + 1
+    assert backend.sample_versions()["test_a"] == sample_versions["test_a"] + 1
+    assert backend.sample_versions()["test_b"] == sample_versions["test_b"]
+
+
+def test_stamp_rejects_unknown_samples_and_actions(backend):
+    with pytest.raises(KeyError):
+        backend.stamp_event("no_such_sample", "start")
+    with pytest.raises(ValueError):
+        backend.stamp_event("test_a", "pause")
+
+
+def test_stamp_events_keeps_the_order(backend):
+    results = backend.stamp_events([("test_a", "start", START), ("test_b", "start", START),
+                                    ("test_a", "start", START)])
+
+    assert [result["rowid"] for result in results] == [1, 1, 2]
+
+
+def test_reschedule_keeps_the_started_intervals(backend, monkeypatch):
+    backend.stamp_event("test_a", "interval", START)
+    monkeypatch.setitem(samples.sag_samples, "test_a", SagSample("test_a", (12, 25, 35, 40), (60, 70, 80, 90)))
+    backend.reschedule_samples(["test_a"])
+
+    sag_df = backend.bulk_export(["test_a"])
+    assert sag_df["interval"].tolist() == [10, 25, 35, 40]
+    assert sag_df["t_start_target"].tolist()[0] == START.strftime(dhf.TIME_FORMAT)
+    assert sag_df["t_start_target"].isna().tolist() == [False, True, True, True]
+
+
+def test_query_page_sorts_and_counts_all_rows(backend):
+    stamp_interval(backend, "test_a", START)
+    stamp_interval(backend, "test_b", START + timedelta(hours=1))
+
+    page_df, total_rows = backend.query_page(["test_a", "test_b"], page_size=4)
+    assert total_rows == 6
+    assert page_df["source"].tolist() == ["planned", "start", "planned", "planned"]
+    assert page_df["sample"].tolist() == ["test_a", "test_a", "test_a", "test_b"]
+
+    page_df, total_rows = backend.query_page(["test_a", "test_b"], sources=["start"], descending=True)
+    assert total_rows == 2
+    assert page_df["sample"].tolist() == ["test_b", "test_a"]
+
+
+def test_completed_samples_and_drop(backend):
+    stamp_interval(backend, "test_b", START)
+    backend.stamp_event("test_b", "end", START + timedelta(minutes=16))
+    stamp_interval(backend, "test_a", START)
+    backend.stamp_event("test_a", "end", START + timedelta(minutes=11))
+
+    assert backend.completed_samples(["test_a", "test_b"]) == ["test_b"]
+
+    version = backend.data_version()
+    backend.drop_samples(["test_b"])
+    assert backend.bulk_export(["test_b"]).empty
+    assert backend.data_version() > version
+
+
+def test_reschedule_keeps_rows_stamped_before_the_interval(backend, monkeypatch):
+    # E.g. the scan watcher recorded a start before the interval was initialized
+    backend.stamp_event("test_a", "start", START)
+    monkeypatch.setitem(samples.sag_samples, "test_a", SagSample("test_a", (12, 25, 35), (60, 70, 80)))
+    backend.reschedule_samples(["test_a"])
+
+    sag_df = backend.bulk_export(["test_a"])
+    assert sag_df["interval"].tolist() == [10, 25, 35]
+    assert sag_df.at[0, "t_start_is"] == START.strftime(dhf.TIME_FORMAT)
+
+
+def test_sqlite_reschedule_keeps_rows_stamped_before_the_interval(monkeypatch, tmp_path):
+    monkeypatch.setattr(dhf, "DB_PATH", str(tmp_path / "scans.sqlite"))
+    monkeypatch.setitem(samples.sag_samples, "test_a", SagSample("test_a", (10, 20, 30), (60, 60, 80)))
+    dhf.create_new_sag_in_db("test_a")
+    dhf.start_next_leaching_interval("test_a", START)
+    dhf.stamp_first_empty("test_a", "t_start_is", START)
+    dhf.stamp_first_empty("test_a", "t_start_is", START)
+    monkeypatch.setitem(samples.sag_samples, "test_a", SagSample("test_a", (12, 25, 35, 40), (60, 70, 80, 90)))
+    dhf.reschedule_sag_sample("test_a")
+
+    sag_df = dhf.get_total_sag_df(["test_a"])
+    assert sag_df["interval"].tolist() == [10, 20, 35, 40]
+    assert sag_df["t_start_is"].notna().tolist() == [True, True, False, False]
+
+
+def test_sharded_campaigns_keep_their_own_data(monkeypatch, tmp_path):
+    monkeypatch.setitem(samples.sag_samples, "test_a", SagSample("test_a", (10, 20), (60, 60)))
+    monkeypatch.setattr(dhf, "ARCHIVE_DIR", str(tmp_path / "archive"))
+    catalog = shards.CampaignCatalog(str(tmp_path / "campaigns.sqlite"), str(tmp_path / "shards"),
+                                     legacy_db_path=str(tmp_path / "scans.sqlite"))
+    backend = ShardedBackend(catalog)
+    backend.seed_samples(["test_a"])
+    backend.stamp_event("test_a", "start", START)
+
+    version = backend.data_version()
+    backend.create_campaign("second")
+    assert backend.data_version() > version
+    # The app seeds its samples on every run, the name is used again in the active campaign
+    backend.seed_samples(["test_a"])
+    sample_version = backend.sample_versions()["test_a"]
+    assert backend.bulk_export()["t_start_is"].isna().all()
+    backend.stamp_event("test_a", "start", START + timedelta(hours=1))
+    # The rows of the earlier campaign are still there
+    sag_df = backend.bulk_export(["test_a"], campaigns=[shards.DEFAULT_CAMPAIGN, "second"])
+    assert sorted(sag_df.dropna(subset=["t_start_is"])["campaign"]) == [shards.DEFAULT_CAMPAIGN, "second"]
+
+    version = backend.data_version()
+    catalog.set_active(shards.DEFAULT_CAMPAIGN)
+    assert backend.data_version() > version
+    backend.seed_samples(["test_a"])
+    assert backend.sample_versions()["test_a"] > sample_version
+    assert backend.bulk_export()["t_start_is"].tolist()[0] == START.strftime(dhf.TIME_FORMAT)
+
+
+def test_catalog_keeps_the_samples_of_an_older_catalog(tmp_path):
+    path = str(tmp_path / "campaigns.sqlite")
+    connection = sqlite3.connect(path)
+    connection.executescript('''
+        CREATE TABLE campaigns (name TEXT PRIMARY KEY, path TEXT NOT NULL, created TEXT NOT NULL,
+                                active INTEGER NOT NULL DEFAULT 0, version INTEGER NOT NULL DEFAULT 0);
+        CREATE TABLE campaign_samples (sample TEXT PRIMARY KEY, campaign TEXT NOT NULL, version INTEGER NOT NULL);
+        INSERT INTO campaigns VALUES ('default', 'scans.sqlite', '2025-01-01', 1, 3);
+        INSERT INTO campaign_samples VALUES ('test_a', 'default', 3);
+    ''')
+    connection.commit()
+    connection.close()
+
+    catalog = shards.CampaignCatalog(path, str(tmp_path / "shards"))
+    assert catalog.sample_versions() == {"test_a": 3}
+    catalog.create_campaign("second")
+    catalog.assign("test_a", "second")
+    assert catalog.campaign_samples() == [("default", "test_a"), ("second", "test_a")]
+    assert catalog.campaign_of("test_a") == "second"
+
+
+@pytest.fixture
+def sqlite_sample(monkeypatch, tmp_path):
+    monkeypatch.setattr(dhf, "DB_PATH", str(tmp_path / "scans.sqlite"))
+    monkeypatch.setattr(dhf, "ARCHIVE_DIR", str(tmp_path / "archive"))
+    monkeypatch.setitem(samples.sag_samples, "test_a", SagSample("test_a", (10, 20, 30), (60, 60, 80)))
+    dhf.create_new_sag_in_db("test_a")
+    return "test_a"
+
+
+def test_sag_pages_cover_every_row_once(sqlite_sample):
+    for i in range(3):
+        dhf.stamp_first_empty(sqlite_sample, "t_start_is", START + timedelta(hours=i))
+        dhf.stamp_first_empty(sqlite_sample, "t_end_is", START + timedelta(hours=i, minutes=30))
+
+    pages = [dhf.get_sag_page([sqlite_sample], page=page, page_size=4) for page in range(3)]
+    assert [len(page_df) for page_df, _ in pages] == [4, 2, 0]
+    assert [total_rows for _, total_rows in pages] == [6, 6, 6]
+    rows = [tuple(row) for page_df, _ in pages for row in page_df[["source", "interval"]].itertuples(index=False)]
+    assert rows == [("start", 10), ("end", 10), ("start", 20), ("end", 20), ("start", 30), ("end", 30)]
+
+    # The same page as the pandas path of the other backends
+    page_df, total_rows = dhf.get_sag_page([sqlite_sample], sources=["end"], page=1, page_size=2)
+    expected_df, expected_rows = page_history(SQLiteBackend().query_history([sqlite_sample]), sources=["end"], page=1,
+                                              page_size=2)
+    assert total_rows == expected_rows == 3
+    assert page_df["interval"].tolist() == expected_df["interval"].tolist() == [30]
+
+
+def test_sag_page_compares_times_in_utc_across_the_dst_change(sqlite_sample):
+    # On 2025-10-26 the clocks go back from 3:00 CEST to 2:00 CET: 2:30 CEST is before 2:10 CET
+    first = datetime(2025, 10, 26, 2, 30, tzinfo=clock.TIMEZONE)
+    second = datetime(2025, 10, 26, 2, 10, tzinfo=clock.TIMEZONE, fold=1)
+    dhf.stamp_first_empty(sqlite_sample, "t_start_is", first)
+    dhf.stamp_first_empty(sqlite_sample, "t_start_is", second)
+
+    page_df, _ = dhf.get_sag_page([sqlite_sample])
+    assert page_df["interval"].tolist() == [10, 20]
+    page_df, _ = dhf.get_sag_page([sqlite_sample], descending=True)
+    assert page_df["interval"].tolist() == [20, 10]
+
+    # 2:00 CET is 1:00 UTC, only the second start is at or after it
+    boundary = datetime(2025, 10, 26, 2, 0, tzinfo=clock.TIMEZONE, fold=1)
+    page_df, total_rows = dhf.get_sag_page([sqlite_sample], start=boundary)
+    assert total_rows == 1
+    assert page_df["timestamp"].tolist() == [second.strftime(dhf.TIME_FORMAT)]
+    page_df, total_rows = dhf.get_sag_page([sqlite_sample], end=boundary)
+    assert total_rows == 1
+    assert page_df["timestamp"].tolist() == [first.strftime(dhf.TIME_FORMAT)]
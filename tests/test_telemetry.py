@@ -0,0 +1,64 @@
+from datetime import datetime, timedelta
+import numpy as np
+import pandas as pd
+import pytest
+import clock
+from telemetry import establish_telemetry_connection, lttb, query_telemetry, write_readings
+
+# Start of an hour, so the buckets of every resolution start with the first reading
+T0_MS = 486111 * 3600 * 1000
+
+
+def test_lttb_keeps_the_endpoints_and_the_peaks():
+    x = np.arange(1000, dtype=np.float64)
+    y = np.sin(x / 50)
+    y[500] = 10
+
+    x_out, y_out = lttb(x, y, 50)
+    assert len(x_out) == len(y_out) == 50
+    assert (x_out[0], y_out[0]) == (x[0], y[0])
+    assert (x_out[-1], y_out[-1]) == (x[-1], y[-1])
+    assert np.all(np.diff(x_out) > 0)
+    assert 10 in y_out
+
+    # Nothing to decimate
+    for n_out in (1000, 2000, 2):
+        x_out, y_out = lttb(x, y, n_out)
+        assert len(x_out) == 1000
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    # 25 readings at 1 Hz with the values 0 to 24, written in two overlapping batches like a re-read csv
+    db_path = str(tmp_path / "telemetry.sqlite")
+    connection = establish_telemetry_connection(db_path)
+    write_readings(connection, [("test_a", T0_MS + i * 1000, float(i)) for i in range(15)])
+    write_readings(connection, [("test_a", T0_MS + i * 1000, float(i)) for i in range(10, 25)])
+    connection.close()
+    return db_path
+
+
+def test_rollups_count_every_reading_once(db_path):
+    connection = establish_telemetry_connection(db_path)
+    rollups = connection.execute("SELECT resolution, bucket, n, min, max, sum FROM telemetry_rollup "
+                                 "ORDER BY resolution, bucket").fetchall()
+    connection.close()
+
+    bucket_10s = T0_MS // 10000
+    assert rollups[:3] == [(10, bucket_10s, 10, 0, 9, 45), (10, bucket_10s + 1, 10, 10, 19, 145),
+                           (10, bucket_10s + 2, 5, 20, 24, 110)]
+    assert rollups[3:] == [(resolution, T0_MS // (resolution * 1000), 25, 0, 24, 300)
+                           for resolution in (60, 600, 3600)]
+
+
+def test_query_reads_raw_values_or_rollup_means(db_path):
+    start = datetime.fromtimestamp(T0_MS / 1000, clock.TIMEZONE)
+
+    raw_df = query_telemetry(["test_a"], start, start + timedelta(seconds=24), max_points=10, db_path=db_path)
+    assert len(raw_df) == 10
+    assert raw_df["value"].iloc[[0, -1]].tolist() == [0, 24]
+
+    # Ten days do not fit in 4 * 2000 points below the 10 minute rollup
+    rollup_df = query_telemetry(["test_a"], start, start + timedelta(days=10), db_path=db_path)
+    assert rollup_df["value"].tolist() == [12]
+    assert rollup_df["timestamp"].tolist() == [pd.Timestamp(start + timedelta(minutes=5))]